@@ -0,0 +1,231 @@
+"""
+Pool of long-lived boto3 sessions and clients, that scheduler shares between its cycles, and registry of accounts.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import json
+import threading
+
+import boto3
+from botocore.config import Config
+from botocore.credentials import DeferredRefreshableCredentials
+from botocore.session import get_session
+
+THROTTLING_ERRORS = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException')
+ACCOUNT_OPTIONS = (
+    'name', 'aws_access_key_id', 'aws_secret_access_key', 'aws_session_token', 'profile_name', 'role_arn',
+    'external_id', 'max_concurrency',
+)
+ROLE_SESSION_NAME = 'aws-instances-status-page'
+
+
+def parse_accounts(text):
+    """
+    Method parses registry of accounts from JSON.
+
+    Every account is an object with unique `name` and either keys (`aws_access_key_id`, `aws_secret_access_key`)
+    or `profile_name`, or `role_arn` (with optional `external_id`) to assume with those or default credentials.
+    `max_concurrency` limits regions of account, that are queried at once.
+
+    Example:
+        [{"name": "prod", "role_arn": "arn:aws:iam::123456789012:role/status-page", "max_concurrency": 4},
+         {"name": "dev", "aws_access_key_id": "...", "aws_secret_access_key": "..."}]
+
+    Returns:
+        List of accounts` options (dict).
+
+    Raises:
+        ValueError: If registry is not a list of accounts with unique names and known options.
+    """
+    accounts = json.loads(text)
+
+    if not isinstance(accounts, list) or not all(isinstance(account, dict) for account in accounts):
+        raise ValueError('Accounts should be a list of objects.')
+
+    names = [account.get('name') for account in accounts]
+    if not all(names) or len(set(names)) != len(names):
+        raise ValueError('Every account should have a unique name.')
+
+    for account in accounts:
+        unknown = set(account) - set(ACCOUNT_OPTIONS)
+        if unknown:
+            raise ValueError('Account {} has unknown options: {}.'.format(account['name'], ', '.join(sorted(unknown))))
+
+    return accounts
+
+
+def assumed_role_session(session, role_arn, external_id=None):
+    """
+    Method builds session, that acts as role, credentials are requested lazily and refreshed before they expire.
+
+    Arguments:
+        session (boto3.session.Session): Session, whose credentials assume role.
+        role_arn (str): ARN of role to assume.
+        external_id (str): External id, that role requires.
+
+    Returns:
+        Session (boto3.session.Session).
+    """
+    sts = session.client('sts')
+    params = {'RoleArn': role_arn, 'RoleSessionName': ROLE_SESSION_NAME}
+    if external_id:
+        params['ExternalId'] = external_id
+
+    def refresh():
+        credentials = sts.assume_role(**params)['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat(),
+        }
+
+    botocore_session = get_session()
+    botocore_session._credentials = DeferredRefreshableCredentials(refresh, 'sts-assume-role')
+
+    return boto3.session.Session(botocore_session=botocore_session)
+
+
+class ClientPool(object):
+    """
+    Pool keeps one boto3 session per account and one client per (account, region, service).
+    Account might also be limited to a number of concurrent jobs, look at `slot`.
+
+    Clients are built once, so botocore service models are loaded and TLS connections are opened only on first
+    use. Every client retries throttled calls with adaptive backoff and reports its calls to pool`s counters.
+
+    Arguments:
+        max_pool_connections (int): Size of connection pool of every client.
+        max_attempts (int): Attempts per call, including the first one.
+        connect_timeout (int): Seconds to wait for connection.
+        read_timeout (int): Seconds to wait for response.
+        endpoint_url (str): URL, that clients call instead of AWS, e.g. a local stand-in, AWS if omitted.
+    """
+
+    def __init__(self, max_pool_connections=10, max_attempts=10, connect_timeout=60, read_timeout=60,
+                 endpoint_url=None):
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries={'mode': 'adaptive', 'max_attempts': max_attempts},
+        )
+        self.endpoint_url = endpoint_url
+        self.lock = threading.Lock()
+        self.credentials = {}
+        self.sessions = {}
+        self.clients = {}
+        self.limits = {}
+        self.slots = {}
+        self.counters = Counter()
+
+    def register_account(self, account, role_arn=None, external_id=None, max_concurrency=None, **credentials):
+        """
+        Method remembers account`s credentials, that its session is built with.
+
+        Arguments:
+            account (str): Account`s name.
+            role_arn (str): ARN of role to assume with credentials.
+            external_id (str): External id, that role requires.
+            max_concurrency (int): Most jobs of account, that might run at once, unlimited if omitted.
+            credentials (dict): Keyword arguments of `boto3.session.Session`, e.g. `aws_access_key_id`.
+        """
+        with self.lock:
+            self.credentials[account] = dict(credentials, role_arn=role_arn, external_id=external_id)
+            self.limits[account] = max_concurrency
+            self.slots[account] = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+            self.sessions.pop(account, None)
+            for key in [key for key in self.clients if key[0] == account]:
+                del self.clients[key]
+
+    def accounts(self):
+        """
+        Method provides names of registered accounts.
+        """
+        with self.lock:
+            return sorted(self.credentials)
+
+    def concurrency(self, account, default=None):
+        """
+        Method provides most jobs of account, that might run at once, `default` if account is not limited.
+        """
+        return self.limits.get(account) or default
+
+    @contextmanager
+    def slot(self, account):
+        """
+        Method waits until account has a free slot for a job and holds it during the job.
+        """
+        slot = self.slots.get(account)
+
+        if slot is None:
+            yield
+            return
+
+        with slot:
+            yield
+
+    def session(self, account):
+        """
+        Method builds account`s session, that assumes account`s role, if it has one. Called under pool`s lock.
+        """
+        credentials = dict(self.credentials.get(account, {}))
+        role_arn, external_id = credentials.pop('role_arn', None), credentials.pop('external_id', None)
+
+        session = boto3.session.Session(**credentials)
+
+        return assumed_role_session(session, role_arn, external_id) if role_arn else session
+
+    def client(self, region, account='default', service='ec2'):
+        """
+        Method provides pooled client, building it on first request.
+
+        Arguments:
+            region (str): Region name.
+            account (str): Name of registered account.
+            service (str): AWS service name.
+
+        Returns:
+            Boto3 client (botocore.client.BaseClient).
+        """
+        key = (account, region, service)
+
+        with self.lock:
+            if key not in self.clients:
+                if account not in self.sessions:
+                    self.sessions[account] = self.session(account)
+
+                client = self.sessions[account].client(
+                    service, region_name=region, endpoint_url=self.endpoint_url, config=self.config
+                )
+                client.meta.events.register('after-call', self.count_call(account, region))
+                self.clients[key] = client
+
+            return self.clients[key]
+
+    def count_call(self, account, region):
+        """
+        Method builds `after-call` event handler, that counts client`s calls, retries and throttles.
+        """
+        def handler(parsed, **kwargs):
+            retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            error_code = parsed.get('Error', {}).get('Code')
+
+            with self.lock:
+                self.counters[(account, region, 'calls')] += 1
+                self.counters[(account, region, 'retries')] += retries
+                if error_code in THROTTLING_ERRORS:
+                    self.counters[(account, region, 'throttles')] += 1
+
+        return handler
+
+    def stats(self):
+        """
+        Method provides snapshot of counters.
+
+        Returns:
+            stats (dict): {('account', 'region', 'calls' | 'retries' | 'throttles'): count, ...}
+        """
+        with self.lock:
+            return dict(self.counters)
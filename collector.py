@@ -0,0 +1,166 @@
+"""
+Collector, that gathers overall information about EC2 instances and their volumes with batched AWS-API calls.
+
+Every region is described with a few paginated `describe_instances` and `describe_volumes` requests, volumes are
+joined to instances in memory, so amount of calls depends on amount of pages, not on amount of instances.
+"""
+
+from collections import defaultdict
+
+
+def describe_instances(client, instances_ids=None):
+    """
+    Method pages through all instances of client`s region.
+
+    Arguments:
+        client (EC2.Client): Boto3 EC2 client bound to a region.
+        instances_ids (list): Instances` ids to describe, all instances of region are described if omitted.
+
+    Returns:
+        Generator of instances` descriptions (dict), as AWS-API returns them.
+    """
+    params = {'InstanceIds': list(instances_ids)} if instances_ids else {}
+
+    for page in client.get_paginator('describe_instances').paginate(**params):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                yield instance
+
+
+def describe_volumes(client, instances_ids=None):
+    """
+    Method pages through all volumes of client`s region and groups them by instance, they are attached to.
+
+    Arguments:
+        client (EC2.Client): Boto3 EC2 client bound to a region.
+        instances_ids (list): Instances` ids to describe volumes for, all volumes of region are described if omitted.
+
+    Returns:
+        volumes_by_instance (dict): {'instance.id': [volume, ...], ...}
+        volume (dict): Volume`s description, as AWS-API returns it.
+    """
+    params = {}
+    if instances_ids:
+        params['Filters'] = [{'Name': 'attachment.instance-id', 'Values': list(instances_ids)}]
+
+    volumes_by_instance = defaultdict(list)
+
+    for page in client.get_paginator('describe_volumes').paginate(**params):
+        for volume in page['Volumes']:
+            for attachment in volume.get('Attachments', []):
+                volumes_by_instance[attachment['InstanceId']].append(volume)
+
+    return volumes_by_instance
+
+
+def instance_name(instance):
+    """
+    Method gets instance`s name from `Name` tag, falls back to first tag or instance`s id.
+    """
+    tags = instance.get('Tags') or []
+
+    for tag in tags:
+        if tag['Key'] == 'Name':
+            return tag['Value']
+
+    return tags[0]['Value'] if tags else instance['InstanceId']
+
+
+def instance_platform(instance):
+    """
+    Method gets instance`s OS and tenancy the way EC2 price catalogs name them.
+
+    Returns:
+        Tuple of OS (str), e.g. `linux` or `mswin`, and tenancy (str), e.g. `shared` or `dedicated`.
+    """
+    os_name = 'mswin' if instance.get('Platform') == 'windows' else 'linux'
+    tenancy = instance.get('Placement', {}).get('Tenancy') or 'default'
+
+    return os_name, 'shared' if tenancy == 'default' else tenancy
+
+
+def instance_record(instance, volumes, region, account=None):
+    """
+    Method flattens instance`s and volumes` descriptions into a record, that scheduler works with.
+
+    Arguments:
+        instance (dict): Instance`s description from `describe_instances`.
+        volumes (list): Descriptions of volumes attached to instance from `describe_volumes`.
+        region (str): Instance`s region.
+        account (str): Name of account, that instance belongs to.
+
+    Returns:
+        record (dict): {'instance_id': ..., 'name': ..., ..., 'volumes': [{'volume_id': ..., ...}, ...]}
+    """
+    security_groups = instance.get('SecurityGroups') or []
+    os_name, tenancy = instance_platform(instance)
+
+    return {
+        'instance_id': instance['InstanceId'],
+        'account': account,
+        'region': region,
+        'name': instance_name(instance),
+        'instance_type': instance['InstanceType'],
+        'os': os_name,
+        'tenancy': tenancy,
+        'state': instance['State']['Name'],
+        'public_ip_address': instance.get('PublicIpAddress'),
+        'private_ip_address': instance.get('PrivateIpAddress'),
+        'vpc_id': instance.get('VpcId'),
+        'security_group': security_groups[0]['GroupId'] if security_groups else None,
+        'launch_time': instance['LaunchTime'],
+        'volumes': [
+            {
+                'volume_id': volume['VolumeId'],
+                'volume_type': volume['VolumeType'],
+                'size': volume['Size'],
+                'iops': volume.get('Iops'),
+            } for volume in volumes
+        ],
+    }
+
+
+def collect_region_batches(client, region, instances_ids=None, account=None, batch_size=500):
+    """
+    Method collects records of instances with their volumes for a single region batch by batch.
+
+    Volumes of region are described first, then records are yielded, while pages of instances are read, so only
+    a single batch of records is held at once.
+
+    Arguments:
+        client (EC2.Client): Boto3 EC2 client bound to the region.
+        region (str): Region name.
+        instances_ids (list): Instances` ids to collect, whole region is collected if omitted.
+        account (str): Name of account, that client belongs to.
+        batch_size (int): Most records per batch.
+
+    Returns:
+        Generator of lists of instances` records (dict), look at `instance_record`.
+    """
+    volumes_by_instance = describe_volumes(client, instances_ids)
+    batch = []
+
+    for instance in describe_instances(client, instances_ids):
+        batch.append(instance_record(instance, volumes_by_instance.get(instance['InstanceId'], []), region, account))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def collect_region(client, region, instances_ids=None, account=None):
+    """
+    Method collects records of instances with their volumes for a single region.
+
+    Arguments:
+        client (EC2.Client): Boto3 EC2 client bound to the region.
+        region (str): Region name.
+        instances_ids (list): Instances` ids to collect, whole region is collected if omitted.
+        account (str): Name of account, that client belongs to.
+
+    Returns:
+        List of instances` records (dict), look at `instance_record`.
+    """
+    return [record for batch in collect_region_batches(client, region, instances_ids, account) for record in batch]
@@ -0,0 +1 @@
+default_app_config = 'ec2.apps.EC2Config'
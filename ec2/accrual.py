@@ -0,0 +1,127 @@
+"""
+Accrual of instances` costs: every refresh adds cost of the interval since previous refresh to running totals.
+"""
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .generation import new_generation
+from .models import Instance, InstanceCostRollup
+from .utils import bulk_update
+
+RUNNING_STATES = ('running',)
+
+
+def sample_cost(state, ec2_cost_by_hour, volumes_cost_by_month, hours):
+    """
+    Method calculates cost of instance and its volumes during hours, EC-2 hours are paid only while running.
+
+    Return:
+        Float value, that equals cost in dollars ($).
+    """
+    ec2_cost = ec2_cost_by_hour if state in RUNNING_STATES else 0
+
+    return hours * (ec2_cost + volumes_cost_by_month / 30 / 24)
+
+
+def month_start(moment=None):
+    """
+    Method provides beginning of month of moment (now if omitted) in current time zone.
+    """
+    moment = timezone.localtime(moment or timezone.now())
+
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def seed(instance_data):
+    """
+    Method starts totals of instance, that is seen for the first time.
+
+    Costs, that are estimated from launch time, become the starting point, so accrual continues from them.
+
+    Returns:
+        Tuple of accrued hours (float) and cost (float), both are zero.
+    """
+    instance_data['cost_before_history'] = instance_data.get('overall_cost_all_time', 0)
+    instance_data['month_cost_before_history'] = instance_data.get('overall_cost_by_month', 0)
+
+    return 0, 0
+
+
+def accrue(instance, instance_data, seen_at, max_gap_hours=1.0):
+    """
+    Method adds cost of interval since previous refresh to instance`s totals.
+
+    Interval is billed with state and prices, that were in effect during it, i.e. the ones stored at previous
+    refresh. Interval is capped by `max_gap_hours`, so downtime of scheduler is not billed. Monthly total starts
+    over with the part of interval, that falls into new month.
+
+    Arguments:
+        instance (Instance): Instance`s row as it was stored at previous refresh.
+        instance_data (dict): Freshly collected `Instance` fields` values, costs` totals are set into it.
+        seen_at (datetime): Date and time of current refresh.
+        max_gap_hours (float): Most hours, that an interval might stand for.
+
+    Returns:
+        Tuple of accrued hours (float) and cost (float).
+    """
+    if instance.datetime_of_last_seen is None:
+        return seed(instance_data)
+
+    elapsed = max((seen_at - instance.datetime_of_last_seen).total_seconds() / 3600, 0)
+    hours = min(elapsed, max_gap_hours)
+    cost = sample_cost(instance.state, instance.ec2_cost_by_hour, instance.volumes_cost_by_month, hours)
+
+    current_month = month_start(seen_at)
+    month_cost_before_history = instance.month_cost_before_history
+    if instance.datetime_of_last_seen >= current_month:
+        month_cost = instance.overall_cost_by_month + cost
+    else:
+        hours_in_month = min((seen_at - current_month).total_seconds() / 3600, hours)
+        month_cost = cost * hours_in_month / hours if hours else 0
+        month_cost_before_history = 0
+
+    instance_data['overall_cost_all_time'] = instance.overall_cost_all_time + cost
+    instance_data['overall_cost_by_month'] = month_cost
+    instance_data['cost_before_history'] = instance.cost_before_history
+    instance_data['month_cost_before_history'] = month_cost_before_history
+
+    return hours, cost
+
+
+def rebuild_totals():
+    """
+    Method recalculates totals of all instances from monthly rollups of history, e.g. after pricing correction,
+    look at `ec2.history.reprice_history`.
+
+    All time total is a sum of cost before history and of all monthly rollups, monthly total is a rollup
+    of current month along with the part of cost before history within it, if instance was seen for the first time
+    in current month. Rollups should be brought up to date beforehand, look at `ec2.history.roll_up_history`.
+
+    Returns:
+        Amount of updated instances (int).
+    """
+    rollups = InstanceCostRollup.objects.filter(period=InstanceCostRollup.MONTH)
+    current_month = month_start()
+
+    all_time_costs = dict(rollups.values_list('instance_id').annotate(total=Sum('cost')))
+    month_costs = dict(rollups.filter(period_start__gte=current_month).values_list('instance_id', 'cost'))
+
+    with transaction.atomic():
+        instances = list(Instance.objects.all())
+
+        for instance in instances:
+            instance.overall_cost_all_time = instance.cost_before_history + all_time_costs.get(instance.instance_id, 0)
+            instance.overall_cost_by_month = month_costs.get(instance.instance_id, 0)
+
+            # Accrual resets part of cost before history, once instance is seen in a new month.
+            last_seen = instance.datetime_of_last_seen
+            if last_seen is not None and last_seen >= current_month:
+                instance.overall_cost_by_month += instance.month_cost_before_history
+
+        bulk_update(instances, ['overall_cost_all_time', 'overall_cost_by_month'])
+
+        new_generation('rebuild')
+
+    return len(instances)
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class EC2Config(AppConfig):
+    """
+    Configuration of EC-2 application, that sets every new SQLite connection up, look at `db.configure_sqlite`.
+    """
+    name = 'ec2'
+
+    def ready(self):
+        from .db import configure_sqlite
+
+        connection_created.connect(configure_sqlite, dispatch_uid='ec2.db.configure_sqlite')
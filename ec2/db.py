@@ -0,0 +1,114 @@
+"""
+Routing of database queries between primary and read replica, snapshots of reads and setup of SQLite connections.
+
+Dashboard`s reads of EC-2 application go to `replica` database, if it is configured, everything else, all writes
+and every query of processes, that write, go to `default` one. SQLite is switched to write-ahead log, so pages are
+read, while clock process writes, and writers wait for each other instead of failing.
+"""
+
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+REPLICA_APPS = ('ec2',)
+# Key of PostgreSQL`s advisory lock of writers of refreshed data.
+WRITE_LOCK_KEY = 0x65633201
+
+routing = {'primary_only': False}
+
+
+def use_primary_only():
+    """
+    Method routes all further queries of process to primary, called by processes, that write, e.g. clock one,
+    so they read their own writes and never read within a transaction from another database.
+    """
+    routing['primary_only'] = True
+
+
+def read_alias():
+    """
+    Method provides alias of database, that dashboard reads from.
+    """
+    if routing['primary_only'] or REPLICA not in settings.DATABASES:
+        return PRIMARY
+
+    return REPLICA
+
+
+class PrimaryReplicaRouter(object):
+    """
+    Router sends reads of `REPLICA_APPS` to `read_alias`, sessions, users and the rest of reads and all writes
+    go to primary, so login is never lost to replication lag. Migrations run on primary only.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_alias() if model._meta.app_label in REPLICA_APPS else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+@contextmanager
+def snapshot():
+    """
+    Method runs reads within a single read-only transaction of `read_alias` database, so all of them see the same
+    committed generation of data, never a part of refresh, that is committed after the first of them.
+
+    SQLite`s transaction reads one snapshot of write-ahead log, PostgreSQL`s one is made repeatable read.
+
+    Returns:
+        Alias of database (str), that is read.
+    """
+    using = read_alias()
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        yield using
+
+
+def lock_writes(using=PRIMARY):
+    """
+    Method takes database`s lock of writers of refreshed data till the end of current transaction, so refreshes,
+    rollups and repricing never interleave their writes, even if they run in different processes.
+
+    PostgreSQL takes a transaction-level advisory lock. SQLite takes its write lock with a write, that changes
+    nothing, so transaction waits for other writers at once instead of failing at its first write after reads.
+    Should be the first query of transaction.
+    """
+    from .models import RefreshGeneration
+
+    connection = connections[using]
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [WRITE_LOCK_KEY])
+        elif connection.vendor == 'sqlite':
+            cursor.execute('UPDATE {0} SET id = id WHERE 0'.format(RefreshGeneration._meta.db_table))
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Receiver of `connection_created` signal, that switches SQLite database file to write-ahead log, in-memory
+    databases of tests are left as they are.
+
+    Busy timeout is set by `timeout` option of database, look at `SQLITE_BUSY_TIMEOUT` setting.
+    """
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db(connection.settings_dict['NAME']):
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
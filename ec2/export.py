@@ -0,0 +1,157 @@
+"""
+Export of instances and their cost history as CSV or NDJSON, that is generated row by row.
+"""
+
+import csv
+from datetime import datetime, time, timedelta
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Instance, InstanceCostRollup, InstanceSample
+from .utils import chunked_values
+
+INSTANCE_FIELDS = (
+    'instance_id', 'name', 'instance_type', 'account', 'region', 'state', 'public_ip_address', 'private_ip_address',
+    'vpc_id', 'security_group', 'volumes', 'ec2_cost_by_hour', 'volumes_cost_by_month', 'overall_cost_by_month',
+    'overall_cost_all_time', 'datetime_of_creation', 'datetime_of_last_seen',
+)
+SAMPLE_FIELDS = (
+    'instance_id', 'timestamp', 'state', 'instance_type', 'ec2_cost_by_hour', 'volumes_cost_by_month', 'hours',
+    'cost',
+)
+ROLLUP_FIELDS = (
+    'instance_id', 'period', 'period_start', 'samples', 'hours', 'running_hours', 'cost', 'max_ec2_cost_by_hour',
+)
+PERIODS = ('sample',) + tuple(period for period, name in InstanceCostRollup.PERIODS)
+
+
+def parse_moment(value, end_of_day=False):
+    """
+    Method parses date or date and time from export`s filter.
+
+    Arguments:
+        value (str): ISO date (`2017-03-01`) or date and time (`2017-03-01T10:00`).
+        end_of_day (bool): Whether a date means the beginning of the next day, used for inclusive upper bounds.
+
+    Returns:
+        Aware date and time (datetime) or None if value is empty.
+
+    Raises:
+        ValueError: If value is neither date nor date and time.
+    """
+    if not value:
+        return None
+
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('Wrong date: {}'.format(value))
+        moment = datetime.combine(day + timedelta(days=1) if end_of_day else day, time())
+
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+
+def filtered_instances(region=None, state=None):
+    """
+    Method filters instances by region and state, if they are given.
+    """
+    instances = Instance.objects.all()
+
+    if region:
+        instances = instances.filter(region=region)
+    if state:
+        instances = instances.filter(state=state)
+
+    return instances
+
+
+def instances_rows(region=None, state=None, since=None, until=None):
+    """
+    Method provides header and rows of instances, launched within date range.
+
+    Arguments:
+        region (str): Region of instances.
+        state (str): State of instances.
+        since (datetime): Earliest date and time of launch.
+        until (datetime): Date and time of launch, that instances were launched before.
+
+    Returns:
+        Tuple of header (tuple) and generator of rows (tuple).
+    """
+    instances = filtered_instances(region, state)
+
+    if since:
+        instances = instances.filter(datetime_of_creation__gte=since)
+    if until:
+        instances = instances.filter(datetime_of_creation__lt=until)
+
+    return INSTANCE_FIELDS, chunked_values(instances, INSTANCE_FIELDS)
+
+
+def history_rows(period='day', region=None, state=None, since=None, until=None):
+    """
+    Method provides header and rows of cost history of instances within date range.
+
+    Arguments:
+        period (str): `sample` for raw samples, `hour`, `day` or `month` for rollups.
+        region (str): Current region of instances.
+        state (str): Current state of instances.
+        since (datetime): Earliest date and time of sample or period`s beginning.
+        until (datetime): Date and time, that samples or periods began before.
+
+    Returns:
+        Tuple of header (tuple) and generator of rows (tuple).
+    """
+    if period == 'sample':
+        history, time_field, fields = InstanceSample.objects.all(), 'timestamp', SAMPLE_FIELDS
+    else:
+        history, time_field = InstanceCostRollup.objects.filter(period=period), 'period_start'
+        fields = ROLLUP_FIELDS
+
+    if region or state:
+        history = history.filter(instance_id__in=filtered_instances(region, state).values('instance_id'))
+    if since:
+        history = history.filter(**{'{}__gte'.format(time_field): since})
+    if until:
+        history = history.filter(**{'{}__lt'.format(time_field): until})
+
+    return fields, chunked_values(history, fields)
+
+
+class Echo(object):
+    """
+    File-like object, that returns written value instead of buffering it, so CSV writer produces lines.
+    """
+
+    def write(self, value):
+        return value
+
+
+def render_csv(header, rows):
+    """
+    Method turns header and rows into CSV lines.
+    """
+    writer = csv.writer(Echo())
+
+    yield writer.writerow(header)
+
+    for row in rows:
+        yield writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+
+
+def render_ndjson(header, rows):
+    """
+    Method turns rows into lines of newline-delimited JSON objects with header as keys.
+    """
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+RENDERERS = {
+    'csv': ('text/csv', render_csv),
+    'ndjson': ('application/x-ndjson', render_ndjson),
+}
@@ -0,0 +1,30 @@
+"""
+Generations of dashboard`s data: every job, that commits visible changes, starts a new one.
+"""
+
+from .models import RefreshGeneration
+
+
+def current_generation():
+    """
+    Method looks current generation up with a single query by primary key.
+
+    Returns:
+        Tuple of generation`s number (int) and date and time of its creation (datetime), (0, None) if none.
+    """
+    latest = RefreshGeneration.objects.order_by('-pk').values_list('pk', 'datetime_of_creation').first()
+
+    return latest or (0, None)
+
+
+def new_generation(source):
+    """
+    Method starts a new generation. Called within job`s transaction, it becomes visible along with job`s changes.
+
+    Arguments:
+        source (str): Name of job, that changed data.
+
+    Returns:
+        New generation (RefreshGeneration).
+    """
+    return RefreshGeneration.objects.create(source=source)
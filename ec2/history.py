@@ -0,0 +1,277 @@
+"""
+History of instances` costs: raw samples, their rollups into hours, days and months, and retention of samples.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Max, Sum, When
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth
+from django.utils import timezone
+
+from .accrual import RUNNING_STATES, month_start, rebuild_totals
+from .generation import new_generation
+from .models import Instance, InstanceCostRollup, InstanceSample
+from .utils import BATCH_SIZE, batches
+
+# Rollups of every period are built from the ones of previous period, hours are built from raw samples.
+ROLLUPS = (
+    (InstanceCostRollup.HOUR, TruncHour, None),
+    (InstanceCostRollup.DAY, TruncDay, InstanceCostRollup.HOUR),
+    (InstanceCostRollup.MONTH, TruncMonth, InstanceCostRollup.DAY),
+)
+
+
+def record_samples(samples, timestamp=None):
+    """
+    Method writes snapshot of every instance into history with a bulk insert.
+
+    Arguments:
+        samples (list): Tuples of `Instance` fields` values (dict), hours since previous snapshot (float) and
+            cost of these hours (float), look at `ec2.accrual.accrue`.
+        timestamp (datetime): Date and time of snapshot, now if omitted.
+
+    Returns:
+        Amount of written samples (int).
+    """
+    timestamp = timestamp or timezone.now()
+
+    InstanceSample.objects.bulk_create([
+        InstanceSample(
+            instance_id=instance_data['instance_id'],
+            timestamp=timestamp,
+            state=instance_data['state'],
+            instance_type=instance_data['instance_type'],
+            os=instance_data.get('os'),
+            tenancy=instance_data.get('tenancy'),
+            ec2_cost_by_hour=instance_data['ec2_cost_by_hour'],
+            volumes_cost_by_month=instance_data['volumes_cost_by_month'],
+            hours=hours,
+            cost=cost,
+        ) for instance_data, hours, cost in samples
+    ], batch_size=BATCH_SIZE)
+
+    return len(samples)
+
+
+def roll_up(period, trunc, source_period=None):
+    """
+    Method aggregates samples or rollups of previous period into rollups of period.
+
+    The latest existing rollup of period might be incomplete, so it and everything after it are recalculated.
+
+    Arguments:
+        period (str): Period to build rollups for, look at `InstanceCostRollup.PERIODS`.
+        trunc (Trunc): Database function, that truncates date and time to period`s beginning.
+        source_period (str): Period of rollups to aggregate, raw samples are aggregated if omitted.
+
+    Returns:
+        Amount of written rollups (int).
+    """
+    since = InstanceCostRollup.objects.filter(period=period).aggregate(since=Max('period_start'))['since']
+
+    if source_period is None:
+        source = InstanceSample.objects.all()
+        time_field = 'timestamp'
+        totals = {
+            'samples_total': Count('id'),
+            'running_hours_total': Sum(
+                Case(When(state__in=RUNNING_STATES, then='hours'), default=0, output_field=FloatField())
+            ),
+            'max_ec2_cost_by_hour_total': Max('ec2_cost_by_hour'),
+        }
+    else:
+        source = InstanceCostRollup.objects.filter(period=source_period)
+        time_field = 'period_start'
+        totals = {
+            'samples_total': Sum('samples'),
+            'running_hours_total': Sum('running_hours'),
+            'max_ec2_cost_by_hour_total': Max('max_ec2_cost_by_hour'),
+        }
+
+    if since is not None:
+        source = source.filter(**{'{}__gte'.format(time_field): since})
+
+    rows = (
+        source
+        .annotate(start=trunc(time_field))
+        .values('instance_id', 'start')
+        .annotate(hours_total=Sum('hours'), cost_total=Sum('cost'), **totals)
+    )
+
+    rollups = [
+        InstanceCostRollup(
+            instance_id=row['instance_id'],
+            period=period,
+            period_start=row['start'],
+            samples=row['samples_total'] or 0,
+            hours=row['hours_total'] or 0,
+            running_hours=row['running_hours_total'] or 0,
+            cost=row['cost_total'] or 0,
+            max_ec2_cost_by_hour=row['max_ec2_cost_by_hour_total'] or 0,
+        ) for row in rows
+    ]
+
+    with transaction.atomic():
+        stale = InstanceCostRollup.objects.filter(period=period)
+        if since is not None:
+            stale = stale.filter(period_start__gte=since)
+        stale.delete()
+
+        for batch in batches(rollups):
+            InstanceCostRollup.objects.bulk_create(batch)
+
+    return len(rollups)
+
+
+def prune_samples(retention_days):
+    """
+    Method deletes raw samples older than retention period, that are already rolled up into hours.
+
+    Arguments:
+        retention_days (int): Days to keep raw samples for.
+
+    Returns:
+        Amount of deleted samples (int).
+    """
+    rolled_up_till = InstanceCostRollup.objects.filter(
+        period=InstanceCostRollup.HOUR
+    ).aggregate(till=Max('period_start'))['till']
+
+    if rolled_up_till is None:
+        return 0
+
+    prune_till = min(rolled_up_till, timezone.now() - timedelta(days=retention_days))
+
+    return InstanceSample.objects.filter(timestamp__lt=prune_till).delete()[0]
+
+
+def roll_up_history(retention_days=31):
+    """
+    Method rolls samples up into hours, days and months, then prunes raw samples out of retention period.
+    Updated rollups become visible together with a new generation of data, in a single transaction.
+
+    Arguments:
+        retention_days (int): Days to keep raw samples for.
+
+    Returns:
+        counts (dict): {'hour': ..., 'day': ..., 'month': ..., 'pruned': ...}
+    """
+    with transaction.atomic():
+        counts = {period: roll_up(period, trunc, source_period) for period, trunc, source_period in ROLLUPS}
+        counts['pruned'] = prune_samples(retention_days)
+
+        new_generation('rollup')
+
+    return counts
+
+
+def reprice_history(price_index):
+    """
+    Method reprices EC-2 hours of history with corrected prices, e.g. after a wrong price catalog was served, and
+    recalculates instances` totals from repriced history.
+
+    Every instance is priced by its region, type, OS and tenancy, that refresh priced it for, look at
+    `PriceIndex.price`. Instances, whose OS is not known yet or whose price is not known, keep their costs and are
+    counted as `skipped`. Cost of every running hour of raw samples is billed with price of type, OS and tenancy
+    of sample, samples taken before OS was kept keep their costs. Cost of running hours of hourly rollups is billed
+    with price of instance, costs of volumes are kept. Daily and monthly rollups are built again from hourly ones,
+    then totals are rebuilt, look at `ec2.accrual.rebuild_totals`. Hourly rollups should be brought up to date
+    beforehand, look at `roll_up_history`.
+
+    Arguments:
+        price_index (PriceIndex): Index of corrected hourly prices.
+
+    Returns:
+        counts (dict): {'instances': ..., 'skipped': ..., 'samples': ..., 'hour': ..., 'day': ..., 'month': ...,
+                        'totals': ...}
+    """
+    regions, instances_by_price, samples_by_price = {}, defaultdict(list), defaultdict(list)
+    counts = {'instances': 0, 'skipped': 0, 'samples': 0, InstanceCostRollup.HOUR: 0}
+
+    for instance_id, region, instance_type, os_name, tenancy in Instance.objects.values_list(
+        'instance_id', 'region', 'instance_type', 'os', 'tenancy'
+    ):
+        regions[instance_id] = region
+        price = price_index.price(region, instance_type, os_name, tenancy) if os_name else None
+
+        if price is None:
+            counts['skipped'] += 1
+        else:
+            instances_by_price[price].append(instance_id)
+
+    for instance_id, instance_type, os_name, tenancy in InstanceSample.objects.filter(os__isnull=False).values_list(
+        'instance_id', 'instance_type', 'os', 'tenancy'
+    ).distinct():
+        if instance_id not in regions:
+            continue
+
+        price = price_index.price(regions[instance_id], instance_type, os_name, tenancy)
+        if price is not None:
+            samples_by_price[(price, instance_type, os_name, tenancy)].append(instance_id)
+
+    with transaction.atomic():
+        for price, instances_ids in instances_by_price.items():
+            for batch in batches(instances_ids):
+                counts['instances'] += Instance.objects.filter(instance_id__in=batch).update(ec2_cost_by_hour=price)
+
+                # Hour holds every sample, that refreshes took within it, a dozen or more with short intervals and
+                # event refreshes, its running hours are repriced from its highest price, that is exact, unless
+                # price of instance changed within the hour.
+                counts[InstanceCostRollup.HOUR] += InstanceCostRollup.objects.filter(
+                    period=InstanceCostRollup.HOUR, instance_id__in=batch
+                ).update(
+                    cost=F('cost') + F('running_hours') * (price - F('max_ec2_cost_by_hour')),
+                    max_ec2_cost_by_hour=price,
+                )
+
+        for (price, instance_type, os_name, tenancy), instances_ids in samples_by_price.items():
+            for batch in batches(instances_ids):
+                samples = InstanceSample.objects.filter(
+                    instance_id__in=batch, instance_type=instance_type, os=os_name, tenancy=tenancy
+                )
+                samples.filter(state__in=RUNNING_STATES).update(
+                    cost=F('cost') + F('hours') * (price - F('ec2_cost_by_hour'))
+                )
+                counts['samples'] += samples.update(ec2_cost_by_hour=price)
+
+        InstanceCostRollup.objects.exclude(period=InstanceCostRollup.HOUR).delete()
+        for period, trunc, source_period in ROLLUPS[1:]:
+            counts[period] = roll_up(period, trunc, source_period)
+
+        counts['totals'] = rebuild_totals()
+
+    return counts
+
+
+def month_to_date_costs():
+    """
+    Method provides costs of instances since beginning of current month from monthly rollups.
+
+    Returns:
+        costs (dict): {'instance_id': cost, ...}
+    """
+    return dict(
+        InstanceCostRollup.objects
+        .filter(period=InstanceCostRollup.MONTH, period_start__gte=month_start())
+        .values_list('instance_id', 'cost')
+    )
+
+
+def daily_costs(instance_id, days=30):
+    """
+    Method provides daily costs of instance for recent days from daily rollups.
+
+    Returns:
+        List of rollups (InstanceCostRollup) ordered from the latest day.
+    """
+    return list(
+        InstanceCostRollup.objects
+        .filter(
+            instance_id=instance_id,
+            period=InstanceCostRollup.DAY,
+            period_start__gte=timezone.now() - timedelta(days=days),
+        )
+        .order_by('-period_start')
+    )
@@ -0,0 +1,152 @@
+"""
+Live updates of dashboard: diffs between generations of data, that are pushed to open pages as Server-Sent Events.
+
+Every open page holds one idle connection, that is served by a greenlet of gevent worker of gunicorn, not by
+a whole worker. Current generation is looked up at most once per `POLL_SECONDS` in every web process no matter
+how many pages are open, diff between two generations is built once and cached.
+"""
+
+import json
+import threading
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from .generation import current_generation
+from .summary import cached, cached_fleet_summary, fleet_summary
+
+LIVE_FIELDS = (
+    'name', 'instance_type', 'state', 'public_ip_address', 'private_ip_address', 'ec2_cost_by_hour',
+    'volumes_cost_by_month', 'overall_cost_by_month', 'overall_cost_all_time',
+)
+STREAM_SECONDS = 5 * 60
+POLL_SECONDS = 2
+KEEPALIVE_SECONDS = 15
+RETRY_MILLISECONDS = 5000
+
+latest = {'generation': None, 'checked_at': 0}
+latest_lock = threading.Lock()
+
+
+def latest_generation(max_age=POLL_SECONDS):
+    """
+    Method provides number of current generation, that was looked up not more than `max_age` seconds ago.
+
+    Returns:
+        Number of generation (int).
+    """
+    with latest_lock:
+        if latest['generation'] is None or time.time() - latest['checked_at'] >= max_age:
+            latest['generation'] = current_generation()[0]
+            latest['checked_at'] = time.time()
+
+        return latest['generation']
+
+
+def summary_values(summary):
+    """
+    Method extracts values, that page shows, from fleet summary.
+
+    Returns:
+        instances (dict): {'instance_id': {'name': ..., ..., 'month_to_date_cost': ...}, ...}
+        totals (dict): {'all_instances_cost': ..., 'all_instances_month_to_date_cost': ...}
+    """
+    instances = {}
+
+    for instance in summary['instances']:
+        values = {field: instance[field] for field in LIVE_FIELDS}
+        values['month_to_date_cost'] = round(summary['month_to_date_costs'].get(instance['instance_id'], 0), 2)
+        instances[instance['instance_id']] = values
+
+    totals = {
+        'all_instances_cost': summary['all_instances_cost'],
+        'all_instances_month_to_date_cost': summary['all_instances_month_to_date_cost'],
+    }
+
+    return instances, totals
+
+
+def build_generation_diff(since, generation):
+    """
+    Method builds diff of values, that page shows, between generations. Diff is built up to a newer generation,
+    if it is committed meanwhile, `generation` of diff tells which one.
+
+    Only changed values of instances are sent. If summary of `since` generation is not cached anymore, every
+    value is sent and diff is marked as reset, so page compares sets of instances itself.
+
+    Returns:
+        diff (dict): {'generation': ..., 'reset': ..., 'instances': ..., 'added': ..., 'removed': ..., 'totals': ...}
+    """
+    summary = fleet_summary(generation)
+    generation = summary['generation']
+    instances, totals = summary_values(summary)
+    previous = cached_fleet_summary(since) if since else None
+
+    if previous is None:
+        return {
+            'generation': generation, 'reset': True, 'instances': instances, 'added': [], 'removed': [],
+            'totals': totals,
+        }
+
+    previous_instances, previous_totals = summary_values(previous)
+    changes = {}
+
+    for instance_id, values in instances.items():
+        previous_values = previous_instances.get(instance_id, {})
+        changed = {field: value for field, value in values.items() if previous_values.get(field) != value}
+        if changed:
+            changes[instance_id] = changed
+
+    return {
+        'generation': generation,
+        'reset': False,
+        'instances': changes,
+        'added': sorted(set(instances) - set(previous_instances)),
+        'removed': sorted(set(previous_instances) - set(instances)),
+        'totals': {key: value for key, value in totals.items() if previous_totals.get(key) != value},
+    }
+
+
+def generation_diff(since, generation):
+    """
+    Method provides diff between generations, built once per process, look at `build_generation_diff`.
+    """
+    return cached('generation-diff:{}'.format(since), generation, lambda: build_generation_diff(since, generation))
+
+
+def generation_events(since, stream_seconds=STREAM_SECONDS, poll_seconds=POLL_SECONDS):
+    """
+    Method streams Server-Sent Events with diffs of new generations since `since` one.
+
+    Stream ends after `stream_seconds`, browser reconnects then with `Last-Event-ID`, that is the last generation,
+    so no diff is lost. Database connection is released between polls, so idle stream does not hold it.
+
+    Arguments:
+        since (int): Number of generation, that page shows.
+        stream_seconds (int): Seconds to keep connection open for.
+        poll_seconds (int): Seconds between lookups of current generation.
+
+    Returns:
+        Generator of events (str).
+    """
+    started = last_sent = time.time()
+
+    yield 'retry: {}\n\n'.format(RETRY_MILLISECONDS)
+
+    while time.time() - started < stream_seconds:
+        generation = latest_generation(poll_seconds)
+
+        if generation != since:
+            diff = generation_diff(since, generation)
+            yield 'id: {}\nevent: generation\ndata: {}\n\n'.format(
+                diff['generation'], json.dumps(diff, cls=DjangoJSONEncoder)
+            )
+            since, last_sent = diff['generation'], time.time()
+        elif time.time() - last_sent >= KEEPALIVE_SECONDS:
+            yield ': keepalive\n\n'
+            last_sent = time.time()
+
+        # Connections are kept for `CONN_MAX_AGE` otherwise, so every open stream would hold its own one.
+        connections.close_all()
+        time.sleep(poll_seconds)
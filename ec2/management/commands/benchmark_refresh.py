@@ -0,0 +1,340 @@
+"""
+Command, that benchmarks refresh of instances and rendering of instance`s page against a local stand-in of AWS.
+"""
+
+import datetime
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from fake_aws import CATALOG_TYPES, PAGE_SIZE, FakeAWS, SyntheticFleet, stand_in
+from price_index import PriceIndex, parse_price_rows
+import refresh
+from ec2.db import use_primary_only
+from ec2.models import Instance
+
+# Amounts of queries and AWS calls do not depend on machine, so any growth is a regression. Seconds and bytes
+# vary from run to run, so only growth beyond tolerance is.
+EXACT_METRICS = ('queries', 'queries_per_render', 'aws_calls')
+MEASURED_METRICS = ('seconds', 'seconds_per_render', 'parse_seconds', 'peak_memory_bytes')
+# Changes of timings shorter than this are noise of scheduling, not regressions.
+NOISE_SECONDS = 0.05
+# Uncached render is a single page, so the fastest of a few is kept.
+COLD_RENDERS = 3
+COMPARED_PARAMETERS = ('regions', 'volumes', 'churn', 'renders', 'page_size', 'catalog_types', 'latency', 'seed')
+# Reports of older commits lack parameters, that were added later, they were run with these values.
+PARAMETERS_DEFAULTS = {'latency': 0.0}
+
+
+def git_commit():
+    """
+    Method provides commit, that tree is at, and whether tree has uncommitted changes.
+
+    Returns:
+        Tuple of commit`s hash (str) and dirtiness (bool), or of None values outside of git repository.
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR).decode().strip()
+        status = subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=settings.BASE_DIR
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+    return commit, bool(status.strip())
+
+
+def measure(function, trace_memory=True):
+    """
+    Method runs function, while wall time, database queries and peak of allocated memory are measured.
+
+    Returns:
+        result: Result of function.
+        metrics (dict): {'seconds': ..., 'queries': ..., 'query_seconds': ..., 'peak_memory_bytes': ...}
+    """
+    if trace_memory:
+        tracemalloc.start()
+
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            result = function()
+            seconds = time.perf_counter() - started
+
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return result, {
+        'seconds': round(seconds, 4),
+        'queries': len(queries),
+        'query_seconds': round(sum(float(query['time']) for query in queries.captured_queries), 4),
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def metrics_of(report):
+    """
+    Method flattens compared metrics of report.
+
+    Returns:
+        metrics (dict): {(instances, 'run', 'metric'): value, ...}
+    """
+    metrics = {}
+
+    for result in report['results']:
+        for run, measured in result['runs'].items():
+            for metric in EXACT_METRICS + MEASURED_METRICS:
+                if measured.get(metric) is not None:
+                    metrics[(result['instances'], run, metric)] = measured[metric]
+
+    return metrics
+
+
+class Command(BaseCommand):
+    """
+    Benchmark refresh and page renders on synthetic fleets, that a local stand-in of EC2 API and price catalog
+    serves, look at `fake_aws`. No AWS credentials are needed and nothing is written into the project`s database:
+    benchmark runs in a throwaway test database.
+
+    For every fleet size three refreshes are measured: `initial` into empty database, `churn` after a share of
+    fleet changed and `unchanged` one right after it, then uncached renders of `ec2:instance` page and
+    further cached ones. Every run records wall time, AWS calls, database queries and peak memory, pricing records
+    size and parse time of price catalog. Report is JSON with commit of tree, so reports of two commits are
+    comparable with `--baseline`.
+
+    Example:
+        python manage.py benchmark_refresh --sizes 10,100,1000,10000 --regions 4 --volumes 2 --output after.json \
+            --baseline before.json
+    """
+    help = 'Benchmark refresh and page renders against a local stand-in of AWS on synthetic fleets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,10000', help='Comma-separated amounts of instances.')
+        parser.add_argument('--regions', type=int, default=4, help='Regions to spread instances across.')
+        parser.add_argument('--volumes', type=int, default=2, help='Volumes attached to every instance.')
+        parser.add_argument('--churn', type=float, default=0.05, help='Share of fleet, that changes between runs.')
+        parser.add_argument('--renders', type=int, default=20, help='Cached renders of instance page to measure.')
+        parser.add_argument('--workers', type=int, help='Regions to query at once, look at `refresh_instances`.')
+        parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Items per page of EC2 API.')
+        parser.add_argument('--catalog-types', type=int, default=CATALOG_TYPES, help='Instance types in catalog.')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds every AWS call waits for answer.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of synthetic fleets.')
+        parser.add_argument('--no-memory', action='store_true', help='Do not trace memory, it slows runs down.')
+        parser.add_argument('--output', help='File to write JSON report into, it is printed if omitted.')
+        parser.add_argument('--baseline', help='JSON report of another commit to compare with.')
+        parser.add_argument(
+            '--tolerance', type=float, default=1.25,
+            help='Most ratio of seconds and memory to baseline, that is not a regression.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size]
+        except ValueError:
+            raise CommandError('--sizes should be comma-separated integers.')
+
+        if not sizes or min(sizes) < 1 or options['regions'] < 1 or options['volumes'] < 0:
+            raise CommandError('--sizes and --regions should be positive, --volumes should not be negative.')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        commit, dirty = git_commit()
+        parameters = {
+            parameter: options[parameter] for parameter in COMPARED_PARAMETERS + ('sizes', 'workers', 'no_memory')
+        }
+        report = {
+            'commit': commit,
+            'dirty': dirty,
+            'started_at': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'parameters': parameters,
+            'results': [],
+        }
+
+        # Only primary is switched to test database, so replica, if there is one, is not read.
+        use_primary_only()
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        try:
+            for size in sizes:
+                self.stderr.write('Benchmarking {} instances...'.format(size))
+                report['results'].append(self.run_size(size, options))
+                call_command('flush', interactive=False, verbosity=0)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        text = json.dumps(report, indent=2, sort_keys=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(text)
+        else:
+            self.stdout.write(text)
+
+        if baseline is not None:
+            self.compare(baseline, report, options['tolerance'])
+
+    def run_size(self, size, options):
+        """
+        Method benchmarks refreshes and renders of a single fleet size.
+
+        Returns:
+            result (dict): {'instances': ..., 'regions': ..., 'volumes_per_instance': ..., 'runs': {'run': ...}}
+        """
+        fleet = SyntheticFleet(size, options['regions'], options['volumes'], options['seed'])
+        runs = {}
+
+        fake_aws = FakeAWS(fleet, options['page_size'], options['catalog_types'], options['latency'])
+        with fake_aws, stand_in(fake_aws):
+            runs['pricing'] = self.measure_pricing(fake_aws.catalog)
+
+            runs['refresh.initial'] = self.measure_refresh(fake_aws, options)
+            fleet.churn(options['churn'])
+            runs['refresh.churn'] = self.measure_refresh(fake_aws, options)
+            runs['refresh.unchanged'] = self.measure_refresh(fake_aws, options)
+
+            runs.update(self.measure_renders(options['renders'], not options['no_memory']))
+
+        return {
+            'instances': size,
+            'regions': len(fleet.regions),
+            'volumes_per_instance': options['volumes'],
+            'runs': runs,
+        }
+
+    def measure_pricing(self, catalog):
+        """
+        Method measures parsing of price catalog into rows and building of index from them.
+        """
+        started = time.perf_counter()
+        rows = parse_price_rows(catalog)
+        parse_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        PriceIndex.from_rows(rows)
+        index_seconds = time.perf_counter() - started
+
+        return {
+            'catalog_bytes': len(catalog.encode('utf-8')),
+            'rows': len(rows),
+            'parse_seconds': round(parse_seconds, 4),
+            'index_seconds': round(index_seconds, 4),
+        }
+
+    def measure_refresh(self, fake_aws, options):
+        """
+        Method measures a full refresh of all regions.
+        """
+        fake_aws.reset_calls()
+
+        counts, metrics = measure(
+            lambda: refresh.refresh_instances_info(workers=options['workers']), not options['no_memory']
+        )
+        calls = fake_aws.reset_calls()
+
+        metrics['stages'] = {stage: round(seconds, 4) for stage, seconds in counts.pop('timings').items()}
+        metrics['counts'] = counts
+        metrics['aws_calls'] = sum(calls.values())
+        metrics['aws_calls_by_action'] = calls
+
+        return metrics
+
+    def measure_renders(self, renders, trace_memory):
+        """
+        Method measures renders of `ec2:instance` page: uncached ones, that build fleet summary, and the ones,
+        that are served from cache of current generation.
+
+        Static files are served by plain storage, so renders do not depend on whether `collectstatic` was run.
+        """
+        client = Client()
+        client.force_login(
+            get_user_model().objects.create_user('benchmark'), backend='django.contrib.auth.backends.ModelBackend'
+        )
+        instances_ids = list(
+            Instance.objects.order_by('instance_id').values_list('instance_id', flat=True)[:renders + 1]
+        )
+
+        def render(instance_id):
+            response = client.get(reverse('ec2:instance', args=[instance_id]))
+            if response.status_code != 200:
+                raise CommandError('Page of {} answered {}.'.format(instance_id, response.status_code))
+            return len(response.content)
+
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            colds = []
+            for attempt in range(COLD_RENDERS):
+                cache.clear()
+                colds.append(measure(lambda: render(instances_ids[0]), trace_memory))
+
+            page_bytes, cold = min(colds, key=lambda measured: measured[1]['seconds'])
+            cold['page_bytes'] = page_bytes
+
+            warm_ids = instances_ids[1:] or instances_ids
+            pages_bytes, warm = measure(lambda: [render(instance_id) for instance_id in warm_ids], trace_memory)
+
+        return {
+            'render.cold': cold,
+            'render.warm': {
+                'renders': len(warm_ids),
+                'seconds_per_render': round(warm['seconds'] / len(warm_ids), 4),
+                'queries_per_render': warm['queries'] / len(warm_ids),
+                'peak_memory_bytes': warm['peak_memory_bytes'],
+                'page_bytes': max(pages_bytes),
+            },
+        }
+
+    def compare(self, baseline, report, tolerance):
+        """
+        Method prints changes of metrics against baseline report.
+
+        Raises:
+            CommandError: If reports were run with different parameters or any metric regressed.
+        """
+        for parameter in COMPARED_PARAMETERS:
+            baseline_value = baseline['parameters'].get(parameter, PARAMETERS_DEFAULTS.get(parameter))
+            if baseline_value != report['parameters'][parameter]:
+                raise CommandError('Baseline was run with other --{}.'.format(parameter.replace('_', '-')))
+
+        self.stdout.write('Compared with {} ({}):'.format(baseline.get('commit'), baseline.get('started_at')))
+
+        before, after = metrics_of(baseline), metrics_of(report)
+        regressions = []
+
+        for key in sorted(set(before) & set(after)):
+            instances, run, metric = key
+            ratio = after[key] / before[key] if before[key] else (1.0 if after[key] == before[key] else float('inf'))
+            if metric in EXACT_METRICS:
+                regressed = after[key] > before[key]
+            else:
+                regressed = ratio > tolerance and not ('seconds' in metric and after[key] - before[key] < NOISE_SECONDS)
+
+            line = '{:>8} {:<18} {:<20} {:>14} -> {:<14} {:.2f}x'.format(
+                instances, run, metric, before[key], after[key], ratio
+            )
+            self.stdout.write(line + (' REGRESSION' if regressed else ''))
+
+            if regressed:
+                regressions.append(line)
+
+        if regressions:
+            raise CommandError('{} metrics regressed against baseline.'.format(len(regressions)))
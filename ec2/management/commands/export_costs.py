@@ -0,0 +1,52 @@
+"""
+Command, that exports instances or their cost history as CSV or NDJSON.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ec2.export import PERIODS, RENDERERS, history_rows, instances_rows, parse_moment
+
+
+class Command(BaseCommand):
+    """
+    Export instances or their cost history row by row into standard output or a file.
+
+    Example:
+        python manage.py export_costs history --format csv --period day --since 2017-03-01 --until 2017-03-31
+    """
+    help = 'Export instances or their cost history as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=('instances', 'history'))
+        parser.add_argument('--format', dest='export_format', choices=sorted(RENDERERS), default='csv')
+        parser.add_argument('--period', choices=PERIODS, default='day', help='Period of history.')
+        parser.add_argument('--region', help='Region of instances.')
+        parser.add_argument('--state', help='State of instances.')
+        parser.add_argument('--since', help='Earliest date (inclusive).')
+        parser.add_argument('--until', help='Latest date (inclusive).')
+        parser.add_argument('--output', help='File to write into, standard output if omitted.')
+
+    def handle(self, *args, **options):
+        try:
+            filters = {
+                'region': options['region'],
+                'state': options['state'],
+                'since': parse_moment(options['since']),
+                'until': parse_moment(options['until'], end_of_day=True),
+            }
+        except ValueError as error:
+            raise CommandError(error)
+
+        if options['kind'] == 'history':
+            header, rows = history_rows(options['period'], **filters)
+        else:
+            header, rows = instances_rows(**filters)
+
+        content_type, render = RENDERERS[options['export_format']]
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(render(header, rows))
+        else:
+            for line in render(header, rows):
+                self.stdout.write(line, ending='')
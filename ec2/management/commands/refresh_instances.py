@@ -0,0 +1,74 @@
+"""
+Command, that runs a single refresh of instances on demand.
+"""
+
+import cProfile
+import io
+import json
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+import refresh
+from ec2.db import use_primary_only
+from ec2.models import Instance
+
+
+class Command(BaseCommand):
+    """
+    Run the same refresh, that clock process runs, once, optionally limited, dry or profiled.
+
+    Example:
+        python manage.py refresh_instances --regions us-east-1,eu-west-1 --dry-run --profile refresh.prof
+    """
+    help = 'Refresh instances once with the same collection and persistence as clock process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', help='Comma-separated regions to refresh, all regions if omitted.')
+        parser.add_argument(
+            '--instance', action='append', dest='instances', default=[],
+            help='Id of instance to refresh, might be repeated, region is looked up if --regions is omitted.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Collect and show changes without writing them.')
+        parser.add_argument('--workers', type=int, help='Regions of every account to query at once.')
+        parser.add_argument('--profile', help='File to dump cProfile statistics into.')
+
+    def handle(self, *args, **options):
+        use_primary_only()
+
+        regions = [region for region in (options['regions'] or '').split(',') if region] or None
+        instances_ids = options['instances'] or None
+
+        if instances_ids and regions is None:
+            regions = sorted(set(
+                Instance.objects.filter(instance_id__in=instances_ids).values_list('region', flat=True)
+            ) - {None})
+            if not regions:
+                raise CommandError('Regions of instances are unknown, pass --regions.')
+
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers should be positive.')
+
+        profiler = cProfile.Profile() if options['profile'] else None
+        if profiler:
+            profiler.enable()
+
+        counts = refresh.refresh_instances_info(
+            regions, instances_ids, workers=options['workers'], dry_run=options['dry_run']
+        )
+
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(options['profile'])
+            stats = io.StringIO()
+            pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(20)
+            self.stdout.write(stats.getvalue())
+
+        timings = counts.pop('timings')
+        for stage in refresh.STAGES:
+            self.stdout.write('{:<8} {:.3f}s'.format(stage, timings[stage]))
+
+        self.stdout.write(json.dumps(counts, indent=2, sort_keys=True))
+
+        if options['dry_run']:
+            self.stdout.write('Dry run, nothing is written.')
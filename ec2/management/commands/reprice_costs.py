@@ -0,0 +1,43 @@
+"""
+Command, that reprices history and totals of instances with current price catalogs, e.g. after a pricing fix.
+"""
+
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import refresh
+from ec2.db import use_primary_only
+from ec2.history import reprice_history, roll_up_history
+
+
+class Command(BaseCommand):
+    """
+    Bill running hours of history again with prices of `PRICE_URLS` catalogs and rebuild totals from them.
+
+    Example:
+        python manage.py reprice_costs --dry-run
+    """
+    help = 'Reprice running hours of cost history with current price catalogs and rebuild totals of instances.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Show amounts of repriced rows without writing.')
+
+    def handle(self, *args, **options):
+        use_primary_only()
+        price_index = refresh.get_current_ec2_prices()
+
+        # Clock process waits for repricing, so no accrual is committed between rollup and rebuild of totals.
+        with refresh.persisting():
+            # Samples, that are not rolled up yet, would be rolled up later with old costs otherwise.
+            counts = {'rollup': roll_up_history(retention_days=refresh.HISTORY_RETENTION_DAYS)}
+            counts.update(reprice_history(price_index))
+
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps(counts, indent=2, sort_keys=True))
+
+        if options['dry_run']:
+            self.stdout.write('Dry run, nothing is written.')
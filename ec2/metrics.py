@@ -0,0 +1,401 @@
+"""
+Metrics of clock and web processes in Prometheus text format.
+
+Clock process publishes stats of the last run of every job and its counters of AWS calls and price catalogs into
+`ClockStats` rows, look at `ClockJobsListener`. Web process keeps latency and queries of its views in memory,
+look at `ViewMetricsMiddleware`, and serves both at `ec2:metrics`. Every web process reports its own views, so
+they are told apart by the scraped target, not by a label of their own.
+"""
+
+import json
+import threading
+import time
+
+from django.db import connections
+from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
+
+from .generation import current_generation
+from .models import ClockStats
+
+CLOCK_KEY = 'clock'
+JOB_KEY_PREFIX = 'job:'
+ROW_COUNTS = ('inserted', 'updated', 'deleted', 'unchanged', 'changed', 'skipped', 'samples')
+AWS_COUNTERS = ('calls', 'retries', 'throttles')
+PRICE_COUNTERS = ('requests', 'downloads', 'not_modified', 'failures', 'download_seconds', 'parse_seconds')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def publish_clock_stats(key, stats):
+    """
+    Method writes stats for web process to serve, replacing the previous ones of the same key.
+
+    Arguments:
+        key (str): Name of stats, look at `ClockStats`.
+        stats (dict): JSON-serializable stats.
+    """
+    ClockStats.objects.update_or_create(
+        key=key, defaults={'stats': json.dumps(stats, sort_keys=True), 'datetime_of_update': timezone.now()}
+    )
+
+
+def clock_stats():
+    """
+    Method reads all published stats with a single query.
+
+    Returns:
+        stats (dict): {'key': stats, ...}
+    """
+    return {key: json.loads(stats) for key, stats in ClockStats.objects.values_list('key', 'stats')}
+
+
+class ClockJobsListener(object):
+    """
+    Listener of executed and failed jobs of APScheduler`s scheduler, that publishes stats of the last run of every
+    job, look at `job_stats`, and counters of clock process.
+
+    Jobs, that return nothing and did not fail, e.g. polling of refresh requests, are counted, but not published.
+
+    Arguments:
+        counters (callable): Function, that provides counters of clock process, look at `refresh.clock_stats`.
+    """
+
+    def __init__(self, counters=None):
+        self.counters = counters
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.failures = {}
+        self.succeeded_at = {}
+
+    def __call__(self, event):
+        succeeded = event.exception is None
+
+        with self.lock:
+            self.runs[event.job_id] = self.runs.get(event.job_id, 0) + 1
+            self.failures[event.job_id] = self.failures.get(event.job_id, 0) + (not succeeded)
+            if succeeded:
+                self.succeeded_at[event.job_id] = time.time()
+
+        if succeeded and not isinstance(event.retval, dict):
+            return
+
+        publish_clock_stats(JOB_KEY_PREFIX + event.job_id, self.job_stats(event))
+        if self.counters is not None:
+            publish_clock_stats(CLOCK_KEY, dict(self.counters(), published_at=time.time()))
+
+    def job_stats(self, event):
+        """
+        Method builds stats of job`s run from its event.
+
+        Returns:
+            stats (dict): {'job': ..., 'succeeded': ..., 'runs': ..., 'failures': ..., 'finished_at': ...,
+                           'succeeded_at': ..., 'scheduled_at': ..., 'error': ..., 'rows': ..., 'timings': ...,
+                           'regions': ..., 'interval_seconds': ..., 'lag_seconds': ...}
+        """
+        retval = event.retval if isinstance(event.retval, dict) else {}
+
+        with self.lock:
+            stats = {
+                'job': event.job_id,
+                'succeeded': event.exception is None,
+                'runs': self.runs[event.job_id],
+                'failures': self.failures[event.job_id],
+                'finished_at': time.time(),
+                'succeeded_at': self.succeeded_at.get(event.job_id),
+            }
+
+        stats.update({
+            'scheduled_at': event.scheduled_run_time.timestamp() if event.scheduled_run_time else None,
+            'error': repr(event.exception) if event.exception is not None else None,
+            'rows': {count: retval[count] for count in ROW_COUNTS if isinstance(retval.get(count), int)},
+            'timings': retval.get('timings', {}),
+            'regions': retval.get('regions', []),
+            'interval_seconds': retval.get('interval_seconds'),
+            'lag_seconds': retval.get('lag_seconds'),
+        })
+
+        return stats
+
+
+view_stats = {}
+view_stats_lock = threading.Lock()
+
+
+def record_view(view, method, status, seconds, queries):
+    """
+    Method adds a handled request to latency histogram and queries of its view.
+
+    Arguments:
+        view (str): Name of view, e.g. `ec2:instance`.
+        method (str): HTTP method of request.
+        status (int): HTTP status of response.
+        seconds (float): Seconds, that handling took.
+        queries (int): Database queries, that handling made.
+    """
+    key = (view, method if method in METHODS else 'other', str(status))
+
+    with view_stats_lock:
+        stats = view_stats.setdefault(key, {
+            'count': 0, 'seconds': 0.0, 'queries': 0, 'buckets': [0] * len(LATENCY_BUCKETS),
+        })
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['queries'] += queries
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                stats['buckets'][index] += 1
+
+
+class CountingCursor(object):
+    """
+    Cursor wrapper, that counts statements executed on its connection, look at `start_counting`.
+    """
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+    def execute(self, sql, params=None):
+        self.connection.metrics_queries += 1
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.connection.metrics_queries += 1
+        return self.cursor.executemany(sql, param_list)
+
+
+def start_counting(connection):
+    """
+    Method makes new cursors of connection count executed statements into its `metrics_queries` attribute, until
+    `stop_counting` is called.
+
+    Cursor factories are only replaced on the connection itself, that belongs to the current thread, and counting
+    neither formats SQL nor keeps it, unlike debug cursors, so it is cheap enough for every request.
+    """
+    connection.metrics_queries = 0
+
+    if 'make_cursor' in vars(connection):
+        return
+
+    for name in ('make_cursor', 'make_debug_cursor'):
+        make = getattr(connection, name)
+        setattr(connection, name, lambda cursor, make=make: CountingCursor(make(cursor), connection))
+
+
+def stop_counting(connection):
+    """
+    Method restores cursor factories of connection, look at `start_counting`.
+
+    Returns:
+        Statements (int), that were counted, 0 if connection was not counting.
+    """
+    for name in ('make_cursor', 'make_debug_cursor'):
+        vars(connection).pop(name, None)
+
+    return vars(connection).pop('metrics_queries', 0)
+
+
+class ViewMetricsMiddleware(MiddlewareMixin):
+    """
+    Middleware measures latency and database queries of every request by its view, look at `record_view`.
+
+    Queries are counted on all databases while request is handled, look at `start_counting`. Queries of streamed
+    responses, that are made after view returned, are not counted.
+    """
+
+    def process_request(self, request):
+        for connection in connections.all():
+            start_counting(connection)
+        request.metrics_started = time.time()
+
+    def process_response(self, request, response):
+        started = getattr(request, 'metrics_started', None)
+        if started is None:
+            return response
+
+        queries = sum(stop_counting(connection) for connection in connections.all())
+
+        resolver_match = getattr(request, 'resolver_match', None)
+
+        record_view(
+            resolver_match.view_name if resolver_match else 'unresolved',
+            request.method,
+            response.status_code,
+            time.time() - started,
+            queries,
+        )
+
+        return response
+
+
+def escape_label(value):
+    """
+    Method escapes value of label the way Prometheus text format requires.
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def exposition(families):
+    """
+    Method renders metrics in Prometheus text format.
+
+    Arguments:
+        families (list): Tuples of name (str), type (str), help (str) and samples (list) of metric, every sample
+            is a tuple of suffix of name (str), labels (dict) and value (float).
+
+    Returns:
+        Text (str) of metrics.
+    """
+    lines = []
+
+    for name, kind, help_text, samples in families:
+        if not samples:
+            continue
+
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+
+        for suffix, labels, value in samples:
+            labels_text = ','.join(
+                '{}="{}"'.format(label, escape_label(labels[label])) for label in sorted(labels)
+            )
+            lines.append('{}{}{} {}'.format(name, suffix, '{' + labels_text + '}' if labels else '', float(value)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def view_families():
+    """
+    Method builds metrics of views of current process.
+    """
+    latency, queries = [], []
+
+    with view_stats_lock:
+        for (view, method, status), stats in sorted(view_stats.items()):
+            labels = {'view': view, 'method': method, 'status': status}
+
+            for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+                latency.append(('_bucket', dict(labels, le=str(bound)), count))
+            latency.append(('_bucket', dict(labels, le='+Inf'), stats['count']))
+            latency.append(('_sum', labels, stats['seconds']))
+            latency.append(('_count', labels, stats['count']))
+
+            queries.append(('', labels, stats['queries']))
+
+    return [
+        ('ec2_view_request_seconds', 'histogram', 'Latency of requests by view.', latency),
+        ('ec2_view_queries_total', 'counter', 'Database queries of requests by view.', queries),
+    ]
+
+
+def job_families(jobs):
+    """
+    Method builds metrics of the last runs of clock`s jobs.
+
+    Arguments:
+        jobs (list): Stats of jobs, look at `ClockJobsListener.job_stats`.
+    """
+    families = {
+        name: (kind, help_text, []) for name, kind, help_text in (
+            ('ec2_clock_job_runs_total', 'counter', 'Runs of job since clock process started.'),
+            ('ec2_clock_job_failures_total', 'counter', 'Failed runs of job since clock process started.'),
+            ('ec2_clock_job_last_success', 'gauge', 'Whether the last run of job succeeded.'),
+            ('ec2_clock_job_last_finish_timestamp_seconds', 'gauge', 'Time, when the last run of job finished.'),
+            ('ec2_clock_job_last_success_timestamp_seconds', 'gauge', 'Time, when job succeeded the last time.'),
+            ('ec2_clock_job_interval_seconds', 'gauge', 'Interval, that job refreshed region with.'),
+            ('ec2_clock_job_lag_seconds', 'gauge', 'How much later than its scheduled time the last run started.'),
+            ('ec2_clock_job_stage_seconds', 'gauge', 'Seconds, that every stage of the last refresh took.'),
+            ('ec2_clock_job_rows', 'gauge', 'Rows, that the last refresh wrote, by change.'),
+            ('ec2_clock_job_region_seconds', 'gauge', 'Seconds, that the last refresh collected region for.'),
+            ('ec2_clock_job_region_instances', 'gauge', 'Instances, that the last refresh collected in region.'),
+        )
+    }
+
+    def add(name, labels, value):
+        if value is not None:
+            families[name][2].append(('', labels, value))
+
+    for stats in jobs:
+        labels = {'job': stats['job']}
+
+        add('ec2_clock_job_runs_total', labels, stats['runs'])
+        add('ec2_clock_job_failures_total', labels, stats['failures'])
+        add('ec2_clock_job_last_success', labels, int(stats['succeeded']))
+        add('ec2_clock_job_last_finish_timestamp_seconds', labels, stats['finished_at'])
+        add('ec2_clock_job_last_success_timestamp_seconds', labels, stats['succeeded_at'])
+        add('ec2_clock_job_interval_seconds', labels, stats['interval_seconds'])
+        add('ec2_clock_job_lag_seconds', labels, stats['lag_seconds'])
+
+        for stage, seconds in sorted(stats['timings'].items()):
+            add('ec2_clock_job_stage_seconds', dict(labels, stage=stage), seconds)
+        for change, rows in sorted(stats['rows'].items()):
+            add('ec2_clock_job_rows', dict(labels, change=change), rows)
+        for scope in stats['regions']:
+            scope_labels = dict(labels, account=scope['account'], region=scope['region'])
+            add('ec2_clock_job_region_seconds', scope_labels, scope['seconds'])
+            add('ec2_clock_job_region_instances', scope_labels, scope['instances'])
+
+    return [(name, kind, help_text, samples) for name, (kind, help_text, samples) in sorted(families.items())]
+
+
+def counter_families(counters):
+    """
+    Method builds metrics of AWS calls and price catalogs of clock process.
+
+    Arguments:
+        counters (dict): Counters of clock process, look at `refresh.clock_stats`.
+    """
+    families = []
+
+    for counter in AWS_COUNTERS:
+        families.append((
+            'ec2_aws_{}_total'.format(counter), 'counter', 'AWS-API {} by account and region.'.format(counter), [
+                ('', {'account': scope['account'], 'region': scope['region']}, scope.get(counter, 0))
+                for scope in counters.get('aws', [])
+            ]
+        ))
+
+    for counter in PRICE_COUNTERS:
+        families.append((
+            'ec2_price_catalog_{}_total'.format(counter), 'counter',
+            'Price catalog {} by URL.'.format(counter.replace('_', ' ')), [
+                ('', {'url': price_catalog['url']}, price_catalog.get(counter, 0))
+                for price_catalog in counters.get('prices', [])
+            ]
+        ))
+
+    families.append((
+        'ec2_clock_last_publish_timestamp_seconds', 'gauge', 'Time, when clock process published stats the last time.',
+        [('', {}, counters['published_at'])] if 'published_at' in counters else [],
+    ))
+
+    return families
+
+
+def render_metrics():
+    """
+    Method renders all metrics of clock and of current web process in Prometheus text format.
+    """
+    stats = clock_stats()
+    jobs = [job_stats for key, job_stats in sorted(stats.items()) if key.startswith(JOB_KEY_PREFIX)]
+
+    families = view_families() + job_families(jobs) + counter_families(stats.get(CLOCK_KEY, {}))
+    families.append(('ec2_generation', 'gauge', 'Number of current generation of data.', [
+        ('', {}, current_generation()[0])
+    ]))
+
+    return exposition(families)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:28
+from __future__ import unicode_literals
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Instance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=250)),
+                ('instance_id', models.CharField(max_length=250)),
+                ('instance_type', models.CharField(max_length=250)),
+                ('state', models.CharField(max_length=250)),
+                ('public_ip_address', models.CharField(max_length=250, null=True)),
+                ('private_ip_address', models.CharField(max_length=250, null=True)),
+                ('vpc_id', models.CharField(max_length=250, null=True)),
+                ('security_group', models.CharField(max_length=250, null=True)),
+                ('volumes', models.CharField(max_length=250, null=True)),
+                ('ec2_cost_by_hour', models.FloatField(default=0)),
+                ('volumes_cost_by_month', models.FloatField(default=0)),
+                ('overall_cost_by_month', models.FloatField(default=0)),
+                ('overall_cost_all_time', models.FloatField(default=0)),
+                ('datetime_of_creation', models.DateTimeField(blank=True, null=True)),
+                ('datetime_of_current_ec2_info', models.DateTimeField(blank=True, default=datetime.datetime.now, null=True)),
+            ],
+        ),
+    ]
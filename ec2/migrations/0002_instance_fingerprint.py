@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='datetime_of_last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='instance',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
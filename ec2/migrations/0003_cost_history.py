@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0002_instance_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstanceCostRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.CharField(max_length=250)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateTimeField()),
+                ('samples', models.IntegerField(default=0)),
+                ('hours', models.FloatField(default=0)),
+                ('running_hours', models.FloatField(default=0)),
+                ('cost', models.FloatField(default=0)),
+                ('max_ec2_cost_by_hour', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InstanceSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.CharField(max_length=250)),
+                ('timestamp', models.DateTimeField()),
+                ('state', models.CharField(max_length=250)),
+                ('instance_type', models.CharField(max_length=250)),
+                ('ec2_cost_by_hour', models.FloatField(default=0)),
+                ('volumes_cost_by_month', models.FloatField(default=0)),
+                ('hours', models.FloatField(default=0)),
+                ('cost', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='instancesample',
+            index_together=set([('instance_id', 'timestamp')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='instancecostrollup',
+            unique_together=set([('period', 'period_start', 'instance_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='instancecostrollup',
+            index_together=set([('instance_id', 'period', 'period_start')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0003_cost_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='cost_before_history',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0004_instance_cost_before_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50)),
+                ('datetime_of_creation', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
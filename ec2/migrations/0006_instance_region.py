@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0005_refresh_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='region',
+            field=models.CharField(max_length=250, null=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_duplicate_instances(apps, schema_editor):
+    """
+    Keep the latest row of every instance id, so unique index might be built.
+
+    Nothing refers to deleted rows: volumes are attached to instances only later in this migration, history refers
+    to instance id, not to row.
+    """
+    Instance = apps.get_model('ec2', 'Instance')
+
+    duplicates = (
+        Instance.objects.values('instance_id').annotate(last_pk=models.Max('pk'), rows=models.Count('pk'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        Instance.objects.filter(instance_id=duplicate['instance_id'], pk__lt=duplicate['last_pk']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0006_instance_region'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Volume',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('volume_id', models.CharField(max_length=250, unique=True)),
+                ('volume_type', models.CharField(db_index=True, max_length=50)),
+                ('size', models.IntegerField(db_index=True, default=0)),
+                ('iops', models.IntegerField(blank=True, null=True)),
+                ('cost_by_month', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.RunPython(delete_duplicate_instances, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='instance',
+            name='instance_id',
+            field=models.CharField(max_length=250, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='instance',
+            name='instance_type',
+            field=models.CharField(db_index=True, max_length=250),
+        ),
+        migrations.AlterField(
+            model_name='instance',
+            name='region',
+            field=models.CharField(db_index=True, max_length=250, null=True),
+        ),
+        migrations.AlterField(
+            model_name='instance',
+            name='state',
+            field=models.CharField(db_index=True, max_length=250),
+        ),
+        migrations.AlterField(
+            model_name='instance',
+            name='volumes',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='volume',
+            name='instance',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='volume_set', to='ec2.Instance'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0007_volume_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(blank=True, max_length=250, null=True)),
+                ('instance_id', models.CharField(blank=True, max_length=250, null=True)),
+                ('datetime_of_creation', models.DateTimeField(default=django.utils.timezone.now)),
+                ('datetime_of_handling', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_default_account(apps, schema_editor):
+    """
+    Instances, that were collected before accounts were introduced, belong to the single `default` account.
+    """
+    apps.get_model('ec2', 'Instance').objects.filter(account__isnull=True).update(account='default')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0008_refresh_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='account',
+            field=models.CharField(db_index=True, max_length=250, null=True),
+        ),
+        migrations.RunPython(set_default_account, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 00:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0009_instance_account'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClockStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=250, unique=True)),
+                ('stats', models.TextField(default='{}')),
+                ('datetime_of_update', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
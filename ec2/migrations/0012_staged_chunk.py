@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 01:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0011_instance_current_info_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StagedChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('refresh', models.CharField(db_index=True, max_length=32)),
+                ('data', models.TextField()),
+                ('datetime_of_creation', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
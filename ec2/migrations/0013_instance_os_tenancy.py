@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 01:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0012_staged_chunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='os',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='instance',
+            name='tenancy',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='instancesample',
+            name='os',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='instancesample',
+            name='tenancy',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+    ]
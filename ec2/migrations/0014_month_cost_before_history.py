@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 01:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ec2', '0013_instance_os_tenancy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='month_cost_before_history',
+            field=models.FloatField(default=0),
+        ),
+    ]
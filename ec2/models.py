@@ -2,9 +2,8 @@
 Models for EC-2 Instances.
 """
 
-from datetime import datetime
-
 from django.db import models
+from django.utils import timezone
 
 
 class Instance(models.Model):
@@ -14,41 +13,240 @@ class Instance(models.Model):
     `name` is a name of instance.
     `instance_id` is an id of instance.
     `instance_type` is a type of instance.
+    `os` is an OS of instance as price catalogs name it, e.g. `linux` or `mswin`, empty if not known yet.
+    `tenancy` is a tenancy of instance as price catalogs name it, e.g. `shared` or `dedicated`.
+    `account` is a name of AWS-account, that instance belongs to.
+    `region` is a region of instance.
     `state` is a state of instance.
     `public_ip_address` is public IP address type of instance.
     `private_ip_address` is private IP address type of instance.
     `vpc_id` is a VPC id of instance.
     `security_group` is a security group of instance.
-    `volumes` is a list of volumes, that instance contains.
+    `volumes` is a comma-separated list of ids of volumes, that instance contains, for display only.
 
     `ec2_cost_by_hour` is an EC-2 instance`s cost by hour.
     `volumes_cost_by_month` is an instance`s volumes cost by month.
     `overall_cost_by_month` is a total cost of volumes and EC-2 instance for current month.
     `overall_cost_all_time` is a sum of volumes and EC-2 hours by instance from started date.
+    `cost_before_history` is a cost estimated from started date till instance was seen for the first time.
+    `month_cost_before_history` is a part of `cost_before_history` within month, that instance was last seen in.
 
     `datetime_of_creation` is a date and time of instance`s creation.
     `datetime_of_current_ec2_info` is a date and time of last instance`s info update.
+    `datetime_of_last_seen` is a date and time of last refresh, that found instance at AWS.
+
+    `fingerprint` is a hash of instance`s AWS-sourced fields, that detects whether they changed.
+
+    Volumes themselves with their costs are rows of `Volume` model.
     """
     name = models.CharField(max_length=250)
-    instance_id = models.CharField(max_length=250)
-    instance_type = models.CharField(max_length=250)
-    state = models.CharField(max_length=250)
+    instance_id = models.CharField(max_length=250, unique=True)
+    instance_type = models.CharField(max_length=250, db_index=True)
+    os = models.CharField(max_length=50, null=True, blank=True)
+    tenancy = models.CharField(max_length=50, null=True, blank=True)
+    account = models.CharField(max_length=250, null=True, db_index=True)
+    region = models.CharField(max_length=250, null=True, db_index=True)
+    state = models.CharField(max_length=250, db_index=True)
     public_ip_address = models.CharField(max_length=250, null=True)
     private_ip_address = models.CharField(max_length=250, null=True)
     vpc_id = models.CharField(max_length=250, null=True)
     security_group = models.CharField(max_length=250, null=True)
-    volumes = models.CharField(max_length=250, null=True)
+    volumes = models.TextField(null=True)
 
     ec2_cost_by_hour = models.FloatField(default=0)
     volumes_cost_by_month = models.FloatField(default=0)
     overall_cost_by_month = models.FloatField(default=0)
     overall_cost_all_time = models.FloatField(default=0)
+    cost_before_history = models.FloatField(default=0)
+    month_cost_before_history = models.FloatField(default=0)
 
     datetime_of_creation = models.DateTimeField(null=True, blank=True)
-    datetime_of_current_ec2_info = models.DateTimeField(default=datetime.now(), null=True, blank=True)
+    datetime_of_current_ec2_info = models.DateTimeField(default=timezone.now, null=True, blank=True)
+    datetime_of_last_seen = models.DateTimeField(null=True, blank=True)
+
+    fingerprint = models.CharField(max_length=40, null=True, blank=True)
 
     def __str__(self):
         """
         String representation of the instance`s name.
         """
         return self.name
+
+
+class Volume(models.Model):
+    """
+    This model represents EBS volume, that is attached to instance.
+
+    `instance` is an instance, that volume is attached to.
+    `volume_id` is an id of volume.
+    `volume_type` is a type of volume, e.g. `gp2`.
+    `size` is a size of volume in GiB.
+    `iops` is a provisioned iops count of volume, null for types without provisioned iops.
+    `cost_by_month` is a volume`s cost by month.
+    """
+    instance = models.ForeignKey(Instance, on_delete=models.CASCADE, related_name='volume_set')
+    volume_id = models.CharField(max_length=250, unique=True)
+    volume_type = models.CharField(max_length=50, db_index=True)
+    size = models.IntegerField(default=0, db_index=True)
+    iops = models.IntegerField(null=True, blank=True)
+    cost_by_month = models.FloatField(default=0)
+
+    def __str__(self):
+        """
+        String representation of the volume`s id.
+        """
+        return self.volume_id
+
+
+class InstanceSample(models.Model):
+    """
+    This model represents snapshot of instance`s state and costs, that scheduler takes on every refresh.
+
+    `instance_id` is an id of instance.
+    `timestamp` is a date and time of snapshot.
+    `state` is a state of instance.
+    `instance_type` is a type of instance.
+    `os` is an OS of instance, that `ec2_cost_by_hour` was priced for, empty for samples taken before it was kept.
+    `tenancy` is a tenancy of instance, that `ec2_cost_by_hour` was priced for.
+
+    `ec2_cost_by_hour` is an EC-2 instance`s cost by hour.
+    `volumes_cost_by_month` is an instance`s volumes cost by month.
+    `hours` is an amount of hours since previous snapshot, that snapshot stands for.
+    `cost` is a cost of instance and volumes during these hours.
+    """
+    instance_id = models.CharField(max_length=250)
+    timestamp = models.DateTimeField()
+    state = models.CharField(max_length=250)
+    instance_type = models.CharField(max_length=250)
+    os = models.CharField(max_length=50, null=True, blank=True)
+    tenancy = models.CharField(max_length=50, null=True, blank=True)
+
+    ec2_cost_by_hour = models.FloatField(default=0)
+    volumes_cost_by_month = models.FloatField(default=0)
+    hours = models.FloatField(default=0)
+    cost = models.FloatField(default=0)
+
+    class Meta:
+        index_together = [('instance_id', 'timestamp')]
+
+    def __str__(self):
+        """
+        String representation of the sample`s instance and time.
+        """
+        return '{} at {}'.format(self.instance_id, self.timestamp)
+
+
+class InstanceCostRollup(models.Model):
+    """
+    This model represents aggregate of instance`s samples for an hour, a day or a month.
+
+    `instance_id` is an id of instance.
+    `period` is a length of period, one of `hour`, `day` and `month`.
+    `period_start` is a date and time of period`s beginning.
+
+    `samples` is an amount of samples in period.
+    `hours` is an amount of hours, that samples stand for.
+    `running_hours` is an amount of hours, while instance was running.
+    `cost` is a cost of instance and volumes during period.
+    `max_ec2_cost_by_hour` is a highest EC-2 instance`s cost by hour during period.
+    """
+    HOUR, DAY, MONTH = 'hour', 'day', 'month'
+    PERIODS = ((HOUR, 'Hour'), (DAY, 'Day'), (MONTH, 'Month'))
+
+    instance_id = models.CharField(max_length=250)
+    period = models.CharField(max_length=5, choices=PERIODS)
+    period_start = models.DateTimeField()
+
+    samples = models.IntegerField(default=0)
+    hours = models.FloatField(default=0)
+    running_hours = models.FloatField(default=0)
+    cost = models.FloatField(default=0)
+    max_ec2_cost_by_hour = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = [('period', 'period_start', 'instance_id')]
+        index_together = [('instance_id', 'period', 'period_start')]
+
+    def __str__(self):
+        """
+        String representation of the rollup`s instance and period.
+        """
+        return '{} {} {}'.format(self.instance_id, self.period, self.period_start)
+
+
+class StagedChunk(models.Model):
+    """
+    This model represents a chunk of instances` data, that a refresh collected, but did not write yet, look at
+    `ec2.persistence.InstancesStage`.
+
+    `refresh` is a key of refresh, that chunk belongs to.
+    `data` is a JSON list of instances` data.
+    `datetime_of_creation` is a date and time of staging.
+    """
+    refresh = models.CharField(max_length=32, db_index=True)
+    data = models.TextField()
+    datetime_of_creation = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        """
+        String representation of the chunk`s refresh.
+        """
+        return '{} ({})'.format(self.refresh, self.pk)
+
+
+class RefreshGeneration(models.Model):
+    """
+    This model represents a committed change of dashboard`s data, the latest row is current generation.
+
+    `source` is a name of job, that changed data, e.g. `refresh` or `rollup`.
+    `datetime_of_creation` is a date and time of change.
+    """
+    source = models.CharField(max_length=50)
+    datetime_of_creation = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        """
+        String representation of the generation`s number and source.
+        """
+        return '{} ({})'.format(self.pk, self.source)
+
+
+class RefreshRequest(models.Model):
+    """
+    This model represents a manual request to refresh a region or a single instance out of schedule`s cycle.
+
+    `region` is a region to refresh, region of instance if `instance_id` is set.
+    `instance_id` is an id of instance to refresh, the whole region is refreshed if empty.
+    `datetime_of_creation` is a date and time of request.
+    `datetime_of_handling` is a date and time, when scheduler took request, empty while request is pending.
+    """
+    region = models.CharField(max_length=250, null=True, blank=True)
+    instance_id = models.CharField(max_length=250, null=True, blank=True)
+    datetime_of_creation = models.DateTimeField(default=timezone.now)
+    datetime_of_handling = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        """
+        String representation of the request`s target.
+        """
+        return self.instance_id or self.region
+
+
+class ClockStats(models.Model):
+    """
+    This model represents stats, that clock process publishes for web process to serve, look at `ec2.metrics`.
+
+    `key` is a name of stats, e.g. `job:refresh-region:us-east-1` for the last run of job or `clock` for counters
+        of AWS calls and price catalogs.
+    `stats` is a JSON of stats.
+    `datetime_of_update` is a date and time of publication.
+    """
+    key = models.CharField(max_length=250, unique=True)
+    stats = models.TextField(default='{}')
+    datetime_of_update = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        """
+        String representation of the stats` key.
+        """
+        return self.key
@@ -0,0 +1,329 @@
+"""
+Persistence of instances` data, that scheduler collects, into `Instance` and `Volume` models.
+"""
+
+from datetime import timedelta
+from functools import reduce
+import hashlib
+import json
+import operator
+import uuid
+
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .accrual import accrue, seed
+from .generation import new_generation
+from .history import record_samples
+from .models import Instance, StagedChunk, Volume
+from .utils import BATCH_SIZE, batches, bulk_update
+
+AWS_FIELDS = (
+    'name', 'instance_type', 'os', 'tenancy', 'account', 'region', 'state', 'public_ip_address',
+    'private_ip_address', 'vpc_id', 'security_group', 'volumes', 'datetime_of_creation',
+)
+PRICE_FIELDS = ('ec2_cost_by_hour', 'volumes_cost_by_month')
+# Totals grow at every refresh, so they are written along with `datetime_of_last_seen`, not compared.
+ACCRUED_FIELDS = ('overall_cost_by_month', 'overall_cost_all_time', 'month_cost_before_history')
+VOLUME_FIELDS = ('volume_type', 'size', 'iops', 'cost_by_month')
+DATETIME_FIELDS = tuple(field.name for field in Instance._meta.fields if isinstance(field, models.DateTimeField))
+# Chunks of refreshes, that died before they were written, are deleted by the next refreshes.
+STAGE_MAX_AGE = timedelta(days=1)
+
+
+def fingerprint(instance_data):
+    """
+    Method hashes instance`s AWS-sourced fields, so equal fingerprints mean nothing changed at AWS.
+
+    Arguments:
+        instance_data (dict): Dictionary with `Instance` fields` values.
+
+    Returns:
+        Hex digest (str) of SHA-1 over fields from `AWS_FIELDS`.
+    """
+    content = json.dumps([instance_data.get(field) for field in AWS_FIELDS], default=str)
+
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def save_volumes(volumes_by_instance):
+    """
+    Method synchronizes `Volume` table with collected volumes of instances.
+
+    Only volumes of instances from `volumes_by_instance` are synchronized, volumes of the rest of instances are
+    left as they are, and only their rows are read. Volume, that is moved to other instance within the same
+    call, keeps its row.
+
+    Arguments:
+        volumes_by_instance (dict): {'instance_id': [{'volume_id': ..., 'volume_type': ..., 'size': ...,
+                                                      'iops': ..., 'cost_by_month': ...}, ...], ...}
+
+    Returns:
+        counts (dict): {'inserted': ..., 'updated': ..., 'deleted': ...}
+    """
+    counts = {'inserted': 0, 'updated': 0, 'deleted': 0}
+    if not volumes_by_instance:
+        return counts
+
+    instance_pks = {}
+    for batch in batches(list(volumes_by_instance)):
+        instance_pks.update(Instance.objects.filter(instance_id__in=batch).values_list('instance_id', 'pk'))
+    synced_pks = set(instance_pks[instance_id] for instance_id in volumes_by_instance)
+
+    # `instance_id` of `Volume` is a primary key of its instance`s row, not AWS`s id.
+    live = {
+        volume_data['volume_id']: dict(volume_data, instance_id=instance_pks[instance_id])
+        for instance_id, volumes in volumes_by_instance.items() for volume_data in volumes
+    }
+    existing = {}
+    for batch in batches(list(live)):
+        existing.update((volume.volume_id, volume) for volume in Volume.objects.filter(volume_id__in=batch))
+    for batch in batches(sorted(synced_pks)):
+        existing.update((volume.volume_id, volume) for volume in Volume.objects.filter(instance_id__in=batch))
+
+    stale_pks = [
+        volume.pk for volume_id, volume in existing.items()
+        if volume_id not in live and volume.instance_id in synced_pks
+    ]
+    for batch in batches(stale_pks):
+        counts['deleted'] += Volume.objects.filter(pk__in=batch).delete()[1].get(Volume._meta.label, 0)
+
+    to_create, to_update, changed_fields = [], [], set()
+
+    for volume_id, volume_data in live.items():
+        volume = existing.get(volume_id)
+        fields = {field: volume_data.get(field) for field in ('instance_id',) + VOLUME_FIELDS}
+
+        if volume is None:
+            to_create.append(Volume(volume_id=volume_id, **fields))
+            continue
+
+        changed = [field for field, value in fields.items() if getattr(volume, field) != value]
+        if changed:
+            for field in changed:
+                setattr(volume, field, fields[field])
+            changed_fields.update(changed)
+            to_update.append(volume)
+
+    Volume.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    bulk_update(to_update, sorted(changed_fields))
+
+    counts['inserted'], counts['updated'] = len(to_create), len(to_update)
+
+    return counts
+
+
+def staged_value(value):
+    """
+    Method serializes datetimes of instances` data into JSON of staged chunk.
+    """
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+
+    raise TypeError('{!r} is not JSON serializable.'.format(value))
+
+
+class InstancesStage(object):
+    """
+    Stage keeps chunks of instances` data, that a refresh collected, in `StagedChunk` table, until the whole
+    refresh is collected, so all of them are written along with deletion of gone rows and a new generation of
+    data within one transaction, readers never see a part of refresh, and memory still holds a single chunk.
+
+    Every chunk is staged in its own short transaction, so staging waits for no lock of other refreshes.
+    """
+
+    def __init__(self):
+        self.key = uuid.uuid4().hex
+
+    def add(self, instances_data):
+        """
+        Method stages a chunk of instances` data, look at `InstancesWriter.write`.
+        """
+        StagedChunk.objects.create(refresh=self.key, data=json.dumps(instances_data, default=staged_value))
+
+    def chunks(self):
+        """
+        Method reads staged chunks one by one in the order, that they were staged in.
+
+        Returns:
+            Generator of lists of instances` data (dict).
+        """
+        for pk in StagedChunk.objects.filter(refresh=self.key).order_by('pk').values_list('pk', flat=True):
+            instances_data = json.loads(StagedChunk.objects.values_list('data', flat=True).get(pk=pk))
+
+            for instance_data in instances_data:
+                for field in DATETIME_FIELDS:
+                    if instance_data.get(field) is not None:
+                        instance_data[field] = parse_datetime(instance_data[field])
+
+            yield instances_data
+
+    def clear(self):
+        """
+        Method deletes chunks of stage and chunks, that were left by refreshes, which died.
+        """
+        StagedChunk.objects.filter(
+            Q(refresh=self.key) | Q(datetime_of_creation__lt=timezone.now() - STAGE_MAX_AGE)
+        ).delete()
+
+
+class InstancesWriter(object):
+    """
+    Writer synchronizes `Instance` table with collected instances` data, that arrives chunk by chunk, so a refresh
+    never holds all rows at once, look at `InstancesStage`.
+
+    Only rows of a chunk are read, rows of instances, that are new, are inserted with `bulk_create` and changed
+    rows are written with `bulk_update`. Costs of existing instances are accrued since previous refresh, costs of
+    new ones are taken from their data as a starting point, look at `ec2.accrual`. Every accrual is written into
+    history.
+
+    In incremental mode a row is written only if fingerprint of its AWS-sourced fields or its prices changed,
+    for the rest of rows only `datetime_of_last_seen` and accrued totals are updated, so
+    `datetime_of_current_ec2_info` tells, when instance changed last. Otherwise every existing row is rewritten.
+    Volumes of instances, whose data has `volumes_data`, are synchronized as well, look at `save_volumes`.
+
+    Every written row is marked as seen at `seen_at`, so, once all chunks are written, `finish` deletes rows,
+    that were seen before, and starts a new generation of data, look at `ec2.generation`. All calls should run
+    within a single transaction, so the new generation is committed along with all its rows. Rows, that a refresh
+    collected after `seen_at` already wrote, are skipped, so they are neither accrued twice nor deleted.
+    """
+
+    def __init__(self, incremental=True, seen_at=None, max_gap_hours=1.0):
+        """
+        Arguments:
+            incremental (bool): Whether to skip writing of unchanged rows.
+            seen_at (datetime): Date and time of collection, now if omitted.
+            max_gap_hours (float): Most hours, that a single accrual might stand for.
+        """
+        self.incremental = incremental
+        self.seen_at = seen_at or timezone.now()
+        self.max_gap_hours = max_gap_hours
+        self.counts = {
+            'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'changed': 0, 'skipped': 0, 'samples': 0,
+            'volumes': {'inserted': 0, 'updated': 0, 'deleted': 0},
+        }
+        self.ids = {'inserted': [], 'deleted': [], 'changed': []}
+
+    def write(self, instances_data):
+        """
+        Method writes a chunk of instances` data.
+
+        Arguments:
+            instances_data (list): Dictionaries with `Instance` fields` values, `instance_id` is required.
+        """
+        existing = {}
+        for batch in batches([instance_data['instance_id'] for instance_data in instances_data]):
+            existing.update(
+                (instance.instance_id, instance) for instance in Instance.objects.filter(instance_id__in=batch)
+            )
+
+        to_create, to_update, unchanged, changed_fields, samples = [], [], [], set(), []
+        volumes_by_instance = {}
+
+        for instance_data in instances_data:
+            instance_data = dict(
+                instance_data,
+                fingerprint=fingerprint(instance_data),
+                datetime_of_current_ec2_info=self.seen_at,
+                datetime_of_last_seen=self.seen_at,
+            )
+            volumes_data = instance_data.pop('volumes_data', None)
+            if volumes_data is not None:
+                volumes_by_instance[instance_data['instance_id']] = volumes_data
+
+            instance = existing.get(instance_data['instance_id'])
+            last_seen = instance and instance.datetime_of_last_seen
+            if last_seen and last_seen > self.seen_at:
+                self.counts['skipped'] += 1
+                continue
+
+            if instance is None:
+                hours, cost = seed(instance_data)
+            else:
+                hours, cost = accrue(instance, instance_data, self.seen_at, self.max_gap_hours)
+            samples.append((instance_data, hours, cost))
+
+            if instance is None:
+                to_create.append(Instance(**instance_data))
+                self.ids['inserted'].append(instance_data['instance_id'])
+                continue
+
+            if self.incremental and instance.fingerprint == instance_data['fingerprint'] and all(
+                getattr(instance, field) == instance_data[field] for field in PRICE_FIELDS if field in instance_data
+            ):
+                instance.datetime_of_last_seen = self.seen_at
+                for field in ACCRUED_FIELDS:
+                    if field in instance_data:
+                        setattr(instance, field, instance_data[field])
+                unchanged.append(instance)
+                continue
+
+            if instance.fingerprint != instance_data['fingerprint']:
+                self.counts['changed'] += 1
+                self.ids['changed'].append(instance_data['instance_id'])
+
+            changed = [key for key, value in instance_data.items() if getattr(instance, key) != value]
+            for key in changed:
+                setattr(instance, key, instance_data[key])
+
+            changed_fields.update(changed)
+            to_update.append(instance)
+
+        Instance.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+        bulk_update(to_update, sorted(changed_fields))
+
+        bulk_update(unchanged, ('datetime_of_last_seen',) + ACCRUED_FIELDS)
+
+        self.counts['inserted'] += len(to_create)
+        self.counts['updated'] += len(to_update)
+        self.counts['unchanged'] += len(unchanged)
+        self.counts['samples'] += record_samples(samples, self.seen_at)
+
+        for key, value in save_volumes(volumes_by_instance).items():
+            self.counts['volumes'][key] += value
+
+    def finish(self, scopes=None, instances_ids=None):
+        """
+        Method deletes rows of instances, that are gone, and starts a new generation of data.
+
+        A partial refresh passes `scopes` or `instances_ids`, that it collected, so only rows within them might be
+        deleted as gone, the rest of rows are left as they are.
+
+        Arguments:
+            scopes (list): Tuples of account and region, that instances were collected from, all if omitted.
+            instances_ids (list): Ids of instances, that were collected, all instances of scopes if omitted.
+
+        Returns:
+            counts (dict): {'inserted': ..., 'updated': ..., 'deleted': ..., 'unchanged': ..., 'samples': ...,
+                            'volumes': ..., 'changed': ..., 'skipped': ...}
+        """
+        stale = []
+
+        if scopes is None or scopes:
+            queryset = Instance.objects.filter(
+                Q(datetime_of_last_seen__lt=self.seen_at) | Q(datetime_of_last_seen__isnull=True)
+            )
+
+            if scopes is not None:
+                regions_of_accounts = {}
+                for account, region in scopes:
+                    regions_of_accounts.setdefault(account, []).append(region)
+                queryset = queryset.filter(reduce(operator.or_, [
+                    Q(account=account, region__in=regions) for account, regions in regions_of_accounts.items()
+                ]))
+
+            if instances_ids is None:
+                stale = list(queryset.values_list('pk', 'instance_id'))
+            else:
+                for batch in batches(list(instances_ids)):
+                    stale.extend(queryset.filter(instance_id__in=batch).values_list('pk', 'instance_id'))
+
+        self.ids['deleted'] = sorted(instance_id for pk, instance_id in stale)
+        for batch in batches([pk for pk, instance_id in stale]):
+            self.counts['deleted'] += Instance.objects.filter(pk__in=batch).delete()[1].get(Instance._meta.label, 0)
+
+        new_generation('refresh')
+
+        return self.counts
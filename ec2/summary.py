@@ -0,0 +1,135 @@
+"""
+Fleet summary, that dashboard pages are rendered from, cached per generation of data.
+
+Summary is built once per generation in every web process, so a page view costs a single query, that looks
+current generation up. Jobs, that change data, start new generations, so stale summaries are never served.
+Summary is read within a single snapshot along with its generation, so it never mixes data of two refreshes.
+Summary holds plain values instead of model objects, so reading it from cache does not build a model per instance.
+"""
+
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .db import snapshot
+from .generation import current_generation
+from .history import daily_costs, month_to_date_costs
+from .models import Instance, Volume
+
+SUMMARY_TIMEOUT = 60 * 60
+LARGEST_VOLUMES = 10
+SUMMARY_FIELDS = (
+    'instance_id', 'name', 'instance_type', 'state', 'public_ip_address', 'private_ip_address', 'vpc_id',
+    'security_group', 'volumes', 'ec2_cost_by_hour', 'volumes_cost_by_month', 'overall_cost_by_month',
+    'overall_cost_all_time', 'datetime_of_creation', 'datetime_of_current_ec2_info', 'datetime_of_last_seen',
+)
+VOLUME_FIELDS = ('volume_id', 'instance__instance_id', 'volume_type', 'size', 'cost_by_month')
+
+
+def build_fleet_summary():
+    """
+    Method builds fleet summary from a snapshot of database, look at `db.snapshot`.
+
+    Returns:
+        summary (dict): {'generation': ...,
+                         'instances': ...,
+                         'instances_by_id': ...,
+                         'all_instances_cost': ...,
+                         'all_instances_month_cost': ...,
+                         'month_to_date_costs': ...,
+                         'all_instances_month_to_date_cost': ...,
+                         'volumes_cost_by_type': ...,
+                         'largest_volumes': ...}
+        generation (int): Number of generation, that summary is built from.
+        instances (list): Values of `SUMMARY_FIELDS` (dict) of all instances from `Instance` model.
+        instances_by_id (dict): The same values by ids of instances.
+        all_instances_cost (float): Total cost of all instances from creation to now.
+        all_instances_month_cost (float): Total cost of all instances in current month.
+        month_to_date_costs (dict): Costs of instances since beginning of month from history by their ids.
+        all_instances_month_to_date_cost (float): Cost of all instances since beginning of month from history.
+        volumes_cost_by_type (dict): Costs of all volumes by month by their types.
+        largest_volumes (list): Values (dict) of largest volumes from `Volume` model with ids of their instances.
+    """
+    with snapshot():
+        generation = current_generation()[0]
+        instances = list(Instance.objects.order_by('pk').values(*SUMMARY_FIELDS))
+        totals = Instance.objects.aggregate(all_time=Sum('overall_cost_all_time'), month=Sum('overall_cost_by_month'))
+        month_to_date = month_to_date_costs()
+        volumes_cost_by_type = list(
+            Volume.objects.values_list('volume_type').annotate(total=Sum('cost_by_month'))
+        )
+        largest_volumes = [
+            dict(zip(('volume_id', 'instance_id', 'volume_type', 'size', 'cost_by_month'), volume))
+            for volume in Volume.objects.order_by('-size').values_list(*VOLUME_FIELDS)[:LARGEST_VOLUMES]
+        ]
+
+    return {
+        'generation': generation,
+        'instances': instances,
+        'instances_by_id': {instance['instance_id']: instance for instance in instances},
+        'all_instances_cost': round(totals['all_time'] or 0, 2),
+        'all_instances_month_cost': round(totals['month'] or 0, 2),
+        'month_to_date_costs': month_to_date,
+        'all_instances_month_to_date_cost': round(sum(month_to_date.values()), 2),
+        'volumes_cost_by_type': {volume_type: round(total, 2) for volume_type, total in volumes_cost_by_type},
+        'largest_volumes': largest_volumes,
+    }
+
+
+def cache_key(key, generation):
+    """
+    Method provides key of value of generation in cache.
+    """
+    return '{}:{}'.format(key, generation)
+
+
+def cached(key, generation, build):
+    """
+    Method gets value of generation from cache, building and caching it on miss.
+    """
+    key = cache_key(key, generation)
+    value = cache.get(key)
+
+    if value is None:
+        value = build()
+        cache.set(key, value, SUMMARY_TIMEOUT)
+
+    return value
+
+
+def fleet_summary(generation=None):
+    """
+    Method provides fleet summary of generation, current one if omitted, look at `build_fleet_summary`.
+
+    If a newer generation is committed, while summary of generation is missing in cache, summary of the newer one
+    is built, cached under its own generation and provided, its `generation` tells which one it is.
+    """
+    if generation is None:
+        generation = current_generation()[0]
+
+    summary = cache.get(cache_key('fleet-summary', generation))
+
+    if summary is None:
+        summary = build_fleet_summary()
+        cache.set(cache_key('fleet-summary', summary['generation']), summary, SUMMARY_TIMEOUT)
+
+    return summary
+
+
+def cached_fleet_summary(generation):
+    """
+    Method provides fleet summary of past generation, if it is still cached, it can not be built anymore.
+
+    Returns:
+        Summary (dict) or None, look at `build_fleet_summary`.
+    """
+    return cache.get(cache_key('fleet-summary', generation))
+
+
+def instance_daily_costs(instance_id, generation=None):
+    """
+    Method provides daily costs of instance of generation, current one if omitted, look at `history.daily_costs`.
+    """
+    if generation is None:
+        generation = current_generation()[0]
+
+    return cached('daily-costs:{}'.format(instance_id), generation, lambda: daily_costs(instance_id))
@@ -1,3 +1,1158 @@
-from django.test import TestCase
+"""
+Tests of EC-2 application, AWS is replaced with a local stand-in, look at `fake_aws`.
+"""
 
-# Create your tests here.
+import csv
+from datetime import datetime, timedelta
+from io import StringIO
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from aws_clients import ClientPool, parse_accounts
+from fake_aws import FakeAWS, SyntheticFleet, stand_in
+from price_cache import PriceCatalogCache
+from price_index import PriceIndex, parse_price_rows
+import refresh
+from region_scheduler import AdaptiveRegionScheduler
+from schedule_utils import fleet_costs, overall_instance_cost, total_month_cost, volume_cost
+import server_schedule
+
+from . import live
+from .accrual import accrue, month_start, rebuild_totals
+from .db import PrimaryReplicaRouter, routing, snapshot
+from .export import INSTANCE_FIELDS
+from .generation import current_generation, new_generation
+from .history import prune_samples, record_samples, reprice_history, roll_up_history
+from .metrics import CONTENT_TYPE, exposition, start_counting, stop_counting, view_stats
+from .persistence import InstancesWriter
+from .models import Instance, InstanceCostRollup, InstanceSample, RefreshRequest, StagedChunk, Volume
+from .summary import build_fleet_summary, cache_key, fleet_summary
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_event(name):
+    """
+    Method loads EventBridge payload, that was recorded into `fixtures/events`.
+    """
+    with open(os.path.join(FIXTURES_DIR, 'events', '{}.json'.format(name))) as event_file:
+        return event_file.read()
+
+
+class RecordingRegionScheduler(object):
+    """
+    Stand-in of `region_scheduler.AdaptiveRegionScheduler`, that records regions instead of running their jobs.
+    """
+
+    def __init__(self):
+        self.regions = []
+
+    def run_now(self, region):
+        self.regions.append(region)
+
+
+@override_settings(EC2_EVENTS_TOKEN='secret')
+class EC2EventsTests(TestCase):
+    """
+    Webhook of EC-2 state-change events and handling of requests, that it stores.
+    """
+
+    def post_event(self, body, token='secret'):
+        headers = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(token)} if token else {}
+
+        return self.client.post(reverse('ec2:ec2_events'), body, content_type='application/json', **headers)
+
+    @override_settings(EC2_EVENTS_TOKEN='')
+    def test_disabled_without_token(self):
+        self.assertEqual(self.post_event(load_event('state-change-stopped')).status_code, 404)
+
+    def test_wrong_token_is_rejected(self):
+        self.assertEqual(self.post_event(load_event('state-change-stopped'), token='wrong').status_code, 403)
+        self.assertEqual(self.post_event(load_event('state-change-stopped'), token=None).status_code, 403)
+        self.assertFalse(RefreshRequest.objects.exists())
+
+    def test_state_change_is_requested(self):
+        response = self.post_event(load_event('state-change-stopped'))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {'requests': 1})
+        self.assertEqual(
+            list(RefreshRequest.objects.values_list('region', 'instance_id', 'datetime_of_handling')),
+            [('us-east-1', 'i-00000000000000001', None)],
+        )
+
+    def test_batch_of_state_changes_is_requested(self):
+        response = self.post_event(load_event('state-changes-batch'))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            sorted(RefreshRequest.objects.values_list('region', 'instance_id')),
+            [('us-east-1', 'i-00000000000000005'), ('us-east-2', 'i-00000000000000007')],
+        )
+
+    def test_other_events_are_rejected(self):
+        self.assertEqual(self.post_event(load_event('spot-interruption-warning')).status_code, 400)
+        self.assertEqual(self.post_event('not json').status_code, 400)
+        self.assertFalse(RefreshRequest.objects.exists())
+
+    def test_requested_instance_is_collected_again(self):
+        fleet = SyntheticFleet(8, regions=2, volumes=1)
+        changed, untouched = fleet.instances['us-east-1'][:2]
+        changed['State'] = untouched['State'] = 'running'
+        region_scheduler = RecordingRegionScheduler()
+
+        with FakeAWS(fleet) as fake_aws, stand_in(fake_aws):
+            refresh.refresh_instances_info()
+            changed['State'] = untouched['State'] = 'stopped'
+            fake_aws.reset_calls()
+
+            self.assertEqual(self.post_event(load_event('state-change-stopped')).status_code, 202)
+            server_schedule.handle_refresh_requests(region_scheduler)
+
+            calls = fake_aws.reset_calls()
+
+        states = dict(Instance.objects.values_list('instance_id', 'state'))
+        self.assertEqual(states[changed['InstanceId']], 'stopped')
+        self.assertEqual(states[untouched['InstanceId']], 'running')
+        self.assertEqual(len(states), 8)
+        self.assertEqual(calls.get('DescribeInstances'), 1)
+        self.assertEqual(region_scheduler.regions, [])
+        self.assertFalse(RefreshRequest.objects.filter(datetime_of_handling__isnull=True).exists())
+
+
+class RefreshTests(TestCase):
+    """
+    Refresh of instances against a local stand-in of AWS.
+    """
+
+    def setUp(self):
+        self.fleet = SyntheticFleet(8, regions=2, volumes=1)
+        self.fake_aws = FakeAWS(self.fleet).start()
+        self.addCleanup(self.fake_aws.stop)
+        stand_in_aws = stand_in(self.fake_aws)
+        stand_in_aws.__enter__()
+        self.addCleanup(stand_in_aws.__exit__, None, None, None)
+
+    def test_fleet_is_inserted(self):
+        counts = refresh.refresh_instances_info()
+
+        self.assertEqual(
+            {key: counts[key] for key in ('inserted', 'updated', 'deleted', 'unchanged', 'changed', 'samples')},
+            {'inserted': 8, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'changed': 0, 'samples': 8},
+        )
+        self.assertEqual(Instance.objects.count(), 8)
+        self.assertEqual(Volume.objects.count(), 8)
+        self.assertFalse(Instance.objects.filter(os__isnull=True).exists())
+        self.assertFalse(InstanceSample.objects.filter(tenancy__isnull=True).exists())
+        self.assertEqual(
+            sorted((region['region'], region['instances']) for region in counts['regions']),
+            [('us-east-1', 4), ('us-east-2', 4)],
+        )
+
+    def test_unchanged_rows_are_not_rewritten(self):
+        refresh.refresh_instances_info()
+        written = dict(Instance.objects.values_list('instance_id', 'datetime_of_current_ec2_info'))
+        changed = self.fleet.instances['us-east-1'][0]
+        changed['InstanceType'] = 'i3.large' if changed['InstanceType'] != 'i3.large' else 't2.micro'
+
+        counts = refresh.refresh_instances_info()
+
+        self.assertEqual(
+            {key: counts[key] for key in ('inserted', 'updated', 'deleted', 'unchanged', 'changed')},
+            {'inserted': 0, 'updated': 1, 'deleted': 0, 'unchanged': 7, 'changed': 1},
+        )
+        for instance_id, last_seen, current_info in Instance.objects.values_list(
+            'instance_id', 'datetime_of_last_seen', 'datetime_of_current_ec2_info'
+        ):
+            self.assertGreater(last_seen, written[instance_id])
+            self.assertEqual(current_info == written[instance_id], instance_id != changed['InstanceId'])
+
+    def test_only_instances_of_answered_regions_are_deleted(self):
+        refresh.refresh_instances_info()
+        gone = [self.fleet.instances[region].pop() for region in self.fleet.regions]
+        self.fake_aws.failing_regions.add('us-east-2')
+
+        counts = refresh.refresh_instances_info()
+
+        self.assertEqual(counts['deleted'], 1)
+        self.assertEqual([region['region'] for region in counts['regions']], ['us-east-1'])
+        self.assertFalse(Instance.objects.filter(instance_id=gone[0]['InstanceId']).exists())
+        self.assertTrue(Instance.objects.filter(instance_id=gone[1]['InstanceId']).exists())
+        self.assertEqual(Instance.objects.filter(region='us-east-2').count(), 4)
+
+        self.fake_aws.failing_regions.clear()
+
+        self.assertEqual(refresh.refresh_instances_info()['deleted'], 1)
+        self.assertEqual(Instance.objects.count(), 6)
+
+    def test_summary_within_refresh_shows_previous_generation(self):
+        refresh.refresh_instances_info()
+        previous = build_fleet_summary()
+        for instances in self.fleet.instances.values():
+            for instance in instances:
+                instance['InstanceType'] = 'x9.huge'
+        summaries, instances_data = [], refresh.instances_data
+
+        def summarized_instances_data(*args):
+            summaries.append(build_fleet_summary())
+            return instances_data(*args)
+
+        with mock.patch.object(refresh, 'PIPELINE_BATCH_SIZE', 2):
+            with mock.patch.object(refresh, 'instances_data', side_effect=summarized_instances_data):
+                refresh.refresh_instances_info()
+
+        self.assertEqual(len(summaries), 4)
+        for summary in summaries:
+            self.assertEqual(summary['generation'], previous['generation'])
+            self.assertEqual(summary['instances'], previous['instances'])
+
+        current = build_fleet_summary()
+        self.assertGreater(current['generation'], previous['generation'])
+        self.assertEqual({instance['instance_type'] for instance in current['instances']}, {'x9.huge'})
+        self.assertFalse(StagedChunk.objects.exists())
+
+    def test_dry_run_writes_nothing(self):
+        counts = refresh.refresh_instances_info(dry_run=True)
+
+        self.assertEqual(counts['inserted'], 8)
+        self.assertEqual(len(counts['ids']['inserted']), 8)
+        self.assertFalse(Instance.objects.exists())
+
+
+def instance_data(instance_id='i-1', region='us-east-1', state='running', ec2_cost_by_hour=1.0, **fields):
+    """
+    Method provides collected data of instance, that writer takes, with costs estimated before history.
+    """
+    return dict({
+        'instance_id': instance_id, 'name': instance_id, 'instance_type': 'm4.large', 'os': 'linux',
+        'tenancy': 'shared', 'account': 'default', 'region': region, 'state': state,
+        'ec2_cost_by_hour': ec2_cost_by_hour, 'volumes_cost_by_month': 72.0, 'overall_cost_by_month': 10.0,
+        'overall_cost_all_time': 100.0,
+    }, **fields)
+
+
+class AccountsTests(TestCase):
+    """
+    Registry of accounts, their pooled clients and refresh of several accounts side by side.
+    """
+
+    def test_accounts_are_parsed(self):
+        accounts = parse_accounts(json.dumps([
+            {'name': 'prod', 'role_arn': 'arn:aws:iam::123456789012:role/status-page', 'max_concurrency': 4},
+            {'name': 'dev', 'aws_access_key_id': 'key', 'aws_secret_access_key': 'secret'},
+        ]))
+
+        self.assertEqual([account['name'] for account in accounts], ['prod', 'dev'])
+
+        for text in ('{"name": "prod"}', '[{"role_arn": "arn"}]', '[{"name": "prod"}, {"name": "prod"}]',
+                     '[{"name": "prod", "region": "us-east-1"}]', '[["prod"]]'):
+            with self.assertRaises(ValueError):
+                parse_accounts(text)
+
+    def test_clients_are_pooled_by_account(self):
+        aws_clients = ClientPool()
+        aws_clients.register_account('prod', aws_access_key_id='prod', aws_secret_access_key='secret')
+        aws_clients.register_account('dev', aws_access_key_id='dev', aws_secret_access_key='secret', max_concurrency=2)
+        prod = aws_clients.client('us-east-1', 'prod')
+
+        self.assertEqual(aws_clients.accounts(), ['dev', 'prod'])
+        self.assertIs(aws_clients.client('us-east-1', 'prod'), prod)
+        self.assertIsNot(aws_clients.client('us-east-1', 'dev'), prod)
+        self.assertEqual(prod._request_signer._credentials.access_key, 'prod')
+        self.assertEqual((aws_clients.concurrency('prod', 8), aws_clients.concurrency('dev', 8)), (8, 2))
+
+        aws_clients.register_account('prod', aws_access_key_id='rotated', aws_secret_access_key='secret')
+
+        self.assertEqual(aws_clients.client('us-east-1', 'prod')._request_signer._credentials.access_key, 'rotated')
+
+    def test_accounts_are_refreshed_side_by_side(self):
+        fleet = SyntheticFleet(4, regions=2, volumes=1)
+        other_fleet = SyntheticFleet(3, regions=2, volumes=1, seed=1, first_id=100)
+
+        with FakeAWS(fleet, accounts={'other': other_fleet}) as fake_aws, stand_in(fake_aws):
+            counts = refresh.refresh_instances_info()
+            accounts = {
+                instance['InstanceId']: account
+                for account, account_fleet in (('default', fleet), ('other', other_fleet))
+                for instances in account_fleet.instances.values() for instance in instances
+            }
+
+            self.assertEqual(counts['inserted'], 7)
+            self.assertEqual(dict(Instance.objects.values_list('instance_id', 'account')), accounts)
+
+            # Instances of account, that does not answer, are kept, while ones gone from the other account are not.
+            fake_aws.failing_accounts.add('other')
+            gone = fleet.instances['us-east-1'].pop()
+            counts = refresh.refresh_instances_info()
+
+        self.assertEqual(counts['deleted'], 1)
+        self.assertFalse(Instance.objects.filter(instance_id=gone['InstanceId']).exists())
+        self.assertEqual(Instance.objects.filter(account='other').count(), 3)
+        self.assertEqual(Instance.objects.filter(account='default').count(), 3)
+
+
+class AccrualTests(TestCase):
+    """
+    Accrual of costs refresh by refresh and rebuild of totals from history.
+    """
+
+    def write(self, seen_at, instances_data, scopes=None):
+        writer = InstancesWriter(seen_at=seen_at, max_gap_hours=1.0)
+        writer.write(instances_data)
+
+        return writer.finish(scopes)
+
+    def test_interval_is_split_at_month_boundary(self):
+        current_month = month_start()
+        instance = Instance(**dict(
+            instance_data(volumes_cost_by_month=0.0), datetime_of_last_seen=current_month - timedelta(minutes=30)
+        ))
+        accrued = instance_data()
+
+        hours, cost = accrue(instance, accrued, current_month + timedelta(minutes=30), max_gap_hours=2.0)
+
+        self.assertEqual((hours, cost), (1.0, 1.0))
+        self.assertAlmostEqual(accrued['overall_cost_all_time'], 101.0)
+        self.assertAlmostEqual(accrued['overall_cost_by_month'], 0.5)
+        self.assertEqual(accrued['month_cost_before_history'], 0)
+
+    def test_gap_is_capped(self):
+        seen_at = month_start() + timedelta(hours=10)
+        instance = Instance(**dict(instance_data(), datetime_of_last_seen=seen_at - timedelta(hours=5)))
+
+        self.assertEqual(accrue(instance, instance_data(), seen_at, max_gap_hours=1.0)[0], 1.0)
+        self.assertEqual(accrue(instance, instance_data(), seen_at, max_gap_hours=8.0)[0], 5.0)
+
+    def test_overlapping_refreshes_bill_interval_once(self):
+        started = month_start() + timedelta(hours=1)
+        self.write(started, [instance_data('i-1'), instance_data('i-2', region='us-east-2')])
+
+        # Refresh of region collects later, but writes before refresh of the whole fleet, that started earlier.
+        region_counts = self.write(
+            started + timedelta(hours=1), [instance_data('i-1')], scopes=[('default', 'us-east-1')]
+        )
+        fleet_counts = self.write(
+            started + timedelta(minutes=30), [instance_data('i-1'), instance_data('i-2', region='us-east-2')]
+        )
+
+        self.assertEqual((region_counts['deleted'], fleet_counts['skipped'], fleet_counts['deleted']), (0, 1, 0))
+        totals = dict(Instance.objects.values_list('instance_id', 'overall_cost_all_time'))
+        self.assertAlmostEqual(totals['i-1'], 100.0 + 1.1)
+        self.assertAlmostEqual(totals['i-2'], 100.0 + 0.55)
+        self.assertEqual(InstanceSample.objects.filter(instance_id='i-1', hours__gt=0).count(), 1)
+
+    def test_rebuilt_totals_match_accrued_ones(self):
+        started = month_start() + timedelta(minutes=10)
+        for minutes, state, ec2_cost_by_hour in ((0, 'running', 1.0), (30, 'running', 1.0), (150, 'stopped', 2.0),
+                                                 (180, 'running', 2.0), (1500, 'running', 2.0)):
+            self.write(started + timedelta(minutes=minutes), [
+                instance_data('i-1', state=state, ec2_cost_by_hour=ec2_cost_by_hour), instance_data('i-2'),
+            ])
+        self.write(started + timedelta(minutes=1530), [instance_data('i-2'), instance_data('i-1', state='stopped')])
+        accrued = {row[0]: row[1:] for row in Instance.objects.values_list(
+            'instance_id', 'overall_cost_all_time', 'overall_cost_by_month'
+        )}
+
+        roll_up_history()
+        Instance.objects.update(overall_cost_all_time=0, overall_cost_by_month=0)
+
+        self.assertEqual(rebuild_totals(), 2)
+        for instance_id, all_time, by_month in Instance.objects.values_list(
+            'instance_id', 'overall_cost_all_time', 'overall_cost_by_month'
+        ):
+            self.assertAlmostEqual(all_time, accrued[instance_id][0])
+            self.assertAlmostEqual(by_month, accrued[instance_id][1])
+
+
+class RollUpHistoryTests(TestCase):
+    """
+    Rollups of samples into hours, days and months and pruning of samples out of retention period.
+    """
+
+    def record(self, *moments):
+        for index, moment in enumerate(moments):
+            state = 'stopped' if index % 3 == 2 else 'running'
+            record_samples([(instance_data('i-1', state=state), 0.5, 0.5 + index)], moment)
+
+    def totals(self, period):
+        return InstanceCostRollup.objects.filter(period=period).aggregate(
+            samples=Sum('samples'), hours=Sum('hours'), running_hours=Sum('running_hours'), cost=Sum('cost')
+        )
+
+    def test_totals_are_kept_across_hour_day_and_month(self):
+        current_month = month_start()
+        self.record(*[current_month + timedelta(minutes=minutes) for minutes in (-50, -20, 10, 20, 70, 1445)])
+        samples = InstanceSample.objects.aggregate(hours=Sum('hours'), cost=Sum('cost'))
+
+        counts = roll_up_history(retention_days=365)
+
+        self.assertEqual(
+            {period: counts[period] for period in ('hour', 'day', 'month', 'pruned')},
+            {'hour': 4, 'day': 3, 'month': 2, 'pruned': 0},
+        )
+        for period in ('hour', 'day', 'month'):
+            self.assertEqual(self.totals(period), {'samples': 6, 'hours': 3.0, 'running_hours': 2.0, 'cost': 18.0})
+            self.assertEqual((self.totals(period)['hours'], self.totals(period)['cost']), (
+                samples['hours'], samples['cost']
+            ))
+        self.assertEqual(
+            list(InstanceCostRollup.objects.filter(period='month').order_by('period_start').values_list(
+                'period_start', 'samples'
+            )),
+            [(month_start(current_month - timedelta(days=1)), 2), (current_month, 4)],
+        )
+
+    def test_rollup_is_brought_up_to_date_again(self):
+        current_month = month_start()
+        self.record(current_month + timedelta(minutes=5), current_month + timedelta(minutes=10))
+        roll_up_history(retention_days=365)
+        self.record(current_month + timedelta(minutes=15), current_month + timedelta(minutes=20))
+
+        roll_up_history(retention_days=365)
+
+        for period in ('hour', 'day', 'month'):
+            self.assertEqual(self.totals(period)['samples'], 4)
+            self.assertEqual(InstanceCostRollup.objects.filter(period=period).count(), 1)
+
+    def test_only_rolled_up_samples_are_pruned(self):
+        now = timezone.now()
+        self.record(now - timedelta(days=40), now - timedelta(days=35), now - timedelta(hours=1))
+
+        self.assertEqual(prune_samples(31), 0)
+
+        counts = roll_up_history(retention_days=31)
+
+        self.assertEqual(counts['pruned'], 2)
+        self.assertEqual(list(InstanceSample.objects.values_list('timestamp', flat=True)), [now - timedelta(hours=1)])
+        self.assertEqual(self.totals('hour')['samples'], 3)
+        self.assertEqual(self.totals('month')['cost'], 0.5 + 1.5 + 2.5)
+
+
+class RepriceHistoryTests(TestCase):
+    """
+    Repricing of history with corrected prices of OS and tenancy, that instances were priced for.
+    """
+
+    def setUp(self):
+        self.price_index = PriceIndex.from_rows([
+            ['us-east-1', 'm4.large', 'linux', 'shared', 0.1],
+            ['us-east-1', 'm4.large', 'mswin', 'shared', 0.2],
+            ['us-east-1', 'm4.large', 'linux', 'dedicated', 0.3],
+        ])
+        samples = []
+
+        for instance_id, os_name, tenancy in (
+            ('i-linux', 'linux', 'shared'), ('i-windows', 'mswin', 'shared'), ('i-dedicated', 'linux', 'dedicated'),
+            ('i-unknown', None, None),
+        ):
+            instance_data = {
+                'instance_id': instance_id, 'name': instance_id, 'instance_type': 'm4.large', 'os': os_name,
+                'tenancy': tenancy, 'region': 'us-east-1', 'state': 'running', 'ec2_cost_by_hour': 1.0,
+                'volumes_cost_by_month': 0.0,
+            }
+            Instance.objects.create(**instance_data)
+            samples.append((instance_data, 2.0, 2.0))
+
+        record_samples(samples)
+
+    def test_dry_run_writes_nothing(self):
+        with FakeAWS(SyntheticFleet(1)) as fake_aws, stand_in(fake_aws):
+            generation = current_generation()[0]
+            costs = dict(Instance.objects.values_list('instance_id', 'ec2_cost_by_hour'))
+
+            call_command('reprice_costs', dry_run=True, stdout=StringIO())
+
+            self.assertEqual(current_generation()[0], generation)
+            self.assertFalse(InstanceCostRollup.objects.exists())
+            self.assertEqual(dict(Instance.objects.values_list('instance_id', 'ec2_cost_by_hour')), costs)
+
+            call_command('reprice_costs', stdout=StringIO())
+
+        self.assertGreater(current_generation()[0], generation)
+        self.assertTrue(InstanceCostRollup.objects.exists())
+
+    def test_instances_are_repriced_for_their_os_and_tenancy(self):
+        counts = reprice_history(self.price_index)
+
+        self.assertEqual((counts['instances'], counts['skipped'], counts['samples']), (3, 1, 3))
+        self.assertEqual(
+            dict(Instance.objects.values_list('instance_id', 'ec2_cost_by_hour')),
+            {'i-linux': 0.1, 'i-windows': 0.2, 'i-dedicated': 0.3, 'i-unknown': 1.0},
+        )
+        self.assertEqual(
+            {instance_id: round(cost, 6) for instance_id, cost in InstanceSample.objects.values_list(
+                'instance_id', 'cost'
+            )},
+            {'i-linux': 0.2, 'i-windows': 0.4, 'i-dedicated': 0.6, 'i-unknown': 2.0},
+        )
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConditionalViewsTests(TestCase):
+    """
+    ETags of dashboard pages and API, that let clients revalidate them with 304 Not Modified.
+    """
+
+    def setUp(self):
+        # Numbers of generations start over in every test, so summaries of other tests must not be served.
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        with FakeAWS(SyntheticFleet(4, regions=1, volumes=1)) as fake_aws, stand_in(fake_aws):
+            refresh.refresh_instances_info()
+
+        self.instance_id = Instance.objects.values_list('instance_id', flat=True).first()
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def get(self, url, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+
+        return self.client.get(url, **headers)
+
+    def test_page_is_not_modified_within_generation(self):
+        url = reverse('ec2:instance', args=[self.instance_id])
+        # The first page sets CSRF cookie, that the ETag of the next pages is keyed on.
+        self.get(url)
+        response = self.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cookie', response['Vary'])
+        self.assertEqual(self.get(url, response['ETag']).status_code, 304)
+
+        new_generation('test')
+
+        self.assertEqual(self.get(url, response['ETag']).status_code, 200)
+
+    def test_page_is_sent_again_to_other_session(self):
+        url = reverse('ec2:instance', args=[self.instance_id])
+        self.get(url)
+        etag = self.get(url)['ETag']
+
+        self.client.cookies['csrftoken'] = 'x' * 64
+
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+        other_user = User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_login(other_user, backend='django.contrib.auth.backends.ModelBackend')
+
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_api_is_not_modified_within_generation(self):
+        url = reverse('ec2:api_summary')
+        response = self.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['instances'], 4)
+        self.assertEqual(self.get(url, response['ETag']).status_code, 304)
+
+        new_generation('test')
+
+        self.assertEqual(self.get(url, response['ETag']).status_code, 200)
+
+
+class InstancesApiTests(TestCase):
+    """
+    Pages of instances by `after` cursor, their size and selected fields.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        with FakeAWS(SyntheticFleet(5, regions=1, volumes=1)) as fake_aws, stand_in(fake_aws):
+            refresh.refresh_instances_info()
+
+        self.instances_ids = sorted(Instance.objects.values_list('instance_id', flat=True))
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def get(self, url=None, **params):
+        response = self.client.get(url or reverse('ec2:api_instances'), params)
+
+        return response.status_code, json.loads(response.content.decode('utf-8'))
+
+    def test_pages_follow_each_other(self):
+        pages, url = [], None
+        while True:
+            status, page = self.get(url, **({} if url else {'limit': 2}))
+            self.assertEqual(status, 200)
+            pages.append([result['instance_id'] for result in page['results']])
+            url = page['next']
+            if url is None:
+                break
+
+        self.assertEqual(pages, [self.instances_ids[0:2], self.instances_ids[2:4], self.instances_ids[4:]])
+
+    def test_last_full_page_has_no_next(self):
+        status, page = self.get(limit=2, after=self.instances_ids[2])
+
+        self.assertEqual([result['instance_id'] for result in page['results']], self.instances_ids[3:])
+        self.assertIsNone(page['next'])
+
+        status, page = self.get(after=self.instances_ids[-1])
+
+        self.assertEqual((status, page['results'], page['next']), (200, [], None))
+
+    def test_limit_is_capped(self):
+        with mock.patch('ec2.views.API_MAX_PAGE_SIZE', 3):
+            status, page = self.get(limit=100)
+
+        self.assertEqual(len(page['results']), 3)
+        self.assertIn('limit=100', page['next'])
+        self.assertIn('after={}'.format(self.instances_ids[2]), page['next'])
+
+    def test_invalid_limit_is_rejected(self):
+        self.assertEqual(self.get(limit='many')[0], 400)
+        self.assertEqual(self.get(limit=0)[0], 400)
+
+    def test_fields_are_selected(self):
+        status, page = self.get(fields='state,instance_type', limit=1)
+
+        self.assertEqual(set(page['results'][0]), {'instance_id', 'state', 'instance_type'})
+        self.assertIn('fields=state%2Cinstance_type', page['next'])
+
+    def test_unknown_fields_are_rejected(self):
+        status, page = self.get(fields='state,password')
+
+        self.assertEqual(status, 400)
+        self.assertIn('Unknown field', page['error'])
+
+
+class ExportTests(TestCase):
+    """
+    Streamed exports of instances, whose rows are read from database while response is sent.
+    """
+
+    def setUp(self):
+        with FakeAWS(SyntheticFleet(5, regions=2, volumes=1)) as fake_aws, stand_in(fake_aws):
+            refresh.refresh_instances_info()
+
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def export(self, export_format='csv', **params):
+        return self.client.get(reverse('ec2:export', args=['instances', export_format]), params)
+
+    def test_csv_is_streamed(self):
+        response = self.export()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="instances.csv"')
+
+        content = iter(response.streaming_content)
+        with self.assertNumQueries(0):
+            header = next(content)
+        with self.assertNumQueries(1):
+            rows = list(content)
+
+        self.assertEqual(next(csv.reader([header.decode('utf-8')])), list(INSTANCE_FIELDS))
+        self.assertEqual(len(rows), 5)
+
+    def test_rows_are_filtered(self):
+        region = Instance.objects.values_list('region', flat=True).first()
+        expected = sorted(Instance.objects.filter(region=region).values_list('instance_id', flat=True))
+
+        lines = b''.join(self.export(region=region).streaming_content).decode('utf-8').splitlines()
+        rows = list(csv.DictReader(lines))
+
+        self.assertEqual(sorted(row['instance_id'] for row in rows), expected)
+        self.assertTrue(all(row['region'] == region for row in rows))
+
+    def test_ndjson_has_a_line_per_instance(self):
+        response = self.export('ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(set(json.loads(lines[0])), set(INSTANCE_FIELDS))
+
+    def test_wrong_filter_is_rejected(self):
+        self.assertEqual(self.export(since='yesterday').status_code, 400)
+
+
+class VolumeIndexesMigrationTests(TransactionTestCase):
+    """
+    Duplicate instances are deleted before unique index of instance id is built, look at `0007_volume_indexes`.
+    """
+
+    before = [('ec2', '0006_instance_region')]
+    after = [('ec2', '0007_volume_indexes')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.addCleanup(self.migrate, self.executor.loader.graph.leaf_nodes())
+        self.migrate(self.before)
+
+    def migrate(self, targets):
+        self.executor.loader.build_graph()
+        self.executor.migrate(targets)
+
+        return self.executor.loader.project_state(targets).apps
+
+    def test_latest_duplicate_is_kept(self):
+        Instance = self.executor.loader.project_state(self.before).apps.get_model('ec2', 'Instance')
+        for instance_id, name in (('i-dup', 'first'), ('i-single', 'single'), ('i-dup', 'second'), ('i-dup', 'last')):
+            Instance.objects.create(
+                instance_id=instance_id, name=name, instance_type='m4.large', state='running',
+                datetime_of_current_ec2_info=timezone.now(), volumes=json.dumps([{'volume_id': 'vol-{}'.format(name)}]),
+            )
+
+        apps = self.migrate(self.after)
+        Instance, Volume = apps.get_model('ec2', 'Instance'), apps.get_model('ec2', 'Volume')
+
+        self.assertEqual(
+            sorted(Instance.objects.values_list('instance_id', 'name', 'volumes')),
+            [('i-dup', 'last', '[{"volume_id": "vol-last"}]'), ('i-single', 'single', '[{"volume_id": "vol-single"}]')],
+        )
+
+        # Volumes are attached to the kept rows only.
+        kept = Instance.objects.get(instance_id='i-dup')
+        Volume.objects.create(volume_id='vol-last', volume_type='gp2', size=8, instance=kept)
+
+        self.assertEqual(list(Volume.objects.values_list('instance__name', flat=True)), ['last'])
+
+
+class LiveUpdatesTests(TestCase):
+    """
+    Diffs between generations, that open pages are patched with, and their Server-Sent Events.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch.dict(live.latest, generation=None, checked_at=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for instance_id in ('i-1', 'i-2', 'i-3'):
+            Instance.objects.create(
+                instance_id=instance_id, name=instance_id, instance_type='m4.large', state='running',
+                ec2_cost_by_hour=0.1, overall_cost_all_time=10.0,
+            )
+        self.since = new_generation('test').pk
+        fleet_summary(self.since)
+
+        Instance.objects.filter(instance_id='i-1').update(state='stopped')
+        Instance.objects.filter(instance_id='i-2').delete()
+        Instance.objects.create(
+            instance_id='i-4', name='i-4', instance_type='m4.large', state='running', overall_cost_all_time=5.0,
+        )
+        self.generation = new_generation('test').pk
+
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def test_diff_has_changed_values_only(self):
+        diff = live.build_generation_diff(self.since, self.generation)
+
+        self.assertEqual(diff['generation'], self.generation)
+        self.assertFalse(diff['reset'])
+        self.assertEqual(set(diff['instances']), {'i-1', 'i-4'})
+        self.assertEqual(diff['instances']['i-1'], {'state': 'stopped'})
+        self.assertEqual((diff['instances']['i-4']['name'], diff['instances']['i-4']['state']), ('i-4', 'running'))
+        self.assertEqual((diff['added'], diff['removed']), (['i-4'], ['i-2']))
+        self.assertEqual(diff['totals'], {'all_instances_cost': 25.0})
+
+    def test_expired_previous_summary_resets_diff(self):
+        cache.delete(cache_key('fleet-summary', self.since))
+
+        diff = live.build_generation_diff(self.since, self.generation)
+
+        self.assertTrue(diff['reset'])
+        self.assertEqual(set(diff['instances']), {'i-1', 'i-3', 'i-4'})
+        self.assertEqual(diff['instances']['i-3']['state'], 'running')
+        self.assertEqual((diff['added'], diff['removed']), ([], []))
+        self.assertEqual(diff['totals'], {'all_instances_cost': 25.0, 'all_instances_month_to_date_cost': 0})
+
+    def test_diff_is_streamed_as_event(self):
+        response = self.client.get(reverse('ec2:live'), {'generation': 0}, HTTP_LAST_EVENT_ID=str(self.since))
+        events = iter(response.streaming_content)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(next(events), b'retry: 5000\n\n')
+
+        event_id, name, data = next(events).decode('utf-8').rstrip('\n').split('\n')
+        response.close()
+
+        self.assertEqual((event_id, name), ('id: {}'.format(self.generation), 'event: generation'))
+        self.assertEqual(json.loads(data[len('data: '):]), live.build_generation_diff(self.since, self.generation))
+
+    def test_wrong_generation_is_rejected(self):
+        self.assertEqual(self.client.get(reverse('ec2:live'), {'generation': 'last'}).status_code, 400)
+
+
+class DatabaseTests(TestCase):
+    """
+    Routing between primary and replica, snapshots of reads and setup of SQLite connections.
+    """
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.addCleanup(routing.update, dict(routing))
+
+    def test_dashboard_reads_primary_without_replica(self):
+        self.assertEqual(self.router.db_for_read(Instance), 'default')
+        self.assertEqual(self.router.db_for_write(Instance), 'default')
+
+    def test_dashboard_reads_replica(self):
+        with mock.patch.dict(settings.DATABASES, replica=settings.DATABASES['default']):
+            self.assertEqual(self.router.db_for_read(Instance), 'replica')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Instance), 'default')
+            self.assertFalse(self.router.allow_migrate('replica', 'ec2'))
+            self.assertTrue(self.router.allow_migrate('default', 'ec2'))
+
+            routing['primary_only'] = True
+
+            self.assertEqual(self.router.db_for_read(Instance), 'default')
+
+    def test_snapshot_reads_within_transaction(self):
+        with snapshot() as using:
+            self.assertEqual(using, 'default')
+            self.assertTrue(connection.in_atomic_block)
+            self.assertEqual(Instance.objects.count(), 0)
+
+    def test_only_sqlite_files_are_switched_to_wal(self):
+        with tempfile.TemporaryDirectory(prefix='ec2-tests-') as directory:
+            for name, journal_mode in ((os.path.join(directory, 'db.sqlite3'), 'wal'), (':memory:', 'memory')):
+                database = DatabaseWrapper(dict(connection.settings_dict, NAME=name), alias='journal-mode')
+                try:
+                    with database.cursor() as cursor:
+                        cursor.execute('PRAGMA journal_mode')
+                        self.assertEqual(cursor.fetchone()[0], journal_mode)
+                finally:
+                    database.close()
+
+
+class PriceCatalogCacheTests(SimpleTestCase):
+    """
+    Cache of price catalog against a local HTTP stand-in of catalog`s server.
+    """
+
+    def setUp(self):
+        self.fake_aws = FakeAWS(SyntheticFleet(1), catalog_types=20).start()
+        self.addCleanup(self.fake_aws.stop)
+        cache_dir = tempfile.TemporaryDirectory(prefix='ec2-tests-')
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+
+    def price_catalog(self, ttl=0):
+        return PriceCatalogCache(self.fake_aws.price_url, parse_price_rows, cache_dir=self.cache_dir, ttl=ttl)
+
+    def serve(self, catalog):
+        self.fake_aws.catalog = catalog
+        self.fake_aws.catalog_version += 1
+
+    def test_catalog_is_downloaded_and_revalidated(self):
+        price_catalog = self.price_catalog()
+        rows = price_catalog.get()
+
+        self.assertTrue(rows)
+        self.assertEqual(price_catalog.get(), rows)
+        self.assertEqual(self.price_catalog().get(), rows)
+        self.assertEqual(self.fake_aws.reset_calls(), {'GetPriceCatalog': 3})
+        self.assertEqual(
+            {key: price_catalog.stats()[key] for key in ('requests', 'downloads', 'not_modified')},
+            {'requests': 2, 'downloads': 1, 'not_modified': 1},
+        )
+
+    def test_fresh_copy_is_served_without_request(self):
+        rows = self.price_catalog(ttl=60).get()
+
+        self.assertEqual(self.price_catalog(ttl=60).get(), rows)
+        self.assertEqual(self.fake_aws.reset_calls(), {'GetPriceCatalog': 1})
+
+    def test_garbage_keeps_previous_catalog(self):
+        price_catalog = self.price_catalog()
+        rows = price_catalog.get()
+        self.serve('<html><body>Service Unavailable</body></html>')
+
+        self.assertEqual(price_catalog.get(), rows)
+        self.assertEqual(self.price_catalog().get(), rows)
+        self.assertEqual(price_catalog.stats()['failures'], 1)
+
+    def test_garbage_without_previous_catalog_fails(self):
+        self.serve('callback({vers:0.01,config:{regions:[]}});')
+
+        with self.assertRaises(ValueError):
+            self.price_catalog().get()
+
+
+def scalar_volume_cost(volume_type, size, iops=None):
+    """
+    Method calculate volume`s cost the way scalar helpers did before fleet costs were vectorized.
+    """
+    if volume_type in ('gp2', 'st1', 'sc1'):
+        return {'gp2': 0.10, 'st1': 0.045, 'sc1': 0.025}[volume_type] * size * 1024 * 12 / (24 * 30)
+    if volume_type == 'io1':
+        return 0.10 * iops * 1000 * 30 / 30
+    return None
+
+
+def scalar_total_month_cost(volumes_total, ec2_by_hour, now):
+    """
+    Method calculate month`s cost the way scalar helpers did before, with explicit reference datetime.
+    """
+    return round(timezone.localtime(now).day * (ec2_by_hour * 24 + volumes_total / 30), 2)
+
+
+def scalar_overall_instance_cost(month_volumes_cost, ec2_by_hour, created_date, now):
+    """
+    Method calculate overall cost the way scalar helpers did before, with explicit reference datetime.
+    """
+    return round((now - created_date).days * 24 * (month_volumes_cost / 30 / 24 + ec2_by_hour), 2)
+
+
+class FleetCostsTests(SimpleTestCase):
+    """
+    Vectorized fleet costs are equal to scalar ones over random fleets and intervals.
+    """
+
+    def random_fleet(self, generator, now, instances):
+        ec2_by_hour = [round(generator.uniform(0, 5), 4) for _ in range(instances)]
+        created_dates = [now - timedelta(seconds=generator.randint(0, 400 * 24 * 3600)) for _ in range(instances)]
+        volumes = [
+            (generator.randrange(instances), generator.choice(['gp2', 'st1', 'sc1', 'io1', 'standard']),
+             generator.randint(1, 2000), generator.randint(100, 20000))
+            for _ in range(instances * 2)
+        ]
+
+        return ec2_by_hour, created_dates, volumes
+
+    def assertEqualToScalar(self, ec2_by_hour, created_dates, volumes, now):
+        owners, types, sizes, iops = zip(*volumes)
+        costs = fleet_costs(ec2_by_hour, created_dates, owners, types, sizes, iops, now)
+
+        month_volumes = [0.0] * len(ec2_by_hour)
+        for index, (owner, volume_type, size, volume_iops) in enumerate(volumes):
+            expected = scalar_volume_cost(volume_type, size, volume_iops)
+            self.assertEqual(volume_cost(volume_type, size, volume_iops), expected)
+            self.assertAlmostEqual(costs['volume_costs'][index], round(expected or 0, 2))
+            month_volumes[owner] += expected or 0
+
+        for index, created_date in enumerate(created_dates):
+            month = scalar_total_month_cost(month_volumes[index], ec2_by_hour[index], now)
+            overall = scalar_overall_instance_cost(month_volumes[index], ec2_by_hour[index], created_date, now)
+
+            self.assertAlmostEqual(costs['overall_cost_by_month'][index], month)
+            self.assertAlmostEqual(costs['overall_cost_all_time'][index], overall)
+            self.assertAlmostEqual(total_month_cost(month_volumes[index], ec2_by_hour[index], now), month)
+            self.assertAlmostEqual(
+                overall_instance_cost(month_volumes[index], ec2_by_hour[index], created_date, now), overall
+            )
+
+    def test_random_fleets(self):
+        generator = random.Random(10)
+
+        for _ in range(20):
+            now = timezone.make_aware(datetime(2016, 1, 1) + timedelta(seconds=generator.randint(0, 365 * 24 * 3600)))
+            self.assertEqualToScalar(*self.random_fleet(generator, now, generator.randint(1, 30)), now=now)
+
+    def test_month_crossing_interval(self):
+        now = timezone.make_aware(datetime(2016, 3, 1, 0, 30))
+        created_dates = [
+            timezone.make_aware(datetime(2016, 2, 29, 23, 0)),
+            timezone.make_aware(datetime(2016, 2, 28, 1, 0)),
+            timezone.make_aware(datetime(2016, 1, 31, 0, 45)),
+        ]
+
+        # In UTC reference datetime still belongs to February, days of month are counted in current time zone.
+        self.assertEqual(timezone.make_naive(now, timezone.utc).month, 2)
+        self.assertEqual(total_month_cost(30.0, 1.0, now), 25.0)
+        self.assertEqual([overall_instance_cost(0, 1.0, created_date, now) for created_date in created_dates],
+                         [0.0, 24.0, 696.0])
+        self.assertEqualToScalar([1.0, 0.5, 2.0], created_dates, [(0, 'gp2', 8, None), (2, 'io1', 100, 300)], now)
+
+    def test_naive_datetimes_are_taken_in_current_time_zone(self):
+        now = datetime(2016, 3, 1, 0, 30)
+        created_date = datetime(2016, 2, 1, 12, 0)
+
+        self.assertEqual(total_month_cost(30.0, 1.0, now), total_month_cost(30.0, 1.0, timezone.make_aware(now)))
+        self.assertEqual(
+            overall_instance_cost(30.0, 1.0, created_date, now),
+            overall_instance_cost(30.0, 1.0, timezone.make_aware(created_date), timezone.make_aware(now))
+        )
+
+
+class AdaptiveRegionSchedulerTests(SimpleTestCase):
+    """
+    Intervals of regions adapt to their changes, refreshes requested out of cycle are never dropped.
+    """
+
+    def setUp(self):
+        self.scheduler = BackgroundScheduler()
+        self.scheduler.start()
+        self.addCleanup(self.scheduler.shutdown)
+        self.changes = 0
+        self.refreshed = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def refresh(self, region):
+        self.refreshed.append(region)
+        self.started.set()
+        self.release.wait(5)
+
+        return {'inserted': 0, 'deleted': 0, 'changed': self.changes}
+
+    def region_scheduler(self):
+        return AdaptiveRegionScheduler(self.scheduler, self.refresh, interval=20, min_interval=5, max_interval=60)
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_adapt(self):
+        region_scheduler = self.region_scheduler()
+
+        self.assertEqual(region_scheduler.adapt(20, 3), 10)
+        self.assertEqual(region_scheduler.adapt(20, 0), 30)
+        self.assertEqual(region_scheduler.adapt(8, 1), 5)
+        self.assertEqual(region_scheduler.adapt(50, 0), 60)
+
+    def test_run_reschedules_with_adapted_interval(self):
+        region_scheduler = self.region_scheduler()
+        region_scheduler.add_region('us-east-1')
+        self.changes = 2
+
+        counts = region_scheduler.run('us-east-1')
+
+        self.assertEqual(counts['interval_seconds'], 20 * 60)
+        self.assertIsNone(counts['lag_seconds'])
+        self.assertEqual(region_scheduler.intervals['us-east-1'], 10)
+        self.assertEqual(
+            self.scheduler.get_job(region_scheduler.job_id('us-east-1')).trigger.interval, timedelta(minutes=10)
+        )
+
+        self.changes = 0
+        region_scheduler.run('us-east-1')
+
+        self.assertEqual(region_scheduler.intervals['us-east-1'], 15)
+
+    def test_run_now_adds_region_and_runs_it(self):
+        region_scheduler = self.region_scheduler()
+
+        region_scheduler.run_now('us-east-1')
+        self.wait_for(lambda: self.refreshed)
+
+        self.assertEqual(self.refreshed, ['us-east-1'])
+        self.assertEqual(region_scheduler.intervals['us-east-1'], 30)
+
+    def test_run_now_while_running_is_queued(self):
+        region_scheduler = self.region_scheduler()
+        self.release.clear()
+
+        region_scheduler.run_now('us-east-1')
+        self.assertTrue(self.started.wait(5))
+        region_scheduler.run_now('us-east-1')
+        region_scheduler.run_now('us-east-1')
+        self.release.set()
+        self.wait_for(lambda: len(self.refreshed) == 2 and not region_scheduler.running)
+
+        self.assertEqual(self.refreshed, ['us-east-1', 'us-east-1'])
+        self.assertFalse(region_scheduler.pending)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    """
+    Queries and latency of views, and their exposition in Prometheus text format.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.dict(view_stats, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def test_cursors_count_statements_until_stopped(self):
+        # Counting is switched on the connection itself, not on `django.db.connection` proxy.
+        connection = connections['default']
+        start_counting(connection)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(list(cursor), [(1,)])
+            cursor.executemany('UPDATE ec2_refreshgeneration SET id = id WHERE id = %s', [[1], [2]])
+        Instance.objects.count()
+
+        self.assertEqual(stop_counting(connection), 3)
+        self.assertNotIn('make_cursor', vars(connection))
+        self.assertNotIn('make_debug_cursor', vars(connection))
+
+        Instance.objects.count()
+
+        self.assertFalse(hasattr(connection, 'metrics_queries'))
+        self.assertEqual(stop_counting(connection), 0)
+
+    def test_views_are_recorded(self):
+        self.client.get(reverse('ec2:api_summary'))
+        self.client.get(reverse('ec2:api_summary'))
+
+        stats = view_stats[('ec2:api_summary', 'GET', '200')]
+
+        self.assertEqual(stats['count'], 2)
+        self.assertGreater(stats['queries'], 0)
+        self.assertEqual(stats['buckets'][-1], 2)
+        self.assertNotIn('make_cursor', vars(connections['default']))
+
+    def test_exposition(self):
+        text = exposition([
+            ('ec2_empty', 'gauge', 'Nothing.', []),
+            ('ec2_requests', 'counter', 'Requests.', [
+                ('', {'view': 'ec2:index', 'method': 'GET'}, 2),
+                ('', {'view': 'say "hi"\\\n'}, 1.5),
+            ]),
+            ('ec2_generation', 'gauge', 'Generation.', [('', {}, 7)]),
+        ])
+
+        self.assertEqual(text, '\n'.join([
+            '# HELP ec2_requests Requests.',
+            '# TYPE ec2_requests counter',
+            'ec2_requests{method="GET",view="ec2:index"} 2.0',
+            'ec2_requests{view="say \\"hi\\"\\\\\\n"} 1.5',
+            '# HELP ec2_generation Generation.',
+            '# TYPE ec2_generation gauge',
+            'ec2_generation 7.0',
+        ]) + '\n')
+
+    def test_metrics_view(self):
+        self.client.get(reverse('ec2:api_summary'))
+
+        self.assertEqual(self.client.get(reverse('ec2:metrics')).status_code, 403)
+
+        response = self.client.get(reverse('ec2:metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        lines = response.content.decode('utf-8').splitlines()
+        labels = 'method="GET",status="200",view="ec2:api_summary"'
+
+        self.assertEqual(response['Content-Type'], CONTENT_TYPE)
+        self.assertIn('# TYPE ec2_view_request_seconds histogram', lines)
+        self.assertIn('ec2_view_request_seconds_bucket{{le="+Inf",{}}} 1.0'.format(labels), lines)
+        self.assertIn('ec2_view_request_seconds_count{{{}}} 1.0'.format(labels), lines)
+        self.assertIn('ec2_generation 0.0', lines)
@@ -0,0 +1,116 @@
+"""
+Triggers of out-of-cycle refreshes: web process stores requests, scheduler takes them on its next poll.
+
+Requests come from users manually and from EC-2 state-change events, that EventBridge posts to webhook.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Instance, RefreshRequest
+
+
+def request_refresh(region=None, instance_id=None):
+    """
+    Method stores request to refresh a region or a single instance.
+
+    Region of instance is looked up, if it is omitted.
+
+    Arguments:
+        region (str): Region to refresh.
+        instance_id (str): Id of instance to refresh.
+
+    Returns:
+        Stored request (RefreshRequest).
+
+    Raises:
+        ValueError: If neither region nor known instance is given.
+    """
+    if instance_id and not region:
+        region = Instance.objects.filter(instance_id=instance_id).values_list('region', flat=True).first()
+
+    if not region:
+        raise ValueError('Region or id of known instance is required.')
+
+    return RefreshRequest.objects.create(region=region, instance_id=instance_id or None)
+
+
+STATE_CHANGE_SOURCE = 'aws.ec2'
+STATE_CHANGE_DETAIL_TYPE = 'EC2 Instance State-change Notification'
+
+
+def state_changes(payload):
+    """
+    Method extracts affected instances from EventBridge (CloudWatch Events) EC-2 state-change events.
+
+    Arguments:
+        payload (dict | list): Single event or list of events as posted by EventBridge.
+
+    Reference:
+        https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/monitoring-instance-state-changes.html
+
+    Returns:
+        List of tuples of region (str), instance`s id (str) and its new state (str).
+
+    Raises:
+        ValueError: If any event is not an EC-2 instance state-change one.
+    """
+    events = payload if isinstance(payload, list) else [payload]
+    changes = []
+
+    for event in events:
+        if not isinstance(event, dict) or (event.get('source'), event.get('detail-type')) != (
+            STATE_CHANGE_SOURCE, STATE_CHANGE_DETAIL_TYPE
+        ):
+            raise ValueError('Not an EC-2 instance state-change event.')
+
+        detail = event.get('detail') or {}
+        if not event.get('region') or not detail.get('instance-id'):
+            raise ValueError('Event has no region or instance id.')
+
+        changes.append((event['region'], detail['instance-id'], detail.get('state')))
+
+    return changes
+
+
+def request_state_changes_refresh(payload):
+    """
+    Method stores request to re-collect every instance, that state-change events are about, look at `state_changes`.
+
+    Returns:
+        Stored requests (list).
+    """
+    return [request_refresh(region, instance_id) for region, instance_id, state in state_changes(payload)]
+
+
+def take_refresh_requests(keep_days=1):
+    """
+    Method marks pending requests as handled and deletes handled ones older than `keep_days`.
+
+    Requests for the same target are merged, a request for a region covers requests for its instances.
+
+    Returns:
+        targets (dict): {'region': ['instance_id', ...] or None, ...}, None stands for the whole region.
+    """
+    now = timezone.now()
+    targets = {}
+
+    with transaction.atomic():
+        pending = RefreshRequest.objects.filter(datetime_of_handling__isnull=True).order_by('pk')
+        requests = list(pending.values_list('pk', 'region', 'instance_id'))
+
+        if requests:
+            pending.filter(pk__lte=requests[-1][0]).update(datetime_of_handling=now)
+        RefreshRequest.objects.filter(datetime_of_handling__lt=now - timedelta(days=keep_days)).delete()
+
+    for _, region, instance_id in requests:
+        if instance_id is None:
+            targets[region] = None
+        elif region not in targets or targets[region] is not None:
+            targets.setdefault(region, [])
+            if instance_id not in targets[region]:
+                targets[region].append(instance_id)
+
+    return targets
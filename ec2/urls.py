@@ -10,5 +10,19 @@ urlpatterns = [
     url(r'^$', views.Homepage.as_view(), name='index'),
     url(r'^login_error/$', views.LoginError.as_view(), name='login_error'),
     url(r'^after_login_redirect/$', login_required(views.AfterLoginRedirect.as_view()), name='after_login_redirect'),
+    url(r'^api/instances/$', login_required(views.InstancesApi.as_view()), name='api_instances'),
+    url(
+        r'^api/instances/(?P<instance>[-\w\+%_&]+)/$', login_required(views.InstanceApi.as_view()), name='api_instance'
+    ),
+    url(r'^api/summary/$', login_required(views.FleetSummaryApi.as_view()), name='api_summary'),
+    url(r'^events/ec2/$', views.EC2Events.as_view(), name='ec2_events'),
+    url(r'^metrics/$', views.Metrics.as_view(), name='metrics'),
+    url(r'^live/$', login_required(views.LiveUpdates.as_view()), name='live'),
+    url(r'^refresh/$', login_required(views.RefreshNow.as_view()), name='refresh'),
+    url(
+        r'^export/(?P<kind>instances|history)\.(?P<export_format>csv|ndjson)$',
+        login_required(views.Export.as_view()),
+        name='export'
+    ),
     url(r'^(?P<instance>[-\w\+%_&]+)/$', login_required(views.Instance.as_view()), name='instance')
 ]
@@ -0,0 +1,75 @@
+"""
+Helpers for bulk database operations.
+"""
+
+from django.db.models import Case, Value, When
+
+BATCH_SIZE = 500
+
+
+def batches(items, size=BATCH_SIZE):
+    """
+    Method splits list into chunks, so queries stay below database`s limit of parameters.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bulk_update(objects, fields, batch_size=BATCH_SIZE):
+    """
+    Method updates fields of objects with a single `UPDATE ... SET field = CASE ...` query per batch.
+
+    Django 1.10 has no `QuerySet.bulk_update`, so this is its minimal equivalent.
+
+    Arguments:
+        objects (list): Model`s objects with already changed attributes.
+        fields (list): Names of fields to write.
+        batch_size (int): Amount of objects per query.
+    """
+    if not objects or not fields:
+        return
+
+    model = objects[0].__class__
+
+    for batch in batches(objects, batch_size):
+        updates = {}
+
+        for name in fields:
+            field = model._meta.get_field(name)
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, name), output_field=field)) for obj in batch]
+            updates[name] = Case(*whens, output_field=field)
+
+        model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+
+
+def chunked_values(queryset, fields, chunk_size=BATCH_SIZE):
+    """
+    Method iterates over rows of queryset chunk by chunk, paging by primary key.
+
+    Every chunk is a separate query, that starts after the last primary key of previous chunk, so memory stays
+    flat on any database backend regardless of amount of rows.
+
+    Arguments:
+        queryset (QuerySet): Rows to iterate over, its ordering is replaced with primary key`s one.
+        fields (list): Names of fields to get.
+        chunk_size (int): Amount of rows per query.
+
+    Returns:
+        Generator of rows` values (tuple) in order of `fields`.
+    """
+    last_pk = None
+
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+
+        for row in rows:
+            yield row[1:]
+
+        if len(rows) < chunk_size:
+            return
+
+        last_pk = rows[-1][0]
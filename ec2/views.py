@@ -2,16 +2,91 @@
 Views for EC-2 application to work with AWS`s EC-2 instances.
 """
 
-from django.shortcuts import get_object_or_404
+import hashlib
+import json
+
+from django.conf import settings
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse,
+)
 from django.views.generic import RedirectView
 from django.core.urlresolvers import reverse
+from django.utils.decorators import method_decorator
+from django.utils.crypto import constant_time_compare
+from django.utils.http import is_safe_url, urlencode
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
 from django.views.generic import View
-from django.shortcuts import render
+from django.shortcuts import redirect, render
 from django.views import generic
 
+from .export import PERIODS, RENDERERS, history_rows, instances_rows, parse_moment
+from .generation import current_generation
+from .live import generation_events
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
 from .models import Instance as EC2Instance
+from .summary import fleet_summary, instance_daily_costs
+from .triggers import request_refresh, request_state_changes_refresh
+
+
+def request_generation(request):
+    """
+    Method looks current generation up once per request.
+
+    Returns:
+        Tuple of generation`s number (int) and date and time of its creation (datetime).
+    """
+    if not hasattr(request, 'generation'):
+        request.generation = current_generation()
+
+    return request.generation
+
+
+def generation_etag(request, *args, **kwargs):
+    """
+    Method provides ETag of response, that changes along with generation of data.
+    """
+    return 'generation-{}'.format(request_generation(request)[0])
+
+
+def generation_last_modified(request, *args, **kwargs):
+    """
+    Method provides Last-Modified of response, that is a date and time of generation`s creation.
+    """
+    return request_generation(request)[1]
+
+
+# Pages are rendered from data of current generation only, so while generation is the same,
+# client`s copy is up to date and is answered with 304 without rendering.
+conditional_on_generation = method_decorator(
+    condition(etag_func=generation_etag, last_modified_func=generation_last_modified), name='get'
+)
+
+
+def page_etag(request, *args, **kwargs):
+    """
+    Method provides ETag of HTML page, that changes along with generation of data, user and CSRF cookie, so
+    a cached copy never shows other user`s session or posts a form with token, that login rotated.
+    """
+    session = '{}:{}'.format(request.user.pk, request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
 
+    return '{}-{}'.format(generation_etag(request), hashlib.sha1(session.encode('utf-8')).hexdigest()[:16])
 
+
+def conditional_on_page(view):
+    """
+    Decorator of HTML pages, that answers 304, while generation and session are the same, look at `page_etag`.
+
+    Last-Modified is not sent, as it does not change with session, and every response varies on cookies.
+    """
+    view = method_decorator(condition(etag_func=page_etag), name='get')(view)
+
+    return method_decorator(vary_on_cookie, name='get')(view)
+
+
+@conditional_on_page
 class Homepage(View):
     """
     View works with home page and provides empty (no instances) template, either list of
@@ -31,23 +106,24 @@ class Homepage(View):
             `no_instance.html`: If AWS-account has no instances or
             `homepage.html`
         """
-        if EC2Instance.objects.all().count() == 0:
+        if not fleet_summary(request_generation(request)[0])['instances']:
             return render(request, 'no_instances.html', )
 
         return render(request, self.template_name, )
 
 
-class Instance(generic.ListView):
+@conditional_on_page
+class Instance(generic.TemplateView):
     """
     View present instance`s details and selection all instance menu.
 
-    Model:
-        `EC2Instance`
+    Data is taken from fleet summary of current generation, so a page view costs a single query,
+    look at `summary.fleet_summary`. Sidebar and billing of all instances are cached as template fragments
+    per generation.
 
     Templates:
         `instance.html`: Detail for corresponding instance.
     """
-    model = EC2Instance
     template_name = 'instance.html'
 
     def get_context_data(self, **kwargs):
@@ -56,24 +132,355 @@ class Instance(generic.ListView):
             kwargs (dict): Request data to handle.
 
         Return:
-            context (dict): {..., 'instances': ...,
+            context (dict): {..., 'generation': ...,
+                             'instances': ...,
                              'instance': ...,
-                             'all_instances_cost': ...}}
-            instances (querySet): QuerySet of instances from EC2Instance model.
-            instance (EC2Instance): Needed object from `EC2Instance` model by id.
+                             'all_instances_cost': ...,
+                             'month_to_date_cost': ...,
+                             'all_instances_month_to_date_cost': ...,
+                             'daily_costs': ...}}
+            generation (int): Number of generation of summary, that fragments are cached by.
+            instances (list): Values (dict) of instances from fleet summary.
+            instance (dict): Values of needed instance from fleet summary by id.
             all_instances_cost (float): Total cost of all instances from creation to now.
+            month_to_date_cost (float): Cost of instance since beginning of month from history.
+            all_instances_month_to_date_cost (float): Cost of all instances since beginning of month from history.
+            daily_costs (list): Daily rollups of instance`s cost for recent days.
         """
         context = super(Instance, self).get_context_data(**kwargs)
 
-        context['instances'] = EC2Instance.objects.all()
-        context['instance'] = get_object_or_404(EC2Instance, instance_id=self.kwargs['instance'])
+        summary = fleet_summary(request_generation(self.request)[0])
+        generation = summary['generation']
+
+        instance = summary['instances_by_id'].get(self.kwargs['instance'])
+        if instance is None:
+            raise Http404('No instance matches the given query.')
 
-        all_instances_cost = sum([instance.overall_cost_all_time for instance in EC2Instance.objects.all()])
-        context['all_instances_cost'] = round(all_instances_cost, 2)
+        context['generation'] = generation
+        context['instances'] = summary['instances']
+        context['instance'] = instance
+        context['all_instances_cost'] = summary['all_instances_cost']
+
+        context['month_to_date_cost'] = round(summary['month_to_date_costs'].get(instance['instance_id'], 0), 2)
+        context['all_instances_month_to_date_cost'] = summary['all_instances_month_to_date_cost']
+        context['daily_costs'] = instance_daily_costs(instance['instance_id'], generation)
 
         return context
 
 
+API_FIELDS = (
+    'instance_id', 'name', 'instance_type', 'account', 'region', 'state', 'public_ip_address', 'private_ip_address',
+    'vpc_id', 'security_group', 'volumes', 'ec2_cost_by_hour', 'volumes_cost_by_month', 'overall_cost_by_month',
+    'overall_cost_all_time', 'datetime_of_creation', 'datetime_of_current_ec2_info', 'datetime_of_last_seen',
+)
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+
+def api_fields(request):
+    """
+    Method gets fields, that client selected with `fields` parameter, all `API_FIELDS` if omitted.
+
+    Returns:
+        Tuple of fields (str), `instance_id` always goes first, or None if any field is unknown.
+    """
+    selected = [field for field in request.GET.get('fields', '').split(',') if field]
+    if not selected:
+        return API_FIELDS
+
+    if any(field not in API_FIELDS for field in selected):
+        return None
+
+    return ('instance_id',) + tuple(field for field in selected if field != 'instance_id')
+
+
+@conditional_on_generation
+@method_decorator(gzip_page, name='get')
+class InstancesApi(View):
+    """
+    View provides JSON list of instances ordered by id, paginated by cursor.
+
+    Parameters:
+        `after`: Id of the last instance of previous page, the first page is returned if omitted.
+        `limit`: Amount of instances per page, up to `API_MAX_PAGE_SIZE`.
+        `fields`: Comma-separated fields to return, look at `API_FIELDS`.
+    """
+
+    def get(self, request):
+        """
+        Arguments:
+            request (dict): Request data to handle.
+
+        Return:
+            JSON {'generation': ..., 'results': [...], 'next': ...}
+            generation (int): Number of generation of data.
+            results (list): Instances` fields by name.
+            next (str): URL of the next page or null for the last page.
+        """
+        fields = api_fields(request)
+        if fields is None:
+            return JsonResponse({'error': 'Unknown field, allowed are: {}.'.format(', '.join(API_FIELDS))}, status=400)
+
+        try:
+            limit = min(int(request.GET.get('limit', API_PAGE_SIZE)), API_MAX_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({'error': 'Limit should be an integer.'}, status=400)
+        if limit < 1:
+            return JsonResponse({'error': 'Limit should be positive.'}, status=400)
+
+        instances = EC2Instance.objects.order_by('instance_id')
+        if request.GET.get('after'):
+            instances = instances.filter(instance_id__gt=request.GET['after'])
+
+        results = list(instances.values(*fields)[:limit + 1])
+
+        next_url = None
+        if len(results) > limit:
+            results = results[:limit]
+            params = dict(request.GET.items(), after=results[-1]['instance_id'])
+            next_url = '{}?{}'.format(request.path, urlencode(params))
+
+        return JsonResponse({'generation': request_generation(request)[0], 'results': results, 'next': next_url})
+
+
+@conditional_on_generation
+@method_decorator(gzip_page, name='get')
+class InstanceApi(View):
+    """
+    View provides JSON with fields of a single instance.
+
+    Parameters:
+        `fields`: Comma-separated fields to return, look at `API_FIELDS`.
+    """
+
+    def get(self, request, instance):
+        """
+        Arguments:
+            request (dict): Request data to handle.
+            instance (str): Instance`s id.
+
+        Return:
+            JSON with instance`s fields by name.
+        """
+        fields = api_fields(request)
+        if fields is None:
+            return JsonResponse({'error': 'Unknown field, allowed are: {}.'.format(', '.join(API_FIELDS))}, status=400)
+
+        result = EC2Instance.objects.filter(instance_id=instance).values(*fields).first()
+        if result is None:
+            return JsonResponse({'error': 'No instance matches the given query.'}, status=404)
+
+        return JsonResponse(result)
+
+
+@conditional_on_generation
+@method_decorator(gzip_page, name='get')
+class FleetSummaryApi(View):
+    """
+    View provides JSON with costs of the whole fleet from fleet summary of current generation.
+    """
+
+    def get(self, request):
+        """
+        Arguments:
+            request (dict): Request data to handle.
+
+        Return:
+            JSON {'generation': ..., 'instances': ..., 'all_instances_cost': ...,
+                  'all_instances_month_cost': ..., 'all_instances_month_to_date_cost': ...,
+                  'volumes_cost_by_type': ..., 'largest_volumes': ...}
+        """
+        summary = fleet_summary(request_generation(request)[0])
+
+        return JsonResponse({
+            'generation': summary['generation'],
+            'instances': len(summary['instances']),
+            'all_instances_cost': summary['all_instances_cost'],
+            'all_instances_month_cost': summary['all_instances_month_cost'],
+            'all_instances_month_to_date_cost': summary['all_instances_month_to_date_cost'],
+            'volumes_cost_by_type': summary['volumes_cost_by_type'],
+            'largest_volumes': summary['largest_volumes'],
+        })
+
+
+@method_decorator(gzip_page, name='get')
+class Export(View):
+    """
+    View streams instances or their cost history as CSV or NDJSON, memory does not depend on amount of rows.
+
+    Parameters:
+        `region`: Region of instances.
+        `state`: State of instances.
+        `since`: Earliest date (inclusive) of instances` launch or of history.
+        `until`: Latest date (inclusive) of instances` launch or of history.
+        `period`: History only, `sample` for raw samples, `hour`, `day` (default) or `month` for rollups.
+    """
+
+    def get(self, request, kind, export_format):
+        """
+        Arguments:
+            request (dict): Request data to handle.
+            kind (str): `instances` or `history`.
+            export_format (str): `csv` or `ndjson`.
+
+        Return:
+            Streaming attachment with header and rows, look at `export`.
+        """
+        try:
+            filters = {
+                'region': request.GET.get('region'),
+                'state': request.GET.get('state'),
+                'since': parse_moment(request.GET.get('since')),
+                'until': parse_moment(request.GET.get('until'), end_of_day=True),
+            }
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+
+        if kind == 'history':
+            period = request.GET.get('period', 'day')
+            if period not in PERIODS:
+                return HttpResponseBadRequest('Period should be one of: {}.'.format(', '.join(PERIODS)))
+            header, rows = history_rows(period, **filters)
+        else:
+            header, rows = instances_rows(**filters)
+
+        content_type, render = RENDERERS[export_format]
+
+        response = StreamingHttpResponse(render(header, rows), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(kind, export_format)
+
+        return response
+
+
+class LiveUpdates(View):
+    """
+    View streams Server-Sent Events with diffs of changed instances and totals, whenever a new generation of data
+    is committed, so open pages patch themselves instead of reloading, look at `live`.
+
+    Parameters:
+        `generation`: Number of generation, that page shows, `Last-Event-ID` header takes precedence.
+    """
+
+    def get(self, request):
+        """
+        Arguments:
+            request (dict): Request data to handle.
+
+        Return:
+            Stream of `generation` events, data of every one is a JSON diff.
+        """
+        try:
+            since = int(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('generation', 0))
+        except ValueError:
+            return HttpResponseBadRequest('Generation should be a number.')
+
+        response = StreamingHttpResponse(generation_events(since), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+
+        return response
+
+
+class RefreshNow(View):
+    """
+    View requests refresh of a region or a single instance out of schedule`s cycle, scheduler takes it within
+    a minute, look at `triggers`.
+
+    Parameters:
+        `region`: Region to refresh, might be omitted for known instance.
+        `instance_id`: Id of instance to refresh, the whole region is refreshed if omitted.
+        `next`: Page to redirect to after request.
+    """
+
+    def post(self, request):
+        """
+        Arguments:
+            request (dict): Request data to handle.
+
+        Return:
+            Redirect to `next` page or JSON {'request': ..., 'region': ..., 'instance_id': ...} with 202 status.
+        """
+        try:
+            refresh_request = request_refresh(request.POST.get('region'), request.POST.get('instance_id'))
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+
+        next_url = request.POST.get('next')
+        if next_url and is_safe_url(next_url, host=request.get_host()):
+            return redirect(next_url)
+
+        return JsonResponse({
+            'request': refresh_request.pk,
+            'region': refresh_request.region,
+            'instance_id': refresh_request.instance_id,
+        }, status=202)
+
+
+def bearer_token_matches(request, token):
+    """
+    Method checks, that request is authorized with `Authorization: Bearer <token>` header.
+    """
+    return constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer {}'.format(token))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class EC2Events(View):
+    """
+    Webhook receives EC-2 instance state-change events from EventBridge and requests re-collection of affected
+    instances, so their state is updated within a minute instead of the next refresh of region.
+
+    EventBridge`s API destination should send `Authorization: Bearer <EC2_EVENTS_TOKEN>` header,
+    webhook is disabled while `EC2_EVENTS_TOKEN` setting is empty.
+    """
+
+    def post(self, request):
+        """
+        Arguments:
+            request (dict): Request data to handle, body is a JSON event or list of events.
+
+        Return:
+            JSON {'requests': ...} with 202 status, amount of stored refresh requests.
+        """
+        if not settings.EC2_EVENTS_TOKEN:
+            raise Http404('Webhook is disabled.')
+
+        if not bearer_token_matches(request, settings.EC2_EVENTS_TOKEN):
+            return HttpResponseForbidden('Wrong token.')
+
+        try:
+            refresh_requests = request_state_changes_refresh(json.loads(request.body.decode('utf-8')))
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+
+        return JsonResponse({'requests': len(refresh_requests)}, status=202)
+
+
+class Metrics(View):
+    """
+    View provides metrics of clock process and of views of current web process in Prometheus text format,
+    look at `metrics.render_metrics`.
+
+    Prometheus should scrape it with `Authorization: Bearer <METRICS_TOKEN>` header, metrics are disabled while
+    `METRICS_TOKEN` setting is empty.
+    """
+
+    def get(self, request):
+        """
+        Arguments:
+            request (dict): Request data to handle.
+
+        Return:
+            Metrics in Prometheus text format.
+        """
+        if not settings.METRICS_TOKEN:
+            raise Http404('Metrics are disabled.')
+
+        if not bearer_token_matches(request, settings.METRICS_TOKEN):
+            return HttpResponseForbidden('Wrong token.')
+
+        return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
 class LoginError(View):
     """
     View render warning template, that user has bad credentials for login.
@@ -90,7 +497,12 @@ class LoginError(View):
 class AfterLoginRedirect(RedirectView):
     """
     Redirect view generate first instance, because LOGIN_URL in setting does not provide slugs as like pk or name.
+    Instances are ordered by id, so the same one is picked every time, homepage is used while there are none.
     """
     @staticmethod
     def get_redirect_url():
-        return reverse('ec2:instance', kwargs={'instance': EC2Instance.objects.all()[0].instance_id})
+        instance = EC2Instance.objects.order_by('instance_id').first()
+        if instance is None:
+            return reverse('ec2:index')
+
+        return reverse('ec2:instance', kwargs={'instance': instance.instance_id})
@@ -0,0 +1,476 @@
+"""
+Local stand-in for EC2 API and price catalog, that serves synthetic fleets to benchmarks without AWS credentials.
+
+Stand-in speaks the same EC2 Query protocol as AWS, so requests go through the whole boto3 stack: signing,
+retries, XML parsing and pagination. Region of request is taken from its signature, so every region of
+`ClientPool` might use the same endpoint. Benchmark and tests point refresh to it with `stand_in`.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import random
+import re
+from socketserver import ThreadingMixIn
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape
+
+REGIONS = (
+    'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1', 'eu-west-1', 'eu-west-2', 'eu-central-1',
+    'ap-south-1', 'ap-northeast-1', 'ap-northeast-2', 'ap-southeast-1', 'ap-southeast-2', 'sa-east-1',
+)
+INSTANCE_TYPES = (
+    't2.micro', 't2.small', 't2.medium', 't2.large', 'm4.large', 'm4.xlarge', 'm4.2xlarge', 'c4.large',
+    'c4.xlarge', 'r4.large', 'r4.xlarge', 'i3.large',
+)
+VOLUME_TYPES = ('gp2', 'gp2', 'gp2', 'st1', 'sc1', 'io1')
+STATES = ('running', 'running', 'running', 'running', 'stopped')
+STATE_CODES = {'pending': 0, 'running': 16, 'stopping': 64, 'stopped': 80}
+PAGE_SIZE = 1000
+CATALOG_TYPES = 100
+PRICE_PATH = '/pricing/linux-od.min.js'
+XMLNS = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+
+CREDENTIAL_RE = re.compile(r'Credential=([^/]+)/[^/]+/([^/]+)/')
+
+
+class SyntheticFleet(object):
+    """
+    Fleet of instances with attached volumes spread evenly across regions, that is the same for the same seed.
+
+    Arguments:
+        instances (int): Amount of instances.
+        regions (int): Amount of regions to spread instances across, at most `len(REGIONS)`.
+        volumes (int): Amount of volumes attached to every instance.
+        seed (int): Seed of random generator.
+        first_id (int): Sequence number of the first id, fleets of different accounts should not share ids.
+    """
+
+    def __init__(self, instances, regions=1, volumes=1, seed=0, first_id=1):
+        self.regions = list(REGIONS[:max(1, min(regions, len(REGIONS)))])
+        self.volumes_per_instance = volumes
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sequence = first_id - 1
+        self.instances = {region: [] for region in self.regions}
+
+        for index in range(instances):
+            self.launch(self.regions[index % len(self.regions)])
+
+    def __len__(self):
+        return sum(len(instances) for instances in self.instances.values())
+
+    def next_id(self, prefix):
+        """
+        Method provides id in AWS format, that is unique within fleet.
+        """
+        self.sequence += 1
+        return '{}-{:017x}'.format(prefix, self.sequence)
+
+    def launch(self, region):
+        """
+        Method adds a new instance with its volumes to region.
+
+        Returns:
+            instance (dict): {'InstanceId': ..., ..., 'Volumes': [{'VolumeId': ..., ...}, ...]}
+        """
+        instance_id = self.next_id('i')
+        launch_time = datetime.datetime(2017, 1, 1) + datetime.timedelta(minutes=self.random.randrange(60 * 24 * 300))
+        volumes = []
+
+        for device in range(self.volumes_per_instance):
+            volume_type = self.random.choice(VOLUME_TYPES)
+            volumes.append({
+                'VolumeId': self.next_id('vol'),
+                'VolumeType': volume_type,
+                'Size': self.random.choice((8, 16, 32, 100, 500)),
+                'Iops': self.random.choice((100, 1000, 3000)) if volume_type == 'io1' else None,
+                'Device': '/dev/sd{}'.format(chr(ord('a') + device % 26)),
+            })
+
+        instance = {
+            'InstanceId': instance_id,
+            'InstanceType': self.random.choice(INSTANCE_TYPES),
+            'State': self.random.choice(STATES),
+            'LaunchTime': launch_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'AvailabilityZone': '{}a'.format(region),
+            'Platform': 'windows' if self.random.random() < 0.1 else None,
+            'PrivateIpAddress': '10.{}.{}.{}'.format(*(self.sequence >> shift & 255 for shift in (16, 8, 0))),
+            'PublicIpAddress': '54.{}.{}.{}'.format(*(self.sequence >> shift & 255 for shift in (16, 8, 0))),
+            'VpcId': 'vpc-{:08x}'.format(self.regions.index(region)),
+            'GroupId': 'sg-{:08x}'.format(self.random.randrange(16)),
+            'Name': 'bench-{}'.format(instance_id[2:]),
+            'Volumes': volumes,
+        }
+        self.instances[region].append(instance)
+
+        return instance
+
+    def churn(self, fraction):
+        """
+        Method changes a fraction of fleet the way a working day does: a third of changed instances are stopped or
+        started, a third are terminated and as many are launched instead, the rest are resized.
+
+        Arguments:
+            fraction (float): Share of instances to change.
+
+        Returns:
+            Amount of changed instances (int).
+        """
+        with self.lock:
+            changed = 0
+
+            for region, instances in self.instances.items():
+                for instance in self.random.sample(instances, int(len(instances) * fraction)):
+                    kind = changed % 3
+                    if kind == 0:
+                        instance['State'] = 'stopped' if instance['State'] == 'running' else 'running'
+                    elif kind == 1:
+                        instances.remove(instance)
+                        self.launch(region)
+                    else:
+                        instance['InstanceType'] = self.random.choice(INSTANCE_TYPES)
+                    changed += 1
+
+            return changed
+
+    def region_instances(self, region, instances_ids=None):
+        """
+        Method provides instances of region, optionally only the ones with given ids.
+        """
+        with self.lock:
+            instances = list(self.instances.get(region, []))
+
+        if instances_ids:
+            instances = [instance for instance in instances if instance['InstanceId'] in instances_ids]
+
+        return instances
+
+    def price_catalog(self, types=CATALOG_TYPES):
+        """
+        Method builds price catalog in the format of `http://a0.awsstatic.com/pricing/1/ec2/linux-od.min.js`
+        for all `REGIONS`. Instance types of fleet are padded with made up ones up to `types` per region,
+        so catalog is about as large as the real one is.
+        """
+        instance_types = list(INSTANCE_TYPES) + [
+            'x{}.{}large'.format(index // 8, index % 8 or '') for index in range(max(types - len(INSTANCE_TYPES), 0))
+        ]
+        regions = []
+
+        for region_index, region in enumerate(REGIONS):
+            sizes = [
+                '{{size:"{}",vCPU:"2",ECU:"variable",memoryGiB:"4",storageGB:"ebsonly",'
+                'valueColumns:[{{name:"linux",prices:{{USD:"{:.4f}"}}}}]}}'.format(
+                    instance_type, 0.01 * (type_index + 1) * (1 + region_index / 10)
+                ) for type_index, instance_type in enumerate(instance_types)
+            ]
+            regions.append('{{region:"{}",instanceTypes:[{{type:"generalCurrentGen",sizes:[{}]}}]}}'.format(
+                region, ','.join(sizes)
+            ))
+
+        return (
+            'callback({vers:0.01,config:{rate:"perhr",valueColumns:["vCPU","ECU","memoryGiB","storageGB","linux"],'
+            'currencies:["USD"],regions:[' + ','.join(regions) + ']}});'
+        )
+
+
+def element(name, value):
+    """
+    Method renders XML element with escaped text, element is omitted if value is None.
+    """
+    return '' if value is None else '<{0}>{1}</{0}>'.format(name, escape(str(value)))
+
+
+def instance_xml(instance):
+    """
+    Method renders instance the way `DescribeInstances` does.
+    """
+    return ''.join([
+        '<item>',
+        element('instanceId', instance['InstanceId']),
+        element('instanceType', instance['InstanceType']),
+        element('launchTime', instance['LaunchTime']),
+        '<instanceState>', element('code', STATE_CODES[instance['State']]), element('name', instance['State']),
+        '</instanceState>',
+        '<placement>', element('availabilityZone', instance['AvailabilityZone']), element('tenancy', 'default'),
+        '</placement>',
+        element('platform', instance['Platform']),
+        element('privateIpAddress', instance['PrivateIpAddress']),
+        element('ipAddress', instance['PublicIpAddress'] if instance['State'] == 'running' else None),
+        element('vpcId', instance['VpcId']),
+        '<groupSet><item>', element('groupId', instance['GroupId']), element('groupName', 'default'),
+        '</item></groupSet>',
+        '<tagSet><item>', element('key', 'Name'), element('value', instance['Name']), '</item></tagSet>',
+        '</item>',
+    ])
+
+
+def volume_xml(instance, volume):
+    """
+    Method renders volume, that is attached to instance, the way `DescribeVolumes` does.
+    """
+    return ''.join([
+        '<item>',
+        element('volumeId', volume['VolumeId']),
+        element('size', volume['Size']),
+        element('availabilityZone', instance['AvailabilityZone']),
+        element('status', 'in-use'),
+        element('createTime', instance['LaunchTime']),
+        element('volumeType', volume['VolumeType']),
+        element('iops', volume['Iops']),
+        '<attachmentSet><item>',
+        element('volumeId', volume['VolumeId']),
+        element('instanceId', instance['InstanceId']),
+        element('device', volume['Device']),
+        element('status', 'attached'),
+        '</item></attachmentSet>',
+        '</item>',
+    ])
+
+
+def indexed_values(params, prefix):
+    """
+    Method gathers values of Query protocol`s list parameter, e.g. `InstanceId.1`, `InstanceId.2`, ...
+    """
+    return [values[0] for key, values in sorted(params.items()) if re.match(r'^{}\.\d+$'.format(prefix), key)]
+
+
+class FakeAWSHandler(BaseHTTPRequestHandler):
+    """
+    Handler answers EC2 Query API`s actions, that collector calls, and serves price catalog.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body, content_type='text/xml;charset=UTF-8', headers=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_error(self, status, code, message):
+        """
+        Method answers with an error of EC2 Query API, that boto3 raises as `ClientError` without retries.
+        """
+        self.respond(status, (
+            '<Response><Errors><Error><Code>{}</Code><Message>{}</Message></Error></Errors>'
+            '<RequestID>fake</RequestID></Response>'
+        ).format(code, escape(message)))
+
+    def do_GET(self):
+        server = self.server
+
+        if self.path != PRICE_PATH:
+            return self.respond(404, '', content_type='text/plain')
+
+        server.count('GetPriceCatalog')
+        time.sleep(server.latency)
+        etag = '"{}"'.format(server.catalog_version)
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.respond(200, server.catalog, content_type='application/javascript', headers={'ETag': etag})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = parse_qs(self.rfile.read(length).decode('utf-8'))
+        action = params.get('Action', [''])[0]
+        match = CREDENTIAL_RE.search(self.headers.get('Authorization', ''))
+        account, region = match.groups() if match else (None, None)
+        self.fleet = self.server.fleets.get(account, self.server.fleet)
+
+        self.server.count(action)
+        time.sleep(self.server.latency)
+        answer = getattr(self, 'answer_{}'.format(action), None)
+
+        if answer is None:
+            return self.respond_error(400, 'InvalidAction', action)
+
+        if account in self.server.failing_accounts:
+            return self.respond_error(401, 'AuthFailure', 'Account {} is failing.'.format(account))
+        if region in self.server.failing_regions:
+            return self.respond_error(403, 'UnauthorizedOperation', 'Region {} is failing.'.format(region))
+
+        self.respond(200, '<{0}Response xmlns="{1}"><requestId>fake</requestId>{2}</{0}Response>'.format(
+            action, XMLNS, answer(region, params)
+        ))
+
+    def page(self, items, params):
+        """
+        Method slices items by `NextToken` and `MaxResults`, that are offset and page size here.
+
+        Returns:
+            Tuple of items (list) of page and token (str) of the next page or None.
+        """
+        offset = int(params.get('NextToken', ['0'])[0])
+        size = int(params.get('MaxResults', [self.server.page_size])[0])
+        end = offset + size
+
+        return items[offset:end], str(end) if end < len(items) else None
+
+    def answer_DescribeRegions(self, region, params):
+        return '<regionInfo>{}</regionInfo>'.format(''.join(
+            '<item>{}{}</item>'.format(element('regionName', name), element('regionEndpoint', 'localhost'))
+            for name in self.fleet.regions
+        ))
+
+    def answer_DescribeInstances(self, region, params):
+        instances_ids = set(indexed_values(params, 'InstanceId'))
+        instances, next_token = self.page(self.fleet.region_instances(region, instances_ids), params)
+
+        reservations = ''.join(
+            '<item><reservationId>r-{0}</reservationId><ownerId>000000000000</ownerId>'
+            '<instancesSet>{1}</instancesSet></item>'.format(instance['InstanceId'][2:], instance_xml(instance))
+            for instance in instances
+        )
+
+        return '<reservationSet>{}</reservationSet>{}'.format(reservations, element('nextToken', next_token))
+
+    def answer_DescribeVolumes(self, region, params):
+        instances_ids = set(indexed_values(params, r'Filter\.1\.Value'))
+        attached = [
+            (instance, volume)
+            for instance in self.fleet.region_instances(region, instances_ids)
+            for volume in instance['Volumes']
+        ]
+        attached, next_token = self.page(attached, params)
+
+        return '<volumeSet>{}</volumeSet>{}'.format(
+            ''.join(volume_xml(instance, volume) for instance, volume in attached), element('nextToken', next_token)
+        )
+
+
+class FakeAWS(ThreadingMixIn, HTTPServer):
+    """
+    Server of EC2 API and price catalog on a free local port, it runs in a background thread.
+
+    Example:
+        with FakeAWS(SyntheticFleet(1000, regions=4, volumes=2)) as fake_aws:
+            ClientPool(endpoint_url=fake_aws.url).client('us-east-1').describe_instances()
+
+    Arguments:
+        fleet (SyntheticFleet): Fleet to serve.
+        page_size (int): Items per page of `DescribeInstances` and `DescribeVolumes`, unless `MaxResults` is given.
+        catalog_types (int): Instance types per region in price catalog, look at `SyntheticFleet.price_catalog`.
+        latency (float): Seconds to wait before answering every request, as a round trip to AWS takes.
+        accounts (dict): Fleets of other accounts by their names, `fleet` is one of `default` account.
+
+    Account is told by access key of request, that `stand_in` registers accounts with their names as. Accounts of
+    `failing_accounts` (set) and regions of `failing_regions` (set) answer every EC2 action with an error, as ones,
+    that refresh can not reach, do.
+    """
+    daemon_threads = True
+
+    def __init__(self, fleet, page_size=PAGE_SIZE, catalog_types=CATALOG_TYPES, latency=0.0, accounts=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeAWSHandler)
+        self.fleet = fleet
+        self.fleets = dict(accounts or {}, default=fleet)
+        self.page_size = page_size
+        self.latency = latency
+        self.failing_accounts = set()
+        self.failing_regions = set()
+        self.calls = Counter()
+        self.calls_lock = threading.Lock()
+        self.catalog_types = catalog_types
+        self.catalog = fleet.price_catalog(catalog_types)
+        self.catalog_version = 1
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    @property
+    def price_url(self):
+        return self.url + PRICE_PATH
+
+    def count(self, action):
+        with self.calls_lock:
+            self.calls[action] += 1
+
+    def reset_calls(self):
+        """
+        Method provides counts of served requests by action and starts counting over.
+        """
+        with self.calls_lock:
+            calls, self.calls = dict(self.calls), Counter()
+
+        return calls
+
+    def change_prices(self):
+        """
+        Method publishes a new version of price catalog, so it is downloaded and parsed again.
+        """
+        self.catalog = self.fleet.price_catalog(self.catalog_types)
+        self.catalog_version += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-aws', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+@contextmanager
+def stand_in(fake_aws):
+    """
+    Method points `refresh` module to stand-in of AWS and of price catalog and restores its state afterwards.
+
+    Price catalog is revalidated at every refresh, so changed catalog is downloaded and parsed in the refresh,
+    that meets it, the way it would be after cache`s TTL.
+
+    Returns:
+        Pool of AWS clients (ClientPool) with `default` account and other accounts of stand-in.
+    """
+    from aws_clients import ClientPool
+    from price_cache import PriceCatalogCache
+    from price_index import parse_price_rows
+    import refresh
+
+    state = dict(refresh.shared), refresh.REGION
+    cache_dir = tempfile.TemporaryDirectory(prefix='ec2-fake-aws-')
+
+    aws_clients = ClientPool(endpoint_url=fake_aws.url)
+    for account in sorted(fake_aws.fleets):
+        aws_clients.register_account(account, aws_access_key_id=account, aws_secret_access_key='fake')
+
+    refresh.shared['aws_clients'] = aws_clients
+    refresh.shared['price_catalogs'] = [
+        PriceCatalogCache(fake_aws.price_url, parse_price_rows, cache_dir=cache_dir.name, ttl=0)
+    ]
+    refresh.REGION = fake_aws.fleet.regions[0]
+    refresh.account_regions.clear()
+    refresh.current_price_index.update(rows_lists=None, index=None)
+
+    try:
+        yield aws_clients
+    finally:
+        refresh.shared.update(state[0])
+        refresh.REGION = state[1]
+        refresh.account_regions.clear()
+        refresh.current_price_index.update(rows_lists=None, index=None)
+        cache_dir.cleanup()
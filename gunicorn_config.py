@@ -0,0 +1,20 @@
+"""
+Gunicorn`s settings of web process.
+
+Workers are gevent ones, so every open dashboard, that waits for live updates, holds a cheap greenlet instead
+of a whole worker, look at `ec2.live`.
+"""
+
+import os
+
+worker_class = 'gevent'
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+
+
+def post_fork(server, worker):
+    """
+    Make psycopg2 yield to other greenlets, while it waits for database.
+    """
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
@@ -0,0 +1,165 @@
+"""
+On-disk cache of EC2 price catalog, that revalidates it at AWS with conditional requests.
+"""
+
+from collections import Counter
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+
+class PriceCatalogCache(object):
+    """
+    Cache keeps parsed price catalog in a gzipped JSON file next to ETag and Last-Modified of its source.
+
+    While cached copy is younger than `ttl` it is served without any network request. After that catalog is
+    revalidated with `If-None-Match`/`If-Modified-Since` headers, so unchanged catalog is neither downloaded
+    nor parsed again. If request fails or catalog parses to nothing, e.g. an error page is served with 200
+    status, last good copy is served, so instances are never priced from an empty catalog. Requests, their
+    outcomes and seconds of downloads and parsing are counted, look at `stats`.
+
+    Arguments:
+        url (str): Price catalog`s URL.
+        parser (callable): Function, that turns catalog`s text into JSON-serializable data.
+        cache_dir (str): Directory for cache files.
+        ttl (int): Seconds, during which cached copy is served without revalidation.
+        timeout (int): Seconds to wait for price catalog`s server.
+        session (requests.Session): Session with keep-alive connections, new one if omitted.
+    """
+
+    def __init__(self, url, parser, cache_dir=None, ttl=6 * 60 * 60, timeout=30, session=None):
+        self.url = url
+        self.parser = parser
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'ec2-prices')
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.entry = None
+        self.counters = Counter()
+        self.counters_lock = threading.Lock()
+
+    @property
+    def path(self):
+        """
+        Path to cache file of catalog`s URL and parser, so data of different parsers never mix.
+        """
+        key = '{}:{}'.format(self.url, getattr(self.parser, '__name__', ''))
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, '{}.json.gz'.format(name))
+
+    def load(self):
+        """
+        Method reads cached entry from memory or disk.
+
+        Returns:
+            entry (dict): {'etag': ..., 'last_modified': ..., 'fetched_at': ..., 'data': ...} or None.
+        """
+        if self.entry is None and os.path.exists(self.path):
+            try:
+                with gzip.open(self.path, 'rt', encoding='utf-8') as cache_file:
+                    self.entry = json.load(cache_file)
+            except (OSError, ValueError):
+                self.entry = None
+
+        return self.entry
+
+    def store(self, entry):
+        """
+        Method writes entry to disk atomically and keeps it in memory.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with gzip.open(os.fdopen(descriptor, 'wb'), 'wt', encoding='utf-8') as cache_file:
+            json.dump(entry, cache_file, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+        self.entry = entry
+
+    def count(self, **amounts):
+        """
+        Method adds amounts to counters.
+        """
+        with self.counters_lock:
+            self.counters.update(amounts)
+
+    def stats(self):
+        """
+        Method provides snapshot of counters.
+
+        Returns:
+            stats (dict): {'requests': ..., 'downloads': ..., 'not_modified': ..., 'failures': ...,
+                           'download_seconds': ..., 'parse_seconds': ...}
+        """
+        with self.counters_lock:
+            return dict(self.counters)
+
+    def get(self):
+        """
+        Method provides parsed price catalog, downloading and parsing it only if it changed at AWS.
+
+        Returns:
+            Parsed catalog, look at `parser`.
+
+        Raises:
+            requests.RequestException: If catalog can not be fetched and there is no cached copy.
+            ValueError: If catalog can not be parsed or has no prices and there is no cached copy.
+        """
+        entry = self.load()
+
+        if entry and time.time() - entry['fetched_at'] < self.ttl:
+            return entry['data']
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        started = time.time()
+
+        try:
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+            if response.status_code != 304:
+                response.raise_for_status()
+        except requests.RequestException:
+            self.count(requests=1, failures=1, download_seconds=time.time() - started)
+            if entry:
+                return entry['data']
+            raise
+
+        if response.status_code == 304:
+            self.count(requests=1, not_modified=1, download_seconds=time.time() - started)
+            entry['fetched_at'] = time.time()
+            self.store(entry)
+            return entry['data']
+
+        self.count(requests=1, downloads=1, download_seconds=time.time() - started)
+        started = time.time()
+
+        try:
+            data = self.parser(response.text)
+            if not data:
+                raise ValueError('Price catalog {} has no prices.'.format(self.url))
+        except ValueError:
+            self.count(failures=1)
+            if entry:
+                return entry['data']
+            raise
+        finally:
+            self.count(parse_seconds=time.time() - started)
+
+        self.store({
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+            'data': data,
+        })
+
+        return self.entry['data']
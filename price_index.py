@@ -0,0 +1,110 @@
+"""
+Index of EC2 on-demand prices with constant time lookup by region, instance type, OS and tenancy.
+"""
+
+import re
+
+DEFAULT_OS = 'linux'
+DEFAULT_TENANCY = 'shared'
+
+# Price catalog is JSONP with unquoted keys, where region object precedes its sizes, size name precedes its
+# value columns and value column`s name precedes its prices. So these four keys, met in document order,
+# are enough to build the index without turning catalog into JSON and loading the whole tree.
+TOKEN_RE = re.compile(r'(?<![\w"])"?(region|size|name|USD)"?\s*:\s*"([^"]*)"')
+
+
+class PriceIndex(object):
+    """
+    Index keeps hourly prices in a flat dictionary keyed by (region, instance type, OS, tenancy).
+
+    Catalogs of several OS (`linux-od.min.js`, `mswin-od.min.js`, ...) might be loaded into the same index,
+    OS is taken from catalog`s value columns names.
+    """
+
+    def __init__(self):
+        self.prices = {}
+
+    def __len__(self):
+        return len(self.prices)
+
+    def load(self, text, tenancy=DEFAULT_TENANCY):
+        """
+        Method parses price catalog in a single pass and adds its prices to index.
+
+        Arguments:
+            text (str): Content of price catalog.
+            tenancy (str): Tenancy, that catalog`s prices are for.
+
+        Returns:
+            Index itself (PriceIndex).
+        """
+        region = size = os_name = None
+
+        for match in TOKEN_RE.finditer(text):
+            key, value = match.groups()
+
+            if key == 'region':
+                region, size = value, None
+            elif key == 'size':
+                size, os_name = value, None
+            elif key == 'name':
+                os_name = value
+            elif region and size:
+                try:
+                    self.prices[(region, size, os_name or DEFAULT_OS, tenancy)] = float(value)
+                except ValueError:
+                    continue
+
+        return self
+
+    def rows(self):
+        """
+        Method dumps index into JSON-serializable rows [region, instance type, OS, tenancy, price].
+        """
+        return [list(key) + [price] for key, price in self.prices.items()]
+
+    @classmethod
+    def from_rows(cls, *rows_lists):
+        """
+        Method builds index from one or several lists of rows, look at `rows`.
+        """
+        index = cls()
+
+        for rows in rows_lists:
+            for region, instance_type, os_name, tenancy, price in rows:
+                index.prices[(region, instance_type, os_name, tenancy)] = price
+
+        return index
+
+    def price(self, region, instance_type, os_name=DEFAULT_OS, tenancy=DEFAULT_TENANCY, default=None):
+        """
+        Method looks hourly price up.
+
+        Falls back to shared tenancy and then to Linux price of instance type, if exact one is not known.
+
+        Arguments:
+            region (str): Region name.
+            instance_type (str): Instance type, e.g. `t2.micro`.
+            os_name (str): OS as price catalog names it, e.g. `linux` or `mswin`.
+            tenancy (str): Tenancy, e.g. `shared` or `dedicated`.
+            default (float): Value, that is returned if price is unknown.
+
+        Returns:
+            Price in dollars ($) per hour (float).
+        """
+        for key in (
+            (region, instance_type, os_name, tenancy),
+            (region, instance_type, os_name, DEFAULT_TENANCY),
+            (region, instance_type, DEFAULT_OS, DEFAULT_TENANCY),
+        ):
+            if key in self.prices:
+                return self.prices[key]
+
+        return default
+
+
+def parse_price_rows(text):
+    """
+    Method parses price catalog into index`s rows, that are suitable for `price_cache.PriceCatalogCache`.
+    """
+    return PriceIndex().load(text).rows()
@@ -0,0 +1,546 @@
+"""
+Refresh of instances` data: collection from AWS-accounts, pricing and persistence into `Instance` model.
+
+Module is imported after `django.setup()` by clock process (`server_schedule.py`) and by `refresh_instances`
+command. AWS SDK, price catalogs and NumPy are imported and set up on first refresh, so importing module is cheap.
+"""
+
+from collections import Counter
+from concurrent import futures
+from contextlib import closing, contextmanager
+import os
+import queue
+import threading
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from ec2.db import lock_writes
+from ec2.history import roll_up_history
+from ec2.persistence import InstancesStage, InstancesWriter
+
+AWS_KEY, AWS_SECRET, REGION = os.environ.get('AWS_KEY'), os.environ.get('AWS_SECRET'), os.environ.get('REGION')
+AWS_ACCOUNTS = os.environ.get('AWS_ACCOUNTS')
+PRICE_URL = 'http://a0.awsstatic.com/pricing/1/ec2/linux-od.min.js'
+PRICE_URLS = os.environ.get('PRICE_URLS', PRICE_URL).split(',')
+
+DISCOVERY_WORKERS = int(os.environ.get('DISCOVERY_WORKERS', 8))
+DISCOVERY_TIMEOUT = int(os.environ.get('DISCOVERY_TIMEOUT', 60))
+INCREMENTAL_REFRESH = os.environ.get('INCREMENTAL_REFRESH', '1') != '0'
+
+PIPELINE_BATCH_SIZE = int(os.environ.get('PIPELINE_BATCH_SIZE', 500))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 8))
+
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 10))
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', 10))
+
+HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 31))
+ACCRUAL_MAX_GAP_HOURS = float(os.environ.get('ACCRUAL_MAX_GAP_HOURS', 1))
+
+PRICE_CACHE_DIR = os.environ.get('PRICE_CACHE_DIR')
+PRICE_CACHE_TTL = int(os.environ.get('PRICE_CACHE_TTL', 6 * 60 * 60))
+PRICE_TIMEOUT = int(os.environ.get('PRICE_TIMEOUT', 30))
+
+# Stages of refresh in order: looking regions up, describing instances and volumes, getting prices, calculating
+# costs and writing rows.
+STAGES = ('discover', 'collect', 'price', 'cost', 'save')
+
+# Long-lived objects, that are built on first use and shared between refreshes.
+shared = {'aws_clients': None, 'price_catalogs': None}
+shared_lock = threading.Lock()
+
+
+def get_aws_clients():
+    """
+    Method provides pool of AWS clients with all accounts registered, look at `aws_clients.ClientPool`.
+
+    Accounts are taken from `AWS_ACCOUNTS` registry, or the single `default` one from `AWS_KEY` and `AWS_SECRET`.
+    """
+    with shared_lock:
+        if shared['aws_clients'] is None:
+            from aws_clients import ClientPool, parse_accounts
+
+            aws_clients = ClientPool(
+                max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+                max_attempts=AWS_MAX_ATTEMPTS,
+                connect_timeout=DISCOVERY_TIMEOUT,
+                read_timeout=DISCOVERY_TIMEOUT,
+            )
+            if AWS_ACCOUNTS:
+                for account_options in parse_accounts(AWS_ACCOUNTS):
+                    account_options = dict(account_options)
+                    aws_clients.register_account(account_options.pop('name'), **account_options)
+            else:
+                aws_clients.register_account('default', aws_access_key_id=AWS_KEY, aws_secret_access_key=AWS_SECRET)
+
+            shared['aws_clients'] = aws_clients
+
+        return shared['aws_clients']
+
+
+def get_price_catalogs():
+    """
+    Method provides caches of price catalogs from `PRICE_URLS`, look at `price_cache.PriceCatalogCache`.
+    """
+    with shared_lock:
+        if shared['price_catalogs'] is None:
+            from price_cache import PriceCatalogCache
+            from price_index import parse_price_rows
+
+            shared['price_catalogs'] = [
+                PriceCatalogCache(
+                    url, parse_price_rows, cache_dir=PRICE_CACHE_DIR, ttl=PRICE_CACHE_TTL, timeout=PRICE_TIMEOUT
+                ) for url in PRICE_URLS
+            ]
+
+        return shared['price_catalogs']
+
+
+def clock_stats():
+    """
+    Method provides counters of AWS calls and of price catalogs` requests since process started, objects, that
+    were not built yet, have no counters.
+
+    Returns:
+        stats (dict): {'aws': [{'account': ..., 'region': ..., 'calls': ..., 'retries': ..., 'throttles': ...}, ...],
+                       'prices': [{'url': ..., 'requests': ..., ..., 'parse_seconds': ...}, ...]}
+    """
+    aws = {}
+
+    if shared['aws_clients'] is not None:
+        for (account, region, counter), value in shared['aws_clients'].stats().items():
+            aws.setdefault((account, region), {'account': account, 'region': region})[counter] = value
+
+    prices = [
+        dict(price_catalog.stats(), url=price_catalog.url) for price_catalog in shared['price_catalogs'] or []
+    ]
+
+    return {'aws': [aws[scope] for scope in sorted(aws, key=str)], 'prices': prices}
+
+
+def aws_errors():
+    """
+    Method provides errors of AWS SDK, that mean failure of a single account or region.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    return ClientError, BotoCoreError
+
+
+account_regions = {}
+
+
+def list_regions(account='default', refresh=False):
+    """
+    Method provides names of regions, that are available to account, they are looked up once and remembered.
+
+    Arguments:
+        account (str): Name of registered account.
+        refresh (bool): Whether to look regions up again.
+
+    Returns:
+        List of region names (str).
+    """
+    if refresh or account not in account_regions:
+        client = get_aws_clients().client(REGION, account)
+        account_regions[account] = [region['RegionName'] for region in client.describe_regions()['Regions']]
+
+    return account_regions[account]
+
+
+def timed(function, *args):
+    """
+    Method calls function and measures, how long it took.
+
+    Returns:
+        Tuple of function`s result and seconds (float).
+    """
+    started = time.time()
+    result = function(*args)
+
+    return result, time.time() - started
+
+
+def region_batches(account, region, instances_ids=None):
+    """
+    Method collects records of instances with their volumes in a single region of account batch by batch.
+
+    Collection waits for a free slot of account, so no account is queried by more than its `max_concurrency` jobs.
+
+    Arguments:
+        account (str): Name of registered account.
+        region (str): Region name to look instances up in.
+        instances_ids (list): Instances` ids to collect, all instances of region are collected if omitted.
+
+    Returns:
+        Generator of lists of instances` records (dict), look at `collector.instance_record`.
+    """
+    from collector import collect_region_batches
+
+    aws_clients = get_aws_clients()
+
+    with aws_clients.slot(account):
+        for batch in collect_region_batches(
+            aws_clients.client(region, account), region, instances_ids, account, PIPELINE_BATCH_SIZE
+        ):
+            yield batch
+
+
+def put(batches_queue, stopped, item):
+    """
+    Method puts item into a bounded queue, waiting for a free place, until the queue`s consumer stops.
+
+    Returns:
+        Whether item was put (bool).
+    """
+    while not stopped.is_set():
+        try:
+            batches_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def produce_region(batches_queue, stopped, account, region, instances_ids=None):
+    """
+    Method puts batches of a single region of account into queue, look at `stream_instances`.
+
+    Every item is a tuple of scope, kind and payload: `batch` ones carry lists of records, the last one is `done`
+    with seconds, that region took, or `error` with exception, that collection failed with.
+    """
+    scope, started = (account, region), time.time()
+
+    try:
+        for batch in region_batches(account, region, instances_ids):
+            if not put(batches_queue, stopped, (scope, 'batch', batch)):
+                return
+    except Exception as error:
+        put(batches_queue, stopped, (scope, 'error', error))
+        return
+
+    put(batches_queue, stopped, (scope, 'done', time.time() - started))
+
+
+def stream_instances(regions=None, instances_ids=None, workers=None, timings=None, report=None):
+    """
+    Method collects records of instances with their volumes from regions of all registered accounts and yields
+    them batch by batch, as soon as regions answer.
+
+    Every pair of account and region is a separate job. Every account has its own pool of threads, that runs its
+    `max_concurrency` (`DISCOVERY_WORKERS` by default) jobs at once, so accounts are queried side by side. Jobs put
+    batches into a queue of `PIPELINE_QUEUE_SIZE` batches, that waits for the consumer, when it is full, so
+    amount of records in memory is bounded, however large fleet is. Jobs are given `DISCOVERY_TIMEOUT` seconds
+    to answer, regions, that fail or do not report, while queue stays empty after timeout, are skipped, batches,
+    that they already yielded, are kept.
+
+    Arguments:
+        regions (list): Region names to look instances up in, all regions of every account if omitted.
+        instances_ids (list): Instances` ids to collect, all instances of regions are collected if omitted.
+        workers (int): Jobs of every account to run at once instead of `DISCOVERY_WORKERS`, unless account sets
+            its `max_concurrency`.
+
+        timings (dict): Dictionary to put seconds into: `discover` ones, that looking regions up took, and
+            `regions` ones of every account and region, that answered, {('account', 'region'): seconds, ...}.
+        report (dict): Dictionary to put outcome into, once all batches are yielded: `scopes` (list) are tuples
+            of account and region, that answered, `complete` (bool) is whether every account and region answered.
+
+    Returns:
+        Generator of tuples of account and region (tuple) and list of instances` records (dict), look at
+        `collector.instance_record`.
+    """
+    timings = {} if timings is None else timings
+    report = {} if report is None else report
+    started = time.time()
+    aws_clients = get_aws_clients()
+    concurrency = {
+        account: aws_clients.concurrency(account, workers or DISCOVERY_WORKERS) for account in aws_clients.accounts()
+    }
+    executors = {account: futures.ThreadPoolExecutor(max_workers=concurrency[account]) for account in concurrency}
+
+    regions_futures = {account: executor.submit(list_regions, account) for account, executor in executors.items()}
+    futures.wait(regions_futures.values(), timeout=DISCOVERY_TIMEOUT)
+    timings['discover'] = time.time() - started
+
+    batches_queue, stopped = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE), threading.Event()
+    scopes, rounds, complete = [], 1, True
+
+    for account, regions_future in regions_futures.items():
+        if not regions_future.done() or regions_future.exception() is not None:
+            complete = False
+            continue
+
+        regions_of_account = [region for region in regions_future.result() if regions is None or region in regions]
+        for region in regions_of_account:
+            executors[account].submit(produce_region, batches_queue, stopped, account, region, instances_ids)
+            scopes.append((account, region))
+
+        # Jobs of account wait for its threads, so the busiest account needs several timeouts to get through them.
+        rounds = max(rounds, -(-len(regions_of_account) // concurrency[account]))
+
+    deadline = time.time() + DISCOVERY_TIMEOUT * rounds
+    pending = set(scopes)
+    timings['regions'] = {}
+
+    try:
+        while pending:
+            # Timeout only matters, while queue is empty, so time, that consumer spends on batches, is not lost.
+            try:
+                scope, kind, payload = batches_queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+
+            if kind == 'batch':
+                yield scope, payload
+                continue
+
+            pending.discard(scope)
+            if kind == 'done':
+                timings['regions'][scope] = payload
+            elif isinstance(payload, aws_errors()):
+                complete = False
+            else:
+                raise payload
+    finally:
+        stopped.set()
+        for executor in executors.values():
+            executor.shutdown(wait=False)
+
+    report['scopes'] = [scope for scope in scopes if scope in timings['regions']]
+    report['complete'] = complete and not pending
+
+
+current_price_index = {'rows_lists': None, 'index': None}
+
+
+def get_current_ec2_prices():
+    """
+    Method gets current prices of EC2 instances for all regions.
+
+    Price catalogs are served from `get_price_catalogs` caches, so they are downloaded and parsed only when they
+    change, index is rebuilt only when any of catalogs changed.
+
+    Reference:
+        http://a0.awsstatic.com/pricing/1/ec2/linux-od.min.js
+
+    Returns:
+        Index (PriceIndex) of hourly prices by region, instance type, OS and tenancy.
+    """
+    from price_index import PriceIndex
+
+    rows_lists = [price_catalog.get() for price_catalog in get_price_catalogs()]
+
+    if current_price_index['rows_lists'] is None or any(
+        rows is not cached_rows for rows, cached_rows in zip(rows_lists, current_price_index['rows_lists'])
+    ):
+        current_price_index['index'] = PriceIndex.from_rows(*rows_lists)
+        current_price_index['rows_lists'] = rows_lists
+
+    return current_price_index['index']
+
+
+def instances_data(instances, current_price, now):
+    """
+    Method prices a batch of instances` records and calculates their costs, look at `refresh_instances_info`.
+
+    Arguments:
+        instances (list): Instances` records (dict), look at `collector.instance_record`.
+        current_price (PriceIndex): Index of hourly prices, look at `get_current_ec2_prices`.
+        now (datetime): Date and time to calculate costs at.
+
+    Returns:
+        List of dictionaries with `Instance` fields` values and `volumes_data`.
+    """
+    from schedule_utils import fleet_costs
+
+    ec2_by_hour = [
+        current_price.price(
+            instance['region'], instance['instance_type'], instance['os'], instance['tenancy'], default=0.0
+        ) for instance in instances
+    ]
+    volumes = [(index, volume) for index, instance in enumerate(instances) for volume in instance['volumes']]
+
+    costs = fleet_costs(
+        ec2_by_hour,
+        [instance['launch_time'] for instance in instances],
+        [index for index, volume in volumes],
+        [volume['volume_type'] for index, volume in volumes],
+        [volume['size'] for index, volume in volumes],
+        [volume['iops'] for index, volume in volumes],
+        now=now,
+    )
+
+    volumes_data = [[] for instance in instances]
+    for (index, volume), cost in zip(volumes, costs['volume_costs']):
+        volumes_data[index].append(dict(volume, cost_by_month=float(cost)))
+
+    return [
+        {
+            'name': instance['name'],
+            'instance_id': instance['instance_id'],
+            'instance_type': instance['instance_type'],
+            'os': instance['os'],
+            'tenancy': instance['tenancy'],
+            'account': instance['account'],
+            'region': instance['region'],
+            'state': instance['state'],
+            'public_ip_address': instance['public_ip_address'],
+            'private_ip_address': instance['private_ip_address'],
+            'vpc_id': instance['vpc_id'],
+            'security_group': instance['security_group'],
+            'volumes': ', '.join([volume['volume_id'] for volume in instance['volumes']]),
+            'volumes_data': volumes_data[index],
+            'ec2_cost_by_hour': ec2_by_hour[index],
+            'volumes_cost_by_month': float(costs['volumes_cost_by_month'][index]),
+            'overall_cost_by_month': float(costs['overall_cost_by_month'][index]),
+            'overall_cost_all_time': float(costs['overall_cost_all_time'][index]),
+            'datetime_of_creation': instance['launch_time'],
+        } for index, instance in enumerate(instances)
+    ]
+
+
+persistence_lock = threading.Lock()
+
+
+@contextmanager
+def persisting():
+    """
+    Method runs writes of refreshed data within a transaction, that holds `persistence_lock` of process and write
+    lock of database, look at `ec2.db.lock_writes`, so writes of refreshes, rollups and repricing never interleave,
+    whichever processes run them.
+    """
+    with persistence_lock, transaction.atomic():
+        lock_writes()
+        yield
+
+
+def refresh_instances_info(regions=None, instances_ids=None, workers=None, dry_run=False):
+    """
+    Method create overall and billing data for each new AWS`s EC-2 instance and/or update for each instance
+    already exists. Also if existing instances are out of date, method deletes them all, look at
+    `ec2.persistence.InstancesWriter`.
+
+    Refresh is a pipeline: regions yield batches of instances, as soon as they answer, look at `stream_instances`,
+    every batch is priced, costed and staged, while the rest of regions are still collected, look at
+    `ec2.persistence.InstancesStage`. Once all regions reported, staged batches are written, instances, that are
+    gone, are deleted and a new generation of data is started within one transaction, so readers see either the
+    whole refresh or none of it. Price catalogs are loaded side by side with collection. So refresh takes about as
+    long as the slowest region, holds no more than `PIPELINE_QUEUE_SIZE` batches of `PIPELINE_BATCH_SIZE`
+    instances at once and never holds a transaction open, while AWS answers.
+
+    Instances of all registered accounts are merged into one fleet. Refresh might be limited to regions or to
+    instances in them, then only instances within these limits are deleted, if they are gone. Instances of
+    accounts and regions, that did not answer, are never deleted. Writes of refreshes, that run at the same time,
+    are serialized by `persisting`.
+
+    Fields for instance data are:
+        `name` is a name of instance.
+        `instance_id` is an id of instance.
+        `instance_type` is a type of instance.
+        `os` and `tenancy` are an OS and a tenancy of instance, that it is priced for.
+        `account` is a name of AWS-account, that instance belongs to.
+        `region` is a region of instance.
+        `state` is a state of instance.
+        `public_ip_address` is public IP address type of instance.
+        `private_ip_address` is private IP address type of instance.
+        `vpc_id` is a VPC id of instance.
+        `security_group` is a security group of instance.
+        `volumes` is a comma-separated list of ids of volumes, that instance contains.
+        `volumes_data` is a list of volumes` fields, that `Volume` model is synchronized with.
+
+        `ec2_cost_by_hour` is an EC-2 instance`s cost by hour.
+        `volumes_cost_by_month` is an instance`s volumes cost by month.
+        `overall_cost_by_month` is a total cost of volumes and EC-2 instance for current month.
+        `overall_cost_all_time` is a sum of volumes and EC-2 hours by instance from started date.
+
+        `datetime_of_creation` is a date and time of instance`s creation.
+        `datetime_of_current_ec2_info` is a date and time of last instance`s info update.
+        `datetime_of_last_seen` is a date and time of last refresh, that found instance at AWS.
+
+    Costs of new instances are estimated from their launch time, costs of known instances are accrued since
+    previous refresh, look at `ec2.accrual`. Snapshot of every instance is also written into history.
+    Unchanged instances are not rewritten unless `INCREMENTAL_REFRESH` environment variable is `0`.
+
+    Arguments:
+        regions (list): Region names to refresh, all regions if omitted.
+        instances_ids (list): Instances` ids to refresh, all instances of regions if omitted.
+        workers (int): Jobs of every account to run at once, look at `stream_instances`.
+        dry_run (bool): Whether to only show changes without writing them, all of them are written within a
+            transaction, that is rolled back.
+
+    Returns:
+        counts (dict): Amounts of inserted, updated, deleted, unchanged and changed rows and of history samples,
+            `timings` (dict) are seconds, that every stage of `STAGES` took, `collect` one lasts until the last
+            region reported, `price`, `cost` and `save` ones overlap it, `regions` (list) are seconds, that
+            collection of every account and region took, and amounts of instances in them.
+    """
+    collect_timings, report, scope_instances = {}, {}, Counter()
+    timings = {'price': 0.0, 'cost': 0.0, 'save': 0.0}
+    now = timezone.now()
+
+    price_executor = futures.ThreadPoolExecutor(max_workers=1)
+    price_future = price_executor.submit(timed, get_current_ec2_prices)
+    current_price = None
+
+    writer = InstancesWriter(INCREMENTAL_REFRESH, max_gap_hours=ACCRUAL_MAX_GAP_HOURS)
+    stage = InstancesStage()
+    started = time.time()
+
+    try:
+        with closing(stream_instances(regions, instances_ids, workers, collect_timings, report)) as stream:
+            for scope, instances in stream:
+                if current_price is None:
+                    current_price, timings['price'] = price_future.result()
+
+                batch, seconds = timed(instances_data, instances, current_price, now)
+                timings['cost'] += seconds
+                scope_instances[scope] += len(instances)
+                timings['save'] += timed(stage.add, batch)[1]
+
+        timings['discover'] = collect_timings['discover']
+        timings['collect'] = time.time() - started - timings['discover']
+
+        if current_price is None:
+            timings['price'] = price_future.result()[1]
+
+        scopes = None if regions is None and report['complete'] else report['scopes']
+        started = time.time()
+
+        with persisting():
+            for batch in stage.chunks():
+                writer.write(batch)
+
+            counts = writer.finish(scopes, instances_ids)
+
+            if dry_run:
+                counts['ids'] = writer.ids
+                transaction.set_rollback(True)
+    finally:
+        price_executor.shutdown(wait=False)
+        stage.clear()
+
+    timings['save'] += time.time() - started
+    counts['timings'] = timings
+    counts['regions'] = [
+        {'account': account, 'region': region, 'seconds': seconds, 'instances': scope_instances[(account, region)]}
+        for (account, region), seconds in sorted(collect_timings['regions'].items())
+    ]
+
+    return counts
+
+
+def refresh_region(region):
+    """
+    Method refreshes all instances of a single region, instances of region, that did not answer, are kept.
+    """
+    return refresh_instances_info([region])
+
+
+def roll_up():
+    """
+    Method rolls history up, while no refresh writes, look at `ec2.history.roll_up_history`.
+    """
+    with persisting():
+        return roll_up_history(retention_days=HISTORY_RETENTION_DAYS)
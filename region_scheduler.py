@@ -0,0 +1,170 @@
+"""
+Per-region refresh jobs, whose intervals adapt to how often instances of region change.
+"""
+
+import datetime
+import threading
+import time
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+
+JOB_PREFIX = 'refresh-region:'
+
+
+class AdaptiveRegionScheduler(object):
+    """
+    Scheduler keeps a separate interval job per region on APScheduler`s scheduler.
+
+    Every job runs at most once at a time and coalesces missed runs into one, so a slow refresh of region
+    delays its next run instead of overlapping it. After every run interval is adapted: it is halved if
+    instances of region were launched, terminated or changed, and stretched by `backoff` otherwise,
+    staying within `min_interval` and `max_interval`. Refresh requested while region`s job is running is run
+    again right after it, instead of being skipped by APScheduler.
+
+    Arguments:
+        scheduler (BaseScheduler): APScheduler`s scheduler to add jobs to.
+        refresh (callable): Function, that refreshes a region by its name and returns counts of
+            `refresh.refresh_instances_info`.
+        interval (float): Minutes between refreshes of newly added region.
+        min_interval (float): Least minutes between refreshes.
+        max_interval (float): Most minutes between refreshes.
+        backoff (float): Factor, that interval of idle region is stretched by.
+    """
+
+    def __init__(self, scheduler, refresh, interval=25, min_interval=5, max_interval=60, backoff=1.5):
+        self.scheduler = scheduler
+        self.refresh = refresh
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.intervals = {}
+        self.scheduled = {}
+        self.running = set()
+        self.pending = set()
+
+        self.scheduler.add_listener(self.job_done, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+    @staticmethod
+    def job_id(region):
+        """
+        Method provides id of region`s job.
+        """
+        return '{}{}'.format(JOB_PREFIX, region)
+
+    def add_region(self, region, interval=None, first_run=None):
+        """
+        Method adds region`s job, unless region already has one.
+
+        Arguments:
+            region (str): Region name.
+            interval (float): Minutes between refreshes, `interval` of scheduler if omitted.
+            first_run (datetime): Date and time of the first refresh, one interval from now if omitted.
+        """
+        with self.lock:
+            if region in self.intervals:
+                return
+            self.intervals[region] = interval or self.interval
+
+        job_options = {
+            'args': [region],
+            'id': self.job_id(region),
+            'name': self.job_id(region),
+            'max_instances': 1,
+            'coalesce': True,
+            'misfire_grace_time': int(self.intervals[region] * 60),
+            'replace_existing': True,
+        }
+        if first_run is not None:
+            job_options['next_run_time'] = first_run
+
+        self.scheduler.add_job(self.run, 'interval', minutes=self.intervals[region], **job_options)
+
+    def adapt(self, interval, changes):
+        """
+        Method calculates next interval of region from the current one and amount of changes in the last run.
+
+        Returns:
+            Minutes (float) between refreshes.
+        """
+        interval = interval / 2 if changes else interval * self.backoff
+
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def run(self, region):
+        """
+        Method refreshes region and reschedules its job with adapted interval.
+
+        Returns:
+            counts (dict): Counts of refresh, look at `refresh.refresh_instances_info`, `interval_seconds` is
+                an interval, that region was refreshed with, `lag_seconds` is how much later than its scheduled
+                time refresh started, None if scheduled time is not known yet, e.g. for the first refresh.
+        """
+        started = time.time()
+
+        with self.lock:
+            scheduled = self.scheduled.pop(region, None)
+            self.running.add(region)
+
+        counts = self.refresh(region)
+        changes = counts['inserted'] + counts['deleted'] + counts['changed']
+
+        with self.lock:
+            interval = self.intervals[region]
+            self.intervals[region] = self.adapt(interval, changes)
+
+        if self.intervals[region] != interval:
+            self.scheduler.reschedule_job(self.job_id(region), trigger='interval', minutes=self.intervals[region])
+
+        # Job is rescheduled once the run is over, so lag is measured from the next fire time, not from this run.
+        job = self.scheduler.get_job(self.job_id(region))
+        if job is not None and job.next_run_time is not None:
+            with self.lock:
+                self.scheduled.setdefault(region, job.next_run_time.timestamp())
+
+        counts['interval_seconds'] = interval * 60
+        counts['lag_seconds'] = max(started - scheduled, 0) if scheduled is not None else None
+
+        return counts
+
+    def job_done(self, event):
+        """
+        Method runs region again, if its refresh was requested while its job was running.
+
+        Listener is called once APScheduler counts the run as finished, so the job is not skipped as still running.
+        """
+        if not event.job_id.startswith(JOB_PREFIX):
+            return
+
+        region = event.job_id[len(JOB_PREFIX):]
+
+        with self.lock:
+            self.running.discard(region)
+            if region not in self.pending:
+                return
+            self.pending.discard(region)
+
+        self.run_now(region)
+
+    def run_now(self, region):
+        """
+        Method moves the next refresh of region to now, out of its cycle.
+
+        Refresh is still run by region`s job, so it never overlaps the scheduled one. If the job is running, refresh
+        is queued to follow it, look at `job_done`. Region without job is added.
+        """
+        with self.lock:
+            if region in self.running:
+                self.pending.add(region)
+                return
+
+        now = datetime.datetime.now(self.scheduler.timezone)
+
+        if region not in self.intervals:
+            self.add_region(region, first_run=now)
+        else:
+            self.scheduler.modify_job(self.job_id(region), next_run_time=now)
+
+        with self.lock:
+            self.scheduled[region] = now.timestamp()
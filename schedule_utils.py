@@ -1,9 +1,143 @@
 """
 Scheduler`s helpers, oriented on calculating AWS`s using cost.
+
+Costs of the whole fleet are calculated by batch functions in a single vectorized pass against one reference
+datetime, scalar functions are thin wrappers over them. Months are counted in current time zone, hours between
+datetimes in UTC, naive datetimes are taken as ones in current time zone.
 """
 
 from calendar import monthrange
-import datetime
+
+from django.utils import timezone
+import numpy as np
+
+VOLUME_COEFFICIENTS = {'gp2': 0.10, 'st1': 0.045, 'sc1': 0.025}
+
+
+def aware(moment):
+    """
+    Method makes naive datetime aware in current time zone, aware one is returned as it is.
+    """
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def utc_datetime64(moments):
+    """
+    Method converts datetimes into an array of UTC ones, that numpy counts hours between.
+    """
+    return np.array([timezone.make_naive(aware(moment), timezone.utc) for moment in moments], dtype='datetime64[us]')
+
+
+def batch_volume_cost(volume_types, sizes, iops):
+    """
+    Method calculate costs of volumes by types and sizes.
+
+    Arguments:
+        volume_types (sequence): Volumes` types.
+        sizes (sequence): Volumes` sizes.
+        iops (sequence): Volumes` iops counts, might contain None for types without provisioned iops.
+
+    Reference:
+        https://aws.amazon.com/ebs/pricing
+
+    Return:
+        Array of floats, that equal volumes` costs in dollars ($), NaN for unknown volume types.
+    """
+    volume_types = np.asarray(volume_types, dtype=object)
+    sizes = np.asarray(sizes, dtype=float)
+    iops = np.array([value or 0 for value in iops], dtype=float)
+
+    coefficients = np.array([VOLUME_COEFFICIENTS.get(volume_type, np.nan) for volume_type in volume_types])
+    costs = coefficients * sizes * 1024 * 12 / (24 * 30)
+
+    io1 = volume_types == 'io1'
+    costs[io1] = 0.10 * iops[io1] * 1000 * 30 / 30
+
+    return costs
+
+
+def batch_total_month_cost(volumes_totals, ec2_by_hour, now=None):
+    """
+    Method calculate total costs of volumes and EC-2 instances for current month.
+
+    Arguments:
+        volumes_totals (sequence): Amounts of all volumes cost by instance.
+        ec2_by_hour (sequence): Instances` costs by one hour.
+        now (datetime): Reference date and time, now if omitted.
+
+    Return:
+        Array of floats, that equal month total instances` costs in dollars ($).
+    """
+    now = timezone.localtime(aware(now or timezone.now()))
+
+    volume_cost_by_day = np.asarray(volumes_totals, dtype=float) / 30
+    instance_cost_by_day = np.asarray(ec2_by_hour, dtype=float) * 24
+
+    days_in_month = monthrange(now.year, now.month)
+    days_have_passed = days_in_month[1] - (days_in_month[1] - now.day)
+
+    return np.round(days_have_passed * (instance_cost_by_day + volume_cost_by_day), 2)
+
+
+def batch_overall_instance_cost(month_volumes_costs, ec2_by_hour, created_dates, now=None):
+    """
+    Method provides multiplication of volumes and EC-2 hours by instances from started dates.
+
+    Arguments:
+        month_volumes_costs (sequence): Month volumes counts by instance.
+        ec2_by_hour (sequence): Instances` costs by one hour.
+        created_dates (sequence): Datetimes of instances` creation.
+        now (datetime): Reference date and time, now if omitted.
+
+    Return:
+        Array of floats, that equal overall instances` costs from started dates in dollars ($).
+    """
+    now = now or timezone.now()
+
+    days = (utc_datetime64([now])[0] - utc_datetime64(created_dates)) // np.timedelta64(1, 'D')
+
+    volume_cost_by_hour = np.asarray(month_volumes_costs, dtype=float) / 30 / 24
+    total_hours = days.astype(float) * 24
+
+    return np.round(total_hours * (volume_cost_by_hour + np.asarray(ec2_by_hour, dtype=float)), 2)
+
+
+def fleet_costs(ec2_by_hour, created_dates, volume_owners, volume_types, sizes, iops, now=None):
+    """
+    Method calculate volumes, month and overall costs of the whole fleet against one reference datetime.
+
+    Prices might be replaced with hypothetical ones to see, what fleet would cost with them.
+
+    Arguments:
+        ec2_by_hour (sequence): Instances` costs by one hour.
+        created_dates (sequence): Datetimes of instances` creation.
+        volume_owners (sequence): Index of instance in `ec2_by_hour`, that each volume is attached to.
+        volume_types (sequence): Volumes` types.
+        sizes (sequence): Volumes` sizes.
+        iops (sequence): Volumes` iops counts.
+        now (datetime): Reference date and time, now if omitted.
+
+    Return:
+        costs (dict): {'volume_costs': ...,
+                       'volumes_cost_by_month': ...,
+                       'overall_cost_by_month': ...,
+                       'overall_cost_all_time': ...}
+        `volume_costs` is an array of floats in dollars ($) by volume, the rest are ones by instance.
+        Volumes of unknown types cost nothing.
+    """
+    now = now or timezone.now()
+
+    volumes_costs = np.nan_to_num(batch_volume_cost(volume_types, sizes, iops))
+    month_volumes_costs = np.bincount(
+        np.asarray(volume_owners, dtype=int), weights=volumes_costs, minlength=len(ec2_by_hour)
+    ).astype(float)
+
+    return {
+        'volume_costs': np.round(volumes_costs, 2),
+        'volumes_cost_by_month': np.round(month_volumes_costs, 2),
+        'overall_cost_by_month': batch_total_month_cost(month_volumes_costs, ec2_by_hour, now),
+        'overall_cost_all_time': batch_overall_instance_cost(month_volumes_costs, ec2_by_hour, created_dates, now),
+    }
 
 
 def volume_cost(volume_type, size, iops=None):
@@ -19,40 +153,29 @@ def volume_cost(volume_type, size, iops=None):
         https://aws.amazon.com/ebs/pricing
 
     Return:
-        Float value, that equals total instance`s volume cost in dollars ($).
+        Float value, that equals total instance`s volume cost in dollars ($), None for unknown volume type.
     """
-    coefficients = {'gp2': 0.10, 'st1': 0.045, 'sc1': 0.025}
+    cost = batch_volume_cost([volume_type], [size], [iops])[0]
 
-    if volume_type in ('gp2', 'st1', 'sc1'):
-        return coefficients[volume_type] * size * 1024 * 12 / (24 * 30)
+    return None if np.isnan(cost) else float(cost)
 
-    if volume_type == 'io1':
-        return 0.10 * iops * 1000 * 30 / 30
 
-
-def total_month_cost(volumes_total, ec2_by_hour):
+def total_month_cost(volumes_total, ec2_by_hour, now=None):
     """
     Method calculate total cost of volumes and EC-2 instance for current month.
 
     Arguments:
         volumes_total (float): Amount of all volumes cost by instance.
         ec2_by_hour (float): Instance`s cost by one hour.
+        now (datetime): Reference date and time, now if omitted.
 
     Return:
         Float value, that equals month total instance`s cost in dollars ($).
     """
-    volume_cost_by_day = volumes_total / 30
-    instance_cost_by_day = ec2_by_hour * 24
-    now = datetime.datetime.now()
-
-    days_in_month = monthrange(now.year, now.month)
-    days_have_passed = days_in_month[1] - (days_in_month[1] - now.day)
-    month_cost = days_have_passed * (instance_cost_by_day + volume_cost_by_day)
+    return float(batch_total_month_cost([volumes_total], [ec2_by_hour], now)[0])
 
-    return round(month_cost, 2)
 
-
-def overall_instance_cost(month_volumes_cost, ec2_by_hour, created_date):
+def overall_instance_cost(month_volumes_cost, ec2_by_hour, created_date, now=None):
     """
     Method provides multiplication of volumes and EC-2 hours by instance from started date.
 
@@ -60,13 +183,9 @@ def overall_instance_cost(month_volumes_cost, ec2_by_hour, created_date):
         month_volumes_cost (float): Month volumes count by instance.
         ec2_by_hour (float): Instance`s cost by one hour.
         created_date (datetime): Datetime of instance`s creation.
+        now (datetime): Reference date and time, now if omitted.
 
     Return:
         Float value, that equals overall instance`s cost from started date in dollars ($).
     """
-    created_date += datetime.timedelta(hours=2)
-    volume_cost_by_hour = month_volumes_cost / 30 / 24
-    total_hours = (datetime.datetime.now() - created_date.replace(tzinfo=None)).days * 24
-    instance_all_time_cost = total_hours * (volume_cost_by_hour + ec2_by_hour)
-
-    return round(instance_all_time_cost, 2)
+    return float(batch_overall_instance_cost([month_volumes_cost], [ec2_by_hour], [created_date], now)[0])
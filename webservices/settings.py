@@ -41,6 +41,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'ec2.metrics.ViewMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,6 +95,12 @@ LOGOUT_URL = 'logout'
 LOGIN_REDIRECT_URL = '/after_login_redirect/'
 SOCIAL_AUTH_LOGIN_ERROR_URL = '/login_error/'
 
+# Shared secret of EC-2 state-change events` webhook, webhook is disabled if empty.
+EC2_EVENTS_TOKEN = os.environ.get('EC2_EVENTS_TOKEN')
+
+# Token, that Prometheus scrapes metrics with, metrics are disabled if empty.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 WSGI_APPLICATION = 'webservices.wsgi.application'
 
 
@@ -139,6 +146,18 @@ USE_TZ = True
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+# SQLite waits for a lock that long instead of failing with `database is locked`, look at `ec2.db`.
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20))
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).setdefault('timeout', SQLITE_BUSY_TIMEOUT)
+
+# Dashboard reads from read replica at $DATABASE_REPLICA_URL, if it is set, tests read from primary instead.
+if os.environ.get('DATABASE_REPLICA_URL'):
+    DATABASES['replica'] = dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'], conn_max_age=500)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['ec2.db.PrimaryReplicaRouter']
+
 # Honor the 'X-Forwarded-Proto' header for request.is_secure()
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 